@@ -88,6 +88,18 @@ def getDefaultConfigObj():
     maxdownloadspeed_kib = 0
     # wether to use forking to optimize network connectivity:
     workerforking = True
+    # wether to use threads instead of forking where this is safe (e.g. probing clones):
+    workerthreading = True
+    # the number of long-lived worker processes used for forking, and the number of
+    # tasks after which a worker process is replaced:
+    workerprocesses = 6
+    workerprocesstasks = 200
+    # how to store the metadata of a resource: "record" (all properties in a single file),
+    # "directory" (one file per property, as used by older versions) or "sqlite" (all
+    # resources in a single data base, convert existing metadata with scripts/convertMetadata.py)
+    metadatastore = record
+    # keep an index of the resources in the repository (for status tools, quotas etc.)
+    repositoryindex = True
 
     [presenter]
     # presenter provides priviledged DAV support on localhost (=> Finder) 
@@ -109,9 +121,18 @@ def getDefaultConfigObj():
     initialsleep = 1 # it's nice to be fast on the first traversal
     # don't sleep longer than this (in seconds) between resource inspections
     maxsleeptime = 3600
-    # try to make a complete traversal take about this long 
-    # (use a long time for low resource usage, a short one for tight synchronization)
-    treetraversaltime = 86400 # we want a tree traversal to take about one day after the initial sync
+    # inspect every resource at least this often, resources that change or lack clones are 
+    # inspected more often (use a long time for low resource usage, a short one for tight synchronization)
+    treetraversaltime = 86400
+    # validation results are cached as long as a resource doesn't change, every this many
+    # seconds a resource is validated without the cache to detect corrupted contents (0 disables the cache)
+    deepscrubinterval = 604800
+    # resources with fewer (distinct) good clones on other nodes than this are inspected first, and more often
+    replicationtarget = 2
+    # inspect up to this many resources at once (1 inspects one resource at a time)
+    maxinspections = 8
+    # inspect up to this many resources at once that are cloned on the same node
+    maxinspectionsperpeer = 2
     # the default name of this node with which it will advertise itself
     # to remote nodes. if you have a valid host name (DNS entry), use it here:
     nodename = unknown.invalid
@@ -148,6 +169,11 @@ def _configspec_lines():
     desktopnotification = boolean(default=True)
     maxdownloadspeed_kib = integer(min=0,default=0)
     workerforking = boolean(default=True)
+    workerthreading = boolean(default=True)
+    workerprocesses = integer(min=1, default=6)
+    workerprocesstasks = integer(min=1, default=200)
+    metadatastore = option('record', 'directory', 'sqlite', default='record')
+    repositoryindex = boolean(default=True)
     
     [presenter]
     enable = boolean(default=True)
@@ -164,6 +190,10 @@ def _configspec_lines():
     initialsleep = integer(min=0)
     treetraversaltime = integer(min=600)
     maxsleeptime = integer(min=2)
+    deepscrubinterval = integer(min=0, default=604800)
+    replicationtarget = integer(min=1, default=2)
+    maxinspections = integer(min=1, default=8)
+    maxinspectionsperpeer = integer(min=1, default=2)
     nodename = string
 
     [gui]
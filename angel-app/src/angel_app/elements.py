@@ -167,3 +167,66 @@ class ForceLocalCache (WebDAVTextElement):
     for now.
     """
     name = "forceLocalCache"
+
+
+class ByteRange (WebDAVTextElement):
+    """
+    A range of bytes of the contents of a file, as "first-last", where both
+    offsets are inclusive (as in http range requests).
+    """
+    name = "byteRange"
+
+class Digest (WebDAVTextElement):
+    """
+    The hex digest of (a range of) the contents of a file.
+    """
+    name = "digest"
+
+class RangeDigest (WebDAVElement):
+    """
+    The digest of a range of bytes of the contents of a file.
+    """
+    name = "rangeDigest"
+
+    allowed_children = {
+        (dav_namespace, "byteRange"): (1, 1),
+        (dav_namespace, "digest"): (1, 1),
+        }
+
+class RangeDigestReport (WebDAVElement):
+    """
+    Body of a REPORT request asking for the digests of a list of byte ranges 
+    of a file, as well as of the corresponding response.
+    """
+    name = "rangeDigestReport"
+
+    allowed_children = {
+        (dav_namespace, "byteRange"): (0, None),
+        (dav_namespace, "rangeDigest"): (0, None),
+        }
+
+class BlockSize (WebDAVTextElement):
+    """
+    The size (in bytes) of the blocks of a block hash manifest.
+    """
+    name = "blockSize"
+
+class BlockHashes (WebDAVElement):
+    """
+    The hex digests of the consecutive blocks of the contents of a file, 
+    i.e. the digest of the bytes n * blockSize to (n + 1) * blockSize - 1 
+    is found in the n-th digest child. This allows for verifying any block
+    of the contents on its own.
+    """
+    name = "blockHashes"
+
+    # the block size is required in a manifest, but an empty element is needed
+    # to request the property
+    allowed_children = {
+        (dav_namespace, "blockSize"): (0, 1),
+        (dav_namespace, "digest"): (0, None),
+        }
+
+# these keys are signed in addition to the signedKeys, if they are present. 
+# They are optional, because resources signed by older versions don't have them.
+optionalSignedKeys = [BlockHashes]
@@ -26,7 +26,8 @@ def bufferedReadLoop(readCall, blocksize, totalsize, callbacks):
     """
     bytesread = 0
     while bytesread < totalsize:
-        buf = readCall(blocksize)
+        # never read beyond totalsize, e.g. when reading a range of a file
+        buf = readCall(min(blocksize, totalsize - bytesread))
         if len(buf) == 0:
             log.warn("Unexpected EOF after %s bytes, expected total %s bytes. Remote disconnect?", bytesread, totalsize)
             break
@@ -0,0 +1,375 @@
+"""
+Asynchronous inspection of resources, on the Twisted reactor.
+
+This is the counterpart of update.updateResource and client.inspectResource, using
+resource.remote.asyncClone rather than the blocking Clone methods. The conversations
+with the peers (probing, fetching metadata, validation by range digests, discovery of
+clones, announcements) all happen in the reactor thread, so a single process can keep
+many of them going at once, instead of one thread per conversation.
+
+The rest is left to the blocking code, in the reactor's thread pool:
+
+ - the transfer of contents (update.updateResourceFromClones)
+ - the work on the local file system after the transfer: storing the clones, removing
+   unreferenced children, validating (hashing) and indexing the resource
+ - DNS lookups (collect.distinctClones)
+
+The same resource is never worked on by two threads at once: the reactor thread waits
+for the result before going on with that resource.
+"""
+
+import time
+from itertools import chain
+from logging import getLogger
+
+from twisted.internet import defer
+from twisted.internet import threads
+
+from angel_app.config import config
+from angel_app.maintainer import collect
+from angel_app.maintainer import update
+from angel_app.maintainer.client import getChildren
+from angel_app.resource.local.repositoryIndex import indexResource
+from angel_app.resource.remote import asyncClone
+from angel_app.resource.remote import exceptions as cloneExceptions
+
+log = getLogger(__name__)
+
+AngelConfig = config.getConfig()
+
+# the maximum number of resources inspected at a time by inspectTree()
+MAX_IN_FLIGHT = 64
+
+def distinctClones(clones):
+    """
+    @see collect.distinctClones
+    @return a Deferred firing with the distinct clones (the DNS lookups are done in a thread)
+    """
+    return threads.deferToThread(collect.distinctClones, list(clones))
+
+def accessible(clone):
+    """
+    @see collect.accessible
+    @return a Deferred firing with a tuple of (Clone, bool)
+    """
+    if clone.prefetched is not None and time.time() - clone.prefetched < collect.PREFETCH_MAX_AGE:
+        # the clone was listed (along with its properties) by its parent just now
+        return defer.succeed((clone, True))
+
+    def probed(probe):
+        if not probe.reachable:
+            log.debug("clone %r not reachable, ignoring", clone)
+            return (probe.clone, False)
+        if not probe.exists:
+            log.debug("resource %r not found on host %r", probe.clone.path, probe.clone.host)
+            return (probe.clone, False)
+        return (probe.clone, True)
+    return asyncClone.probe(clone).addCallback(probed)
+
+class ValidateClone(collect.ValidateClone):
+    """
+    The asynchronous counterpart of collect.ValidateClone: calling it returns a Deferred
+    firing with a boolean, indicating if the clone is acceptable.
+    """
+    def __call__(self, clone):
+        validating = asyncClone.fetchProperties(clone)
+        validating.addCallback(self._validate)
+        return validating.addErrback(self._notAcceptable, clone)
+
+    def _validate(self, clone):
+        """
+        Validate the clone, once its properties are in the cache (so that no blocking
+        requests are made in the reactor thread).
+        """
+        if self._doByteRangeValidation:
+            return self._acceptableChunk(clone)
+        elif not collect.isRemoteCollection(clone):
+            return self._acceptableMetaData(clone)
+        else:
+            # all the properties are in the cache, no further requests are needed
+            return collect.acceptable(clone, self.publicKeyString, self.resourceID)
+
+    def _acceptableChunk(self, clone):
+        """
+        @see collect.acceptableChunk
+        """
+        if clone.resourceID() != self.resourceID or clone.publicKeyString() != self.publicKeyString:
+            # an invalid clone
+            return False
+        size = self.lresource.contentLength()
+        if size == 0:
+            return True
+        chunks = collect.randomChunks(size)
+        def gotDigests(remotedigests):
+            if remotedigests is None:
+                return asyncClone.getChunkHash(clone, *chunks[0]).addCallback(compare, chunks[:1])
+            return compare(remotedigests, chunks)
+        def compare(remotedigests, chunks):
+            if None in remotedigests:
+                log.info("remote clone %r unreachable during byte range validation", clone)
+                return False
+            # hashing the local chunks reads the file, so it's done in a thread
+            return threads.deferToThread(collect.chunksMatch, self.lresource, clone, chunks, remotedigests)
+        return asyncClone.getChunkHashes(clone, chunks).addCallback(gotDigests)
+
+    def _acceptableMetaData(self, clone):
+        """
+        @see collect.acceptableMetaData
+        """
+        if not collect.matchesMetaData(clone, self.publicKeyString, self.resourceID):
+            return False
+        blocks = collect.randomBlocks(clone)
+        if blocks is None:
+            return True
+        return asyncClone.getChunkHashes(clone, blocks[0]).addCallback(
+                    lambda remotedigests: collect.blocksMatch(clone, blocks, remotedigests))
+
+    def _notAcceptable(self, failure, clone):
+        failure.trap(cloneExceptions.BaseCloneError)
+        log.info("Clone %s not acceptable(): %s", clone.toURI(), failure.getErrorMessage())
+        return False
+
+def basicCloneChecks(toVisit, validate):
+    """
+    @see collect.basicCloneChecks
+    @return a Deferred firing with a dictionary with clone as key, and dictionaries with
+        keys 'accessible' and 'valid'
+    """
+    resultMap = {}
+    def checkedAccessibility(results):
+        toValidate = []
+        for (cc, (success, result)) in zip(toVisit, results):
+            if not success:
+                log.warn("error in accessibility checks of %r:\n%s", cc, result.getTraceback())
+                result = (cc, False)
+            (clone, acc) = result
+            if clone not in resultMap: # mark redirects as seen
+                resultMap[clone] = { 'accessible': acc, 'valid': False } # valid: default to false
+            if acc and clone not in toValidate:
+                toValidate.append(clone)
+        validating = defer.DeferredList([validate(cc) for cc in toValidate], consumeErrors = True)
+        return validating.addCallback(validated, toValidate)
+    def validated(results, toValidate):
+        for (cc, (success, result)) in zip(toValidate, results):
+            if not success:
+                log.warn("error in validation of %r:\n%s", cc, result.getTraceback())
+            elif result:
+                resultMap[cc]['valid'] = True
+        return resultMap
+    checking = defer.DeferredList([accessible(cc) for cc in toVisit], consumeErrors = True)
+    return checking.addCallback(checkedAccessibility)
+
+def cloneListsOf(clones):
+    """
+    @see asyncClone.cloneList
+    @return a Deferred firing with a dictionary mapping each of the clones to its clone list,
+        without the clones for which that failed
+    """
+    clones = list(clones)
+    def listed(results):
+        cloneListMap = {}
+        for (cc, (success, result)) in zip(clones, results):
+            if success:
+                cloneListMap[cc] = result
+            else:
+                log.warn("error listing the clones of %r:\n%s", cc, result.getTraceback())
+        return cloneListMap
+    listing = defer.DeferredList([asyncClone.cloneList(cc) for cc in clones], consumeErrors = True)
+    return listing.addCallback(listed)
+
+def clonesFor(lresource, cloneSeedList, publicKeyString, resourceID):
+    """
+    @see collect.clonesFor
+    @return a Deferred firing with a list of tuples (clone, accessible, valid)
+    """
+    validate = ValidateClone(lresource, publicKeyString, resourceID)
+    # before visiting clones, get rid of duplicate junk:
+    wait = defer.waitForDeferred(distinctClones(cloneSeedList))
+    yield wait
+    toVisit = wait.getResult()
+
+    visited = []
+    checked = []
+    while len(toVisit) > 0:
+        wait = defer.waitForDeferred(basicCloneChecks(toVisit, validate))
+        yield wait
+        resultMap = wait.getResult()
+        toVisit = []
+        for cc in resultMap:
+            visited.append(cc)
+            checked.append((cc, resultMap[cc]['accessible'], resultMap[cc]['valid']))
+        # discover new clones based on valid clones:
+        validClones = [cc for cc in resultMap if resultMap[cc]['valid']]
+        if len(validClones) > 0:
+            wait = defer.waitForDeferred(cloneListsOf(validClones))
+            yield wait
+            discovered = chain(*wait.getResult().values())
+            wait = defer.waitForDeferred(distinctClones(discovered))
+            yield wait
+            for ctocheck in wait.getResult():
+                if ctocheck not in visited and ctocheck not in toVisit:
+                    log.debug("discovered new clone: %r", ctocheck)
+                    toVisit.append(ctocheck)
+    yield checked
+clonesFor = defer.deferredGenerator(clonesFor)
+
+def iterateClones(lresource, cloneSeedList, publicKeyString, resourceID):
+    """
+    @see collect.iterateClones
+    @return a Deferred firing with the collect.CloneLists
+    """
+    checking = clonesFor(lresource, cloneSeedList, publicKeyString, resourceID)
+    return checking.addCallback(lambda checked: collect.cloneListsFrom(lresource, checked))
+
+def prefetchChildClones(cloneList):
+    """
+    @see update.prefetchChildClones
+    @return a Deferred firing with the dictionary of prefetched child clones
+    """
+    def prefetched(results):
+        prefetchedClones = {}
+        for (cc, (success, result)) in zip(cloneList, results):
+            if not success:
+                log.debug("prefetching children of %r failed: %s", cc, result.getErrorMessage())
+                continue
+            for child in result:
+                prefetchedClones[update.prefetchKey(child)] = child
+        return prefetchedClones
+    prefetching = defer.DeferredList([asyncClone.prefetchChildren(cc) for cc in cloneList], consumeErrors = True)
+    return prefetching.addCallback(prefetched)
+
+def discoverBroadCastClones(lclone, cloneList):
+    """
+    @see update.discoverBroadCastClones
+    @return a Deferred firing with the clones that do not know about lclone
+    """
+    def listed(cloneListMap):
+        return distinctClones([cc for cc in cloneListMap if lclone not in cloneListMap[cc]])
+    return cloneListsOf(cloneList).addCallback(listed)
+
+def broadCastAddressToClones(localResource, targetClones):
+    """
+    @see sync.broadCastAddressToClones
+    @return a Deferred firing once the local clone has been announced to the target clones
+    """
+    if not AngelConfig.getboolean("provider", "enable"):
+        return defer.succeed(None)
+    return defer.DeferredList([asyncClone.announce(cc, localResource) for cc in targetClones])
+
+def storeClones(lresource, cloneLists, deepScrub):
+    """
+    Store the clones found, remove the unreferenced children, validate the resource and
+    index it if it's valid, see update.updateResource. This works on the local file system
+    (and hashes the contents), so it's run in a thread.
+    
+    @return whether the resource is valid
+    """
+    update.storeClones(lresource, cloneLists.good, cloneLists.old + cloneLists.unreachable)
+    update.removeUnreferencedChildren(lresource)
+    if not lresource.validate(deepScrub):
+        return False
+    indexResource(lresource, time.time())
+    return True
+
+def updateResource(lresource, prefetchedClones = None, deepScrub = False):
+    """
+    @see update.updateResource
+    @return a Deferred firing with the tuple (isValid, newGoodClones, prefetchedChildClones, cloneLists)
+    """
+    (thisClones, inheritedClones) = update.discoverSeedClones(lresource, prefetchedClones)
+    wait = defer.waitForDeferred(iterateClones(
+                      lresource,
+                      thisClones + inheritedClones,
+                      update.discoverPublicKey(lresource),
+                      update.discoverResourceID(lresource)))
+    yield wait
+    cloneLists = wait.getResult()
+
+    if cloneLists.good == []:
+        log.info("no good clones found for %s", lresource.fp.path)
+    else:
+        wait = defer.waitForDeferred(threads.deferToThread(
+                      update.updateResourceFromClones, lresource, cloneLists.good, cloneLists.bad))
+        yield wait
+        wait.getResult()
+        cloneLists.good = [cc for cc in cloneLists.good if cc not in cloneLists.bad]
+
+    if not lresource.exists():
+        log.warn("update did not create local resource for %s", lresource.fp.path)
+        yield (False, [], {}, cloneLists)
+        return
+
+    wait = defer.waitForDeferred(threads.deferToThread(storeClones, lresource, cloneLists, deepScrub))
+    yield wait
+    if not wait.getResult():
+        log.warn("Resource was not valid after update: %s", lresource.fp.path)
+        yield (False, [], {}, cloneLists)
+        return
+
+    log.debug("lresource is valid: %s, collecting clones for broadcast...", lresource)
+    wait = defer.waitForDeferred(discoverBroadCastClones(lresource.makeClone(),
+                      chain(cloneLists.good, cloneLists.old, cloneLists.bad)))
+    yield wait
+    broadcastClones = wait.getResult()
+    prefetchedChildClones = {}
+    if lresource.isCollection():
+        wait = defer.waitForDeferred(prefetchChildClones(cloneLists.good + cloneLists.old))
+        yield wait
+        prefetchedChildClones = wait.getResult()
+    yield (True, broadcastClones, prefetchedChildClones, cloneLists)
+updateResource = defer.deferredGenerator(updateResource)
+
+def inspectResource(af, prefetchedClones = None, deepScrub = False):
+    """
+    @see client.inspectResourceWithPrefetch
+    @return a Deferred firing with the tuple (success, prefetchedChildClones, isValid, cloneLists)
+    """
+    log.info("inspecting resource: %s", af.fp.path)
+    def updated((isValid, broadcastClones, prefetchedChildClones, cloneLists)):
+        announcing = defer.succeed(None)
+        if isValid:
+            announcing = broadCastAddressToClones(af, broadcastClones)
+        return announcing.addCallback(lambda dummy: (True, prefetchedChildClones, isValid, cloneLists))
+    def failed(failure):
+        log.error("Resource inspection failed for resource: %s\n%s", af.fp.path, failure.getTraceback())
+        return (False, None, False, None)
+    return updateResource(af, prefetchedClones, deepScrub).addCallbacks(updated, failed)
+
+def inspectTree(root, maxInFlight = MAX_IN_FLIGHT):
+    """
+    Inspect the resource and, if it's valid, all resources below it, with at most maxInFlight
+    inspections at a time. Children are inspected once their parent has been inspected.
+
+    @param root: a ResourceHandle
+    @return a Deferred firing with the number of resources inspected successfully
+    """
+    semaphore = defer.DeferredSemaphore(maxInFlight)
+    finished = defer.Deferred()
+    # the number of inspections submitted but not done, and the number of successful ones
+    counts = {"outstanding" : 0, "inspected" : 0}
+
+    def inspectHandle(resource, prefetchedClones):
+        return inspectResource(resource.basic(), prefetchedClones)
+
+    def submit(resource, prefetchedClones):
+        counts["outstanding"] += 1
+        inspecting = semaphore.run(inspectHandle, resource, prefetchedClones)
+        inspecting.addCallback(inspected, resource)
+        inspecting.addErrback(lambda failure: log.error("inspection of %s failed:\n%s",
+                                                        resource.fp.path, failure.getTraceback()))
+        inspecting.addCallback(done)
+
+    def inspected((success, prefetchedChildClones, dummyisValid, dummycloneLists), resource):
+        if success:
+            counts["inspected"] += 1
+            for child in getChildren(resource):
+                submit(child, prefetchedChildClones)
+
+    def done(dummy):
+        counts["outstanding"] -= 1
+        if counts["outstanding"] == 0:
+            log.info("inspected %d resources below %s", counts["inspected"], root.fp.path)
+            finished.callback(counts["inspected"])
+
+    submit(root, None)
+    return finished
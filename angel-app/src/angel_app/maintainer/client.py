@@ -5,36 +5,69 @@ import time
 import random
 from logging import getLogger
 
+from angel_app import worker
 from angel_app.config import config
 from angel_app.graph import graphWalker
+from angel_app.maintainer import collect
+from angel_app.maintainer.inspector import Inspector
+from angel_app.maintainer.inspector import peersOf
 from angel_app.maintainer import sync
 from angel_app.maintainer import update
+from angel_app.maintainer.schedule import Replication
+from angel_app.maintainer.schedule import getSchedule
 from angel_app.resource import childLink
 from angel_app.resource.local.basic import Basic
+from angel_app.resource.local.metadataCache import getMetadataCache
+from angel_app.resource.local.resourceHandle import ResourceHandle
+from angel_app.resource.local.validationCache import getValidationCache
+from angel_app.resource.remote.propertyCache import getPropertyCache
+from angel_app.resource.signatureCache import getSignatureCache
 from angel_app.tracker.connectToTracker import pingTracker
+from angel_app.worker import WorkerError
 
 log = getLogger(__name__)
 AngelConfig = config.getConfig()
 repository = AngelConfig.get("common","repository")
 
+# the interval (in seconds) at which the maintainer pings the tracker, checks the mount points etc.
+HOUSEKEEPING_INTERVAL = 3600
+# the maximum number of resources for which prefetched clones are kept
+MAX_PREFETCHED = 10000
+# while inspections are in flight, the schedule is checked for newly due resources this often (in seconds)
+POLL_INTERVAL = 10
+
 def inspectResource(af):
     """
     I take care of the inspection of a single resource, by first comparing it to all
     available valid clones, updating if necessary, and then broadcasting my existence
     to whoever is inclined to listen.
     """
+    return inspectResourceWithPrefetch(af)[0]
+
+def inspectResourceWithPrefetch(af, prefetchedClones = None, deepScrub = False):
+    """
+    Same as inspectResource, but makes use of (and provides) the clones prefetched for the 
+    children of a collection.
+    
+    @param prefetchedClones: the clones prefetched for the children of the parent of af, or None
+    @param deepScrub: see update.updateResource
+    @return a tuple (success, prefetchedChildClones, isValid, cloneLists), where success is False
+        if the inspection failed with an exception, and cloneLists is None in that case
+    @see update.updateResource
+    """
     log.info("inspecting resource: %s", af.fp.path)
     try:
-        (isValid, broadcastClones) = update.updateResource(af)
+        (isValid, broadcastClones, prefetchedChildClones, cloneLists) = \
+            update.updateResource(af, prefetchedClones, deepScrub)
         if isValid:
             # broadcast to previously unknown clones
             sync.broadCastAddressToClones(af, broadcastClones)
-        return True
+        return (True, prefetchedChildClones, isValid, cloneLists)
     except KeyboardInterrupt:
         raise
     except Exception, e:
         log.error("Resource inspection failed for resource: %s", af.fp.path, exc_info = e)
-        return False
+        return (False, None, False, None)
     
 def newSleepTime(currentSleepTime, startTime):
     """
@@ -54,7 +87,8 @@ def newSleepTime(currentSleepTime, startTime):
        
 def getChildren(resource):
     """
-    @return the children of the resource which are not indirectly mounted.
+    @param resource: a ResourceHandle
+    @return handles on the children of the resource which are not indirectly mounted.
     """
     if resource.isWritableFile():
         # either the resource belongs to us. no mount of a mount, none of the 
@@ -65,36 +99,233 @@ def getChildren(resource):
         # the current resource's key UUID
         parentUuid = resource.keyUUID()
         childLinks = childLink.parseChildren(resource.childLinks())
-        return [Basic(os.sep.join([resource.fp.path, cl.name])) for cl in childLinks if cl.uuid == parentUuid]
+        return [ResourceHandle(os.sep.join([resource.path, cl.name])) for cl in childLinks if cl.uuid == parentUuid]
 
-def traverseResourceTree(sleepTime):
+def traverseResourceTree(sleepTime, deepScrub = False):
     """
     I do one traversal of the local resource tree.
+    
+    @param deepScrub: if True, every resource is validated without relying on the validation cache
     """
-    def timedValidation(resource, dummy = None):
+    def timedValidation(resource, prefetchedClones = None):
         """
         Callback method for the graphwalker which validates/inspects each node
-        in the graph
+        in the graph. The clones prefetched for the children of a collection are
+        passed on to the children in the graphwalker's backpack.
+        
+        The graphwalker holds (light weight) handles on the resources that are yet to be
+        visited, the full resource only exists while it is inspected.
         """
         log.info("sleeping for %f sec", sleepTime)
         time.sleep(sleepTime)
         t1 = time.time()
-        res = (inspectResource(resource), None)
+        res = inspectResourceWithPrefetch(resource.basic(), prefetchedClones, deepScrub)
         log.debug("speed: inspection took %s sec", str( time.time() - t1 ))
-        return res
+        return res[:2]
     
     log.growl("User", "MAINTENANCE PROCESS", "Starting resource tree traversal.")
      
-    for dummyii in graphWalker(Basic(repository), getChildren, timedValidation):
+    for dummyii in graphWalker(ResourceHandle(repository), getChildren, timedValidation):
         continue
     
+    logCaches()
+
+def logCaches():
+    """
+    Log the statistics of the process-wide caches.
+    """
+    log.info("remote property cache: %s", getPropertyCache())
+    log.info("local metadata cache: %s", getMetadataCache())
+    log.info("validation cache: %s", getValidationCache())
+    log.info("signature cache: %s", getSignatureCache())
+
+def isReferenced(resource):
+    """
+    @param resource: a ResourceHandle
+    @return whether the resource is (still) one of the children of its parent that
+        are to be inspected, see getChildren()
+    """
+    parent = resource.parent()
+    if parent is None:
+        return True
+    return resource.path in [child.path for child in getChildren(parent)]
+
+def replicationOf(cloneLists):
+    """
+    @param cloneLists: the collect.CloneLists of a resource
+    @return the schedule.Replication of the resource
+    """
+    return Replication(len(collect.distinctClones(cloneLists.good)),
+                       len(collect.distinctClones(cloneLists.old)),
+                       len(collect.distinctClones(cloneLists.unreachable)),
+                       len(collect.distinctClones(cloneLists.bad)))
+
+def getInspector(pause = 0):
+    """
+    @param pause: see Inspector
+    @return a new Inspector, configured as per maintainer.maxinspections and maintainer.maxinspectionsperpeer
+    """
+    return Inspector(AngelConfig.getint("maintainer", "maxinspections"),
+                     AngelConfig.getint("maintainer", "maxinspectionsperpeer"),
+                     pause)
+
+def inspectHandle(resource, prefetchedClones = None, deepScrub = False):
+    """
+    Inspect the resource of a ResourceHandle, see inspectResourceWithPrefetch. Run by the Inspector threads.
+    """
+    return inspectResourceWithPrefetch(resource.basic(), prefetchedClones, deepScrub)
+
+def inspectTree(root, inspector):
+    """
+    Inspect all resources below (and including) root once, as many at a time as the inspector
+    allows, parents before their children.
+    
+    @param root: a ResourceHandle
+    @param inspector: an Inspector
+    @return the number of resources inspected successfully
+    """
+    # the resources (along with their prefetched clones) whose parents have been inspected
+    pending = [(root, None)]
+    inspected = 0
+    while pending or len(inspector) > 0:
+        while pending and inspector.capacity() > 0:
+            (resource, prefetchedClones) = pending.pop(0)
+            inspector.submit(resource.path, peersOf(resource), inspectHandle, resource, prefetchedClones)
+        for inspection in inspector.results():
+            if isinstance(inspection.result, WorkerError) or not inspection.result[0]:
+                continue
+            inspected += 1
+            resource = inspection.args[0]
+            prefetchedChildClones = inspection.result[1]
+            pending.extend([(child, prefetchedChildClones) for child in getChildren(resource)])
+    log.info("inspected %d resources below %s: %s", inspected, root.path, inspector)
+    return inspected
+
+def submitScheduled(inspector, schedule, entry, prefetchedClones):
+    """
+    Submit the inspection of the resource of a ScheduleEntry to the inspector. Resources that are no
+    longer referenced are removed from the schedule instead.
+    
+    @param prefetchedClones: a dictionary mapping the relative paths of resources scheduled 
+        for their first inspection to the clones prefetched for their siblings
+    @return the Inspection, None if the resource is no longer referenced
+    """
+    resource = ResourceHandle(repository + entry.path)
+    if not isReferenced(resource):
+        log.info("%s is no longer referenced, removing it from the schedule", entry.path)
+        schedule.remove(entry.path)
+        return None
+    # every once in a while, the validation cache is bypassed
+    deepScrub = getValidationCache() is not None and \
+        (entry.scrubbed is None or time.time() - entry.scrubbed >= AngelConfig.getint("maintainer", "deepscrubinterval"))
+    return inspector.submit(entry.path, peersOf(resource), inspectEntry, entry, 
+                            prefetchedClones.pop(entry.path, None), deepScrub)
+
+def inspectEntry(entry, prefetchedClones, deepScrub):
+    """
+    Inspect the resource of a ScheduleEntry. Run by the Inspector threads.
+    
+    @return a tuple (isValid, revision, replication, prefetchedChildClones), where replication
+        is None if the clones could not be collected
+    """
+    resource = ResourceHandle(repository + entry.path)
+    (success, prefetchedChildClones, isValid, cloneLists) = \
+        inspectResourceWithPrefetch(resource.basic(), prefetchedClones, deepScrub)
+    isValid = success and isValid
+    revision = None
+    if isValid:
+        revision = resource.revision()
+    replication = None
+    if cloneLists is not None:
+        replication = replicationOf(cloneLists)
+    return (isValid, revision, replication, prefetchedChildClones)
+
+def recordInspection(schedule, inspection, prefetchedClones):
+    """
+    Schedule the next inspection of the resource of a finished Inspection (see submitScheduled). The
+    children of a valid collection that are not scheduled yet are scheduled right away.
+    
+    @param prefetchedClones: see submitScheduled
+    """
+    (entry, dummyprefetched, deepScrub) = inspection.args
+    if isinstance(inspection.result, WorkerError):
+        (isValid, revision, replication, prefetchedChildClones) = (False, None, None, None)
+    else:
+        (isValid, revision, replication, prefetchedChildClones) = inspection.result
+    entry = schedule.record(entry, isValid, revision, replication, deepScrub)
+    log.debug("next inspection of %s in %d sec", entry.path, entry.due - time.time())
+    resource = ResourceHandle(repository + entry.path)
+    if isValid and resource.isCollection():
+        if len(prefetchedClones) > MAX_PREFETCHED:
+            prefetchedClones.clear()
+        for child in getChildren(resource):
+            childPath = child.relativePath()
+            if schedule.add(childPath) and prefetchedChildClones:
+                prefetchedClones[childPath.rstrip(os.sep)] = prefetchedChildClones
+
 
 def maintenanceLoop():
     """
-    Main loop for the maintainer.
+    Main loop for the maintainer: inspect the resources as they become due (see schedule), as
+    many at a time as maintainer.maxinspections allows (see inspector).
     """
     assert(Basic(repository).exists()), "Root directory (%s) not found." % repository
 
+    schedule = getSchedule()
+    if schedule is None:
+        log.warn("no maintainer schedule, falling back to periodic tree traversals")
+        traversalLoop()
+        return
+    
+    if AngelConfig.getboolean("common", "workerforking") and not AngelConfig.getboolean("common", "workerthreading"):
+        # start the worker processes before the inspector threads
+        worker.getPool().start()
+    
+    # every inspector thread pauses this long between two inspections
+    inspector = getInspector(AngelConfig.getint("maintainer", "initialsleep"))
+    # wake up at least this often, e.g. for resources expedited by the presenter
+    maxSleepTime = AngelConfig.getint("maintainer", "maxsleeptime")
+    # the clones prefetched for the children of the collections inspected
+    prefetchedClones = {}
+    # the relative paths of the resources being inspected
+    submitted = set()
+    lastHousekeeping = 0
+    # the root is always scheduled, the rest of the repository is found from there
+    schedule.add(os.sep)
+    while 1: # for eternity ;-)
+        now = time.time()
+        if now - lastHousekeeping >= HOUSEKEEPING_INTERVAL:
+            lastHousekeeping = now
+            # register with the tracker
+            pingTracker()
+            # check all mount points
+            from angel_app.maintainer import mount
+            mount.addMounts()
+            log.info("maintainer schedule: %s", schedule)
+            log.info("maintainer inspections: %s", inspector)
+            if worker.pool is not None:
+                log.info("maintainer worker processes: %s", worker.pool)
+            logCaches()
+        
+        capacity = inspector.capacity()
+        if capacity > 0:
+            for entry in schedule.due(now, capacity, submitted):
+                if submitScheduled(inspector, schedule, entry, prefetchedClones) is not None:
+                    submitted.add(entry.path)
+        if not submitted:
+            entry = schedule.next(now)
+            if entry is not None and entry.due > now:
+                time.sleep(min(entry.due - now, maxSleepTime))
+            continue
+        for inspection in inspector.results(min(POLL_INTERVAL, maxSleepTime)):
+            submitted.remove(inspection.path)
+            recordInspection(schedule, inspection, prefetchedClones)
+
+def traversalLoop():
+    """
+    Traverse the resource tree again and again, adapting the time to sleep between inspections
+    to maintainer.treetraversaltime. Used if the maintainer schedule is not available.
+    """
     sleepTime = AngelConfig.getint("maintainer", "initialsleep")
     while 1: # for eternity ;-)
         log.info("sleep timeout between resource inspections is: %r", sleepTime)
@@ -107,6 +338,6 @@ def maintenanceLoop():
         from angel_app.maintainer import mount
         mount.addMounts()
         
-        traverseResourceTree(sleepTime)   
+        traverseResourceTree(sleepTime)
         sleepTime = newSleepTime(sleepTime, startTime)
 
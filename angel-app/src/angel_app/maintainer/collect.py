@@ -2,9 +2,11 @@
 Routines for obtaining a best guess about the current replication state of a clone. 
 """
 
+import binascii
 import itertools
 import random
 import socket
+import time
 from logging import getLogger
 
 from angel_app import worker
@@ -14,6 +16,18 @@ from angel_app.resource.remote import exceptions as cloneExceptions
 log = getLogger(__name__)
 AngelConfig = config.getConfig()
 
+# the time (in seconds) for which we trust a clone's prefetched properties to
+# tell us that it is reachable and exists, without probing it again
+PREFETCH_MAX_AGE = 600
+# the number of bytes per chunk for byte range based validation
+CHUNKLENGTH = 4096
+# the number of chunks compared for byte range based validation
+NUMCHUNKS = 16
+# the number of blocks compared against the block hash manifest if there is no local copy
+NUMBLOCKS = 4
+# the time (in seconds) for which the addresses of a host name are cached
+DNS_CACHE_TTL = 300
+
 class CloneLists(object):
     """
     A python style struct
@@ -29,20 +43,25 @@ class CloneLists(object):
 
 def accessible(clone):
     """
-    Check if the clone is reachable, resolve redirects.
+    Check if the clone is reachable, resolve redirects. The properties needed for
+    validation are fetched along the way.
     @return a tuple of (Clone, bool), where Clone is the (redirected) clone, and bool indicates whether it's reachable.
     """
-    if not clone.ping():
+    if clone.prefetched is not None and time.time() - clone.prefetched < PREFETCH_MAX_AGE:
+        # the clone was listed (along with its properties) by its parent just now
+        return (clone, True)
+    
+    probe = clone.probe()
+    
+    if not probe.reachable:
         log.debug("clone %r not reachable, ignoring", clone)
-        return (clone, False)
-
-    clone = clone.checkForRedirect()
+        return (probe.clone, False)
         
-    if not clone.exists():
-        log.debug("resource %r not found on host %r", clone.path, clone.host)
-        return (clone, False)
+    if not probe.exists:
+        log.debug("resource %r not found on host %r", probe.clone.path, probe.clone.host)
+        return (probe.clone, False)
     
-    return (clone, True)
+    return (probe.clone, True)
 
 def acceptable(clone, publicKeyString, resourceID):
     """
@@ -69,14 +88,62 @@ def acceptable(clone, publicKeyString, resourceID):
         log.info("Clone %s not acceptable().", clone.toURI(), exc_info = e)
         return False
 
+def acceptableMetaData(clone, publicKeyString, resourceID):
+    """
+    Compare the clone against the metadata and verify the metadata signature, without
+    downloading the contents. The contents are verified against the (signed) content 
+    signature once they are downloaded.
+    
+    If the clone has a (signed) block hash manifest, a few randomly chosen blocks are 
+    checked as well, using a range digest report.
+    
+    @see sync.readResponseIntoFile
+    @return a boolean, indicating if the clone is valid as far as we can tell
+    """
+    try:
+        if not matchesMetaData(clone, publicKeyString, resourceID):
+            return False
+        
+        if not acceptableBlocks(clone):
+            return False
+    
+        return True
+    except cloneExceptions.BaseCloneError, e:
+        log.info("Clone %s not acceptable().", clone.toURI(), exc_info = e)
+        return False
+
+def matchesMetaData(clone, publicKeyString, resourceID):
+    """
+    Compare the clone against the metadata and verify the metadata signature.
+    
+    @see acceptableMetaData
+    @return a boolean, indicating if the clone's metadata is valid
+    """
+    if clone.resourceID() != resourceID:
+        # an invalid clone
+        return False
+    
+    if clone.publicKeyString() != publicKeyString:
+        # an invalid clone
+        return False
+    
+    if not clone.validateMetaData():
+        # an invalid clone
+        log.debug("iterateClones: %r invalid metadata signature", clone)
+        return False
+    
+    return True
+
 def acceptableChunk(lresource, clone, publicKeyString, resourceID):
     """
     Compare the clone against the metadata, perform validation based on byte ranges.
     
+    A number of randomly chosen chunks is compared. If the clone supports range digest reports,
+    all of them are validated with a single request, otherwise we fall back to downloading
+    a single chunk.
+    
     @return a boolean, indicating if the clone is valid
     """
-    CHUNKLENGTH = 4096 # the number of bytes to be validated
-
     try:
         if clone.resourceID() != resourceID:
             # an invalid clone
@@ -86,26 +153,86 @@ def acceptableChunk(lresource, clone, publicKeyString, resourceID):
             # an invalid clone
             return False
         
-        # here we do a comparison of a chunk of data only
+        # here we do a comparison of chunks of data only
         size = lresource.contentLength()
-        startoffset = random.randint(0, size)
-        if startoffset + CHUNKLENGTH > size:
-            CHUNKLENGTH = size - startoffset 
-            log.debug("had to shrink the chunk to verify to %s bytes. Offset: %s, resource-size: %s", CHUNKLENGTH, startoffset, size)
-        log.debug("doing byte range based validation of a resource of size %s, saving %s bytes traffic", size, size - CHUNKLENGTH)
-        localdigest = lresource.getChunkHash(startoffset, CHUNKLENGTH)
-        remotedigest = clone.getChunkHash(startoffset, CHUNKLENGTH)
-        assert localdigest is not None
-        assert remotedigest is not None, "Remote clone unreachable?"
-        if localdigest == remotedigest:
+        if size == 0:
             return True
-        else:
-            log.info("remote clone %r is not acceptable", clone)
-            return False
+        chunks = randomChunks(size)
+        remotedigests = clone.getChunkHashes(chunks)
+        if remotedigests is None:
+            chunks = chunks[:1]
+            remotedigests = [clone.getChunkHash(*chunks[0])]
+        return chunksMatch(lresource, clone, chunks, remotedigests)
     except cloneExceptions.BaseCloneError, e:
         log.info("Clone %s not acceptable().", clone.toURI(), exc_info = e)
         return False
 
+def randomChunks(size):
+    """
+    @param size: the size of the contents (more than 0)
+    @return a list of (offset, length) tuples of randomly chosen chunks for byte range based validation
+    """
+    chunks = []
+    for dummy in range(NUMCHUNKS):
+        startoffset = random.randint(0, size - 1)
+        chunks.append((startoffset, min(CHUNKLENGTH, size - startoffset)))
+    return chunks
+
+def chunksMatch(lresource, clone, chunks, remotedigests):
+    """
+    @param remotedigests: the digests of the chunks of the clone
+    @return whether the chunks of the local resource have the same digests
+    """
+    log.debug("doing byte range based validation of %d chunks of %r", len(chunks), clone)
+    localdigests = [lresource.getChunkHash(offset, length) for (offset, length) in chunks]
+    assert None not in localdigests
+    assert None not in remotedigests, "Remote clone unreachable?"
+    if localdigests == remotedigests:
+        return True
+    else:
+        log.info("remote clone %r is not acceptable", clone)
+        return False
+
+def acceptableBlocks(clone):
+    """
+    Compare randomly chosen blocks of the clone's contents against the clone's block hash 
+    manifest. The metadata of the clone must have been verified.
+    
+    @return False, if the clone's contents don't match the manifest, True otherwise (also if
+        the clone has no manifest or doesn't support range digest reports)
+    """
+    blocks = randomBlocks(clone)
+    if blocks is None:
+        return True
+    return blocksMatch(clone, blocks, clone.getChunkHashes(blocks[0]))
+
+def randomBlocks(clone):
+    """
+    @return a tuple of a list of (offset, length) tuples of randomly chosen blocks of the clone's 
+        contents, and the hex digests of those blocks according to the clone's block hash manifest, 
+        None if the clone has no manifest
+    """
+    blockHashes = clone.blockHashes()
+    if blockHashes is None or len(blockHashes[1]) == 0:
+        return None
+    (blockSize, digests) = blockHashes
+    blocks = [random.randint(0, len(digests) - 1) for dummy in range(NUMBLOCKS)]
+    return ([(block * blockSize, blockSize) for block in blocks], [digests[block] for block in blocks])
+
+def blocksMatch(clone, blocks, remotedigests):
+    """
+    @param blocks: as returned by randomBlocks()
+    @param remotedigests: the digests of the blocks as reported by the clone, None if it doesn't 
+        support range digest reports
+    @see acceptableBlocks
+    """
+    if remotedigests is None:
+        return True
+    if [binascii.hexlify(digest) for digest in remotedigests] != blocks[1]:
+        log.info("remote clone %r does not match its block hash manifest", clone)
+        return False
+    return True
+
 def canDoByteRangeValidationWith(lresource):
     """
     test wether the given local resource can be used to optimize validation
@@ -130,6 +257,10 @@ class ValidateClone(object):
     need to figure out wether the members are acceptable for:
      a- syncing to a non-existant/broken local resource
      b- keeping them as a meta property in the clonelist
+    
+    If there is no valid local file to compare with, only the metadata of remote 
+    files is verified here. Downloading them just for validation would mean 
+    downloading them twice, since the content is verified during the download anyway.
     """
     def __init__(self, lresource, publicKeyString = None, resourceID = None):
         self.lresource = lresource
@@ -147,9 +278,21 @@ class ValidateClone(object):
         # log.debug("__call__ in ValidateClone for " + `clone`)
         if self._doByteRangeValidation:
             return acceptableChunk(self.lresource, clone, self.publicKeyString, self.resourceID)
+        elif not isRemoteCollection(clone):
+            return acceptableMetaData(clone, self.publicKeyString, self.resourceID)
         else:
             return acceptable(clone, self.publicKeyString, self.resourceID)
 
+def isRemoteCollection(clone):
+    """
+    @return whether the clone is a collection, False if that can not be determined
+    """
+    try:
+        return clone.isCollection()
+    except cloneExceptions.BaseCloneError, e:
+        log.debug("can not determine resource type of %r", clone, exc_info = e)
+        return False
+
 def basicCloneChecks(toVisit, accessibleCb, validateCb):
     """
     This method is a helper to run some checks on a list of clones and return
@@ -164,7 +307,7 @@ def basicCloneChecks(toVisit, accessibleCb, validateCb):
     resultMap = {}
     if len(toVisit) < 1:
         return resultMap
-    accessibleResult = worker.dowork(accessibleCb, toVisit)
+    accessibleResult = worker.dowork(accessibleCb, toVisit, threadsafe = True)
     for cc in accessibleResult:
         if isinstance(accessibleResult[cc], worker.WorkerError):
             log.warn("error in accessibility checks: %r\n%s", accessibleResult[cc], "".join(accessibleResult[cc].formatted_tb()))
@@ -175,7 +318,7 @@ def basicCloneChecks(toVisit, accessibleCb, validateCb):
             resultMap[clone] = { 'accessible': acc, 'valid': False } # valid: default to false
     toValidate = [ cc for (cc, acc) in accessibleResult.itervalues() if acc == True ]
     if len(toValidate) > 0:
-        validationResult = worker.dowork(validateCb, toValidate)
+        validationResult = worker.dowork(validateCb, toValidate, threadsafe = True)
         for cc in validationResult:
             if isinstance(validationResult[cc], worker.WorkerError):
                 log.warn("error in validation: %r\n%s", validationResult[cc], "".join(validationResult[cc].formatted_tb()))
@@ -187,6 +330,13 @@ def basicCloneChecks(toVisit, accessibleCb, validateCb):
     return resultMap
 
     
+def cloneListOf(clone):
+    """
+    @return the clones registered with the clone, see Clone.cloneList
+    """
+    # this assumes that we always get an iterable result!
+    return clone.cloneList()
+
 def clonesFor(lresource, cloneSeedList, publicKeyString, resourceID):
     """
     This generator will take the local resource, combined with a list of seed clones,
@@ -211,10 +361,6 @@ def clonesFor(lresource, cloneSeedList, publicKeyString, resourceID):
 
     visited = []
 
-    def getCloneList(clone):
-        # this assumes that we always get an iterable result!
-        return clone.cloneList()
-
     while len(toVisit) > 0:
         resultMap = basicCloneChecks(toVisit, accessible, validate)
         toVisit = []
@@ -224,7 +370,7 @@ def clonesFor(lresource, cloneSeedList, publicKeyString, resourceID):
         # discover new clones based on valid clones:
         validClones = [ cc for cc in resultMap if resultMap[cc]['valid'] ]
         if len(validClones) > 0:
-            for ctocheck in eliminateDNSDoubles(eliminateSelfReferences(itertools.chain(*worker.dowork(getCloneList, validClones).itervalues()))):
+            for ctocheck in eliminateDNSDoubles(eliminateSelfReferences(itertools.chain(*worker.dowork(cloneListOf, validClones, threadsafe = True).itervalues()))):
                 if ctocheck not in visited and ctocheck not in toVisit:
                     log.debug("discovered new clone: %r", ctocheck)
                     toVisit.append(ctocheck)
@@ -285,9 +431,16 @@ def iterateClones(lresource, cloneSeedList, publicKeyString, resourceID):
     @rtype ([Clone], [Clone])
     @return a tuple of ([the list of valid clones], [the list of checked clones])
     """  
+    return cloneListsFrom(lresource, clonesFor(lresource, cloneSeedList, publicKeyString, resourceID))
+
+def cloneListsFrom(lresource, checkedClones):
+    """
+    @param checkedClones: an iterable of (clone, reachable, valid) tuples, see clonesFor()
+    @return the CloneLists
+    """
     cl = CloneLists()
     okClones = [] # might be old
-    for (c, reachable, valid) in clonesFor(lresource, cloneSeedList, publicKeyString, resourceID):
+    for (c, reachable, valid) in checkedClones:
         if not reachable:
             cl.unreachable.append(c)
         elif valid:
@@ -330,18 +483,26 @@ def eliminateSelfReferences(clones):
     selfReferences.extend( resolvedns(selfNodeName) )
     return [cc for cc in clones if cc.host not in selfReferences and not anyin(resolvedns(cc.host), selfReferences)]
 
+# map from host name to a tuple (time of the lookup, addresses), see resolvedns()
+_dnsCache = {}
+
 def resolvedns(hostname):
     """
     helper method to resolve a hostname and return a list of IPs or the empty
-    list
+    list. The result is cached for DNS_CACHE_TTL seconds.
 
     @param hostname: hostname
     """
+    cached = _dnsCache.get(hostname)
+    if cached is not None and time.time() - cached[0] < DNS_CACHE_TTL:
+        return cached[1]
+    addresses = []
     try:
-        return [ res[4][0] for res in socket.getaddrinfo(hostname, None) ]
+        addresses = [ res[4][0] for res in socket.getaddrinfo(hostname, None) ]
     except socket.error:
         pass
-    return []
+    _dnsCache[hostname] = (time.time(), addresses)
+    return addresses
 
 def eliminateDNSDoubles(clones):
     """
@@ -390,6 +551,12 @@ def eliminateDNSDoubles(clones):
         log.debug("eliminated %d clone(s) w.r.t. DNS/IP", numeliminated)
     return result
 
+def distinctClones(clones):
+    """
+    @return the clones, without those referring to the local node, and without those 
+        that refer to the same node as another one
+    """
+    return eliminateDNSDoubles(eliminateSelfReferences(clones))
 
 def clonesToStore(goodClones, unreachableClones):
     """
@@ -0,0 +1,161 @@
+"""
+Routines for updating an outdated file from a single clone by transferring only
+the blocks that changed.
+
+The (signed) block hash manifest of the new version of the file is compared with
+the digests of the blocks of the local copy. Blocks found in the local copy are
+copied locally, only the remaining blocks are requested from the clone with range
+requests. Since the local blocks are looked up by digest, not by position, appended
+data as well as blocks that moved by a multiple of the block size are recognized.
+
+The new contents are assembled in a SingleFileTransaction, which is only committed
+if they match the content signature.
+"""
+
+import os
+import stat
+from logging import getLogger
+
+from angel_app.config.config import getConfig
+from angel_app.io import RateLimit
+from angel_app.io import bufferedReadLoop
+from angel_app.maintainer import sync
+from angel_app.resource.remote.exceptions import CloneContentError
+from angel_app.resource.util import BlockHasher
+from angel_app.resource.util import getHashObject
+from angel_app.singlefiletransaction import SingleFileTransaction
+
+cfg = getConfig()
+MAX_DOWNLOAD_SPEED = cfg.getint('common', 'maxdownloadspeed_kib') * 1024 # internally handled in bytes
+log = getLogger(__name__)
+
+# the fraction of the new contents that must be found in the local copy for a
+# delta transfer to be worthwhile (otherwise, the file is downloaded as a whole,
+# which can be resumed)
+MIN_REUSE_FRACTION = 0.1
+
+class Run(object):
+    """
+    A python style struct describing a range of consecutive blocks of the new contents.
+    """
+    def __init__(self, offset, length, localOffset = None):
+        # the range of the new contents
+        self.offset = offset
+        self.length = length
+        # the offset of the range in the local copy, None if it must be fetched from the clone
+        self.localOffset = localOffset
+
+    def __repr__(self):
+        return "Run(%d, %d, %r)" % (self.offset, self.length, self.localOffset)
+
+def localBlocks(path, blockSize):
+    """
+    @return a dictionary mapping the hex digest of each block of the file at path
+        to a tuple of the offset and length of the block
+    """
+    hasher = BlockHasher(blockSize)
+    f = open(path, 'rb')
+    try:
+        size = os.fstat(f.fileno())[stat.ST_SIZE]
+        bufferedReadLoop(f.read, 16384, size, [hasher])
+    finally:
+        f.close()
+    blocks = {}
+    for (index, digest) in enumerate(hasher.hexdigests()):
+        if not blocks.has_key(digest):
+            offset = index * blockSize
+            blocks[digest] = (offset, min(blockSize, size - offset))
+    return blocks
+
+def plan(blockHashes, size, blocks):
+    """
+    @param blockHashes: the block hash manifest of the new contents, as returned by Resource.blockHashes()
+    @param size: the size of the new contents
+    @param blocks: the blocks of the local copy, as returned by localBlocks()
+    @return a list of Runs covering the new contents, where adjacent blocks that are
+        fetched from the clone (or copied from adjacent local blocks) are merged
+    """
+    (blockSize, digests) = blockHashes
+    runs = []
+    for (index, digest) in enumerate(digests):
+        offset = index * blockSize
+        length = min(blockSize, size - offset)
+        localOffset = None
+        if blocks.has_key(digest) and blocks[digest][1] == length:
+            localOffset = blocks[digest][0]
+        if runs:
+            last = runs[-1]
+            if localOffset is None and last.localOffset is None:
+                last.length += length
+                continue
+            if localOffset is not None and last.localOffset is not None and \
+                    localOffset == last.localOffset + last.length:
+                last.length += length
+                continue
+        runs.append(Run(offset, length, localOffset))
+    return runs
+
+def copyRange(f, offset, length, callbacks):
+    """
+    Read a byte range of the (local) file f into the callbacks.
+    """
+    f.seek(offset)
+    bytesread = bufferedReadLoop(f.read, 16384, length, callbacks)
+    assert bytesread == length, "Local copy changed during the update"
+
+def download(resource, referenceClone):
+    """
+    Update the contents of the resource's file from the reference clone, transferring
+    only the blocks that are not found in the local copy. The file is only replaced if
+    the new contents match the (verified) content signature of the reference clone.
+    Otherwise, a CloneContentError is raised.
+
+    @return True if the file has been updated, False if a delta transfer is not possible
+        (no local copy, no block hash manifest) or not worthwhile, in which case nothing
+        has been transferred
+    """
+    blockHashes = referenceClone.blockHashes()
+    localpath = resource.fp.path
+    if blockHashes is None or not os.path.isfile(localpath):
+        return False
+    expectedSignature = referenceClone.contentSignature()
+    if not referenceClone.validateMetaData():
+        raise CloneContentError("Metadata signature of clone %s is incorrect" % str(referenceClone))
+    size = referenceClone.contentLength()
+    runs = plan(blockHashes, size, localBlocks(localpath, blockHashes[0]))
+    reused = sum([run.length for run in runs if run.localOffset is not None])
+    if reused == 0 or reused < size * MIN_REUSE_FRACTION:
+        log.debug("delta transfer of '%s' not worthwhile, %d of %d bytes found locally", str(referenceClone), reused, size)
+        return False
+    log.info("updating '%s' with %d range requests, %d of %d bytes found locally",
+             str(referenceClone), len([run for run in runs if run.localOffset is None]), reused, size)
+
+    try:
+        tmppath = cfg.get('common', 'repository-tmp')
+    except KeyError:
+        tmppath = None
+    t = SingleFileTransaction(tmppath)
+    hashObj = getHashObject()
+    rateLimit = RateLimit(size - reused, MAX_DOWNLOAD_SPEED)
+    local = open(localpath, 'rb')
+    try:
+        try:
+            safe = t.open(localpath, 'wb')
+            for run in runs:
+                if run.localOffset is None:
+                    verifier = sync.BlockVerifier(blockHashes, run.offset)
+                    sync.fetchRange(referenceClone, run.offset, run.length, [verifier, safe.write, hashObj.update, rateLimit])
+                    verifier.finish()
+                else:
+                    copyRange(local, run.localOffset, run.length, [safe.write, hashObj.update])
+            if hashObj.hexdigest() != expectedSignature:
+                raise CloneContentError("Content of clone %s does not match its content signature" % str(referenceClone))
+        finally:
+            local.close()
+    except Exception, e:
+        log.warn("Error while updating '%s' from clone '%s'", localpath, str(referenceClone), exc_info = e)
+        t.cleanup()
+        raise
+    else:
+        t.commit()
+    return True
@@ -0,0 +1,250 @@
+"""
+Concurrent inspection of resources.
+
+Inspecting a resource is mostly waiting for the network: probing the clones, fetching
+their metadata, downloading contents. The Inspector keeps several inspections in flight
+in a fixed pool of threads, subject to two limits:
+
+ - at most maintainer.maxinspections inspections at a time
+ - at most maintainer.maxinspectionsperpeer inspections at a time of resources cloned on
+   the same host, so that a large mount doesn't swamp the few nodes it is cloned from
+
+A resource is never inspected while its parent or one of its children is being inspected
+(nor twice at a time), and such related resources are started in the order they were
+submitted. The inspection of a collection may change its children links, and the children
+are only found once their parent has been inspected (see client.getChildren), so parents are
+inspected before their children. Resources further apart are inspected independently, so
+that the (always scheduled) inspection of a collection high up in the tree doesn't hold
+back everything below it.
+
+Inspections are submitted with submit(), and their outcome is collected with results() in
+the submitting thread, which thus does all of the book keeping (e.g. of the schedule). The
+submitting thread keeps a few more inspections outstanding than there are threads (see
+capacity()), so that there is something else to start when an inspection is held back.
+"""
+
+import os
+import Queue
+import sys
+import threading
+import time
+import traceback
+from logging import getLogger
+
+from angel_app.worker import WorkerError
+
+log = getLogger(__name__)
+
+# the maximum number of inspections at a time, unless configured otherwise
+MAX_IN_FLIGHT = 8
+# the maximum number of inspections at a time of resources cloned on the same host
+MAX_PER_PEER = 2
+
+class Inspection(object):
+    """
+    A python style struct describing a submitted inspection.
+    """
+    def __init__(self, path, peers, function, args):
+        # the path of the resource, to tell related resources
+        self.path = path
+        # the hosts of the clones of the resource
+        self.peers = peers
+        # the inspection is function(*args)
+        self.function = function
+        self.args = args
+        # the return value of the function, a WorkerError if it raised an exception
+        self.result = None
+        # the time the inspection started and finished
+        self.started = None
+        self.finished = None
+
+    def __repr__(self):
+        return "Inspection(%r, peers: %r)" % (self.path, sorted(self.peers))
+
+def related(path, otherPath):
+    """
+    @return whether the two paths are the same, or one is the parent of the other
+    """
+    path = path.rstrip(os.sep) or os.sep
+    otherPath = otherPath.rstrip(os.sep) or os.sep
+    if path == otherPath:
+        return True
+    return os.path.dirname(path) == otherPath or os.path.dirname(otherPath) == path
+
+def peersOf(resource):
+    """
+    @param resource: a ResourceHandle
+    @return the set of hosts of the clones of the resource, those of its parent if the
+        resource doesn't exist yet, and an empty set if they can't be found
+    """
+    if not os.path.exists(resource.fp.path):
+        # it will be looked for on the clones of its parent
+        resource = resource.parent()
+        if resource is None or not os.path.exists(resource.fp.path):
+            return set()
+    try:
+        return set([cc.getHost() for cc in resource.clones()])
+    except Exception, e:
+        log.debug("clones of %s not found: %s", resource.fp.path, e)
+        return set()
+
+class Inspector(object):
+    """
+    Runs the submitted inspections in a pool of threads, see the module documentation.
+    """
+    def __init__(self, maxInFlight = MAX_IN_FLIGHT, maxPerPeer = MAX_PER_PEER, pause = 0):
+        """
+        @param maxInFlight: the maximum number of inspections at a time (the number of threads)
+        @param maxPerPeer: the maximum number of inspections at a time of resources cloned on the same host
+        @param pause: the time (in seconds) a thread pauses after each inspection
+        """
+        self.maxInFlight = maxInFlight
+        self.maxPerPeer = maxPerPeer
+        self.pause = pause
+        self._condition = threading.Condition()
+        # the inspections not started yet, in the order they were submitted
+        self._waiting = []
+        self._running = []
+        # map from host to the number of running inspections of resources cloned there
+        self._peerLoad = {}
+        self._finished = Queue.Queue()
+        self._threads = []
+        # the number of inspections submitted, but not collected with results()
+        self._outstanding = 0
+        # statistics
+        self.completed = 0
+        self.inspectionTime = 0.0
+
+    def submit(self, path, peers, function, *args):
+        """
+        Submit the inspection function(*args) of the resource with the given path.
+
+        @param peers: the hosts of the clones of the resource, see peersOf()
+        @return the Inspection
+        """
+        inspection = Inspection(path, peers, function, args)
+        self._condition.acquire()
+        try:
+            if not self._threads:
+                self._startThreads()
+            self._waiting.append(inspection)
+            self._outstanding += 1
+            self._condition.notify()
+        finally:
+            self._condition.release()
+        return inspection
+
+    def results(self, timeout = None):
+        """
+        Collect the finished inspections.
+
+        @param timeout: how long to wait (in seconds) for an inspection to finish, if none has
+            finished yet (None to wait as long as any is outstanding, 0 not to wait)
+        @return the Inspections finished since the last call, in the order they finished
+        """
+        finished = []
+        try:
+            if self._outstanding > 0 and timeout != 0:
+                finished.append(self._finished.get(True, timeout))
+            while True:
+                finished.append(self._finished.get_nowait())
+        except Queue.Empty:
+            pass
+        self._outstanding -= len(finished)
+        return finished
+
+    def capacity(self):
+        """
+        @return the number of further inspections worth submitting right now
+        """
+        return max(0, 2 * self.maxInFlight - self._outstanding)
+
+    def __len__(self):
+        """
+        @return the number of outstanding inspections (waiting, running, or finished but not collected)
+        """
+        return self._outstanding
+
+    def __str__(self):
+        self._condition.acquire()
+        try:
+            (running, waiting) = (len(self._running), len(self._waiting))
+        finally:
+            self._condition.release()
+        meanTime = 0.0
+        if self.completed > 0:
+            meanTime = self.inspectionTime / self.completed
+        return "Inspector(running: %d, waiting: %d, completed: %d, mean time: %.1f sec)" % \
+            (running, waiting, self.completed, meanTime)
+
+    def _startThreads(self):
+        for dummyii in range(self.maxInFlight):
+            thread = threading.Thread(target = self._work)
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _mayStart(self, inspection, index):
+        """
+        @param index: the position of the inspection in the list of waiting inspections
+        @return whether the inspection may be started right now
+        """
+        for peer in inspection.peers:
+            if self._peerLoad.get(peer, 0) >= self.maxPerPeer:
+                return False
+        for other in self._running + self._waiting[:index]:
+            if related(inspection.path, other.path):
+                return False
+        return True
+
+    def _nextInspection(self):
+        """
+        Wait for an inspection that may be started, and mark it as running. Must be called
+        with the condition acquired.
+        """
+        while True:
+            for (index, inspection) in enumerate(self._waiting):
+                if self._mayStart(inspection, index):
+                    del self._waiting[index]
+                    self._running.append(inspection)
+                    for peer in inspection.peers:
+                        self._peerLoad[peer] = self._peerLoad.get(peer, 0) + 1
+                    return inspection
+            self._condition.wait()
+
+    def _done(self, inspection):
+        """
+        Mark the inspection as finished. Must be called with the condition acquired.
+        """
+        self._running.remove(inspection)
+        for peer in inspection.peers:
+            self._peerLoad[peer] -= 1
+            if self._peerLoad[peer] == 0:
+                del self._peerLoad[peer]
+        self.completed += 1
+        self.inspectionTime += inspection.finished - inspection.started
+        # this may have unblocked any of the waiting inspections
+        self._condition.notifyAll()
+
+    def _work(self):
+        while True:
+            self._condition.acquire()
+            try:
+                inspection = self._nextInspection()
+            finally:
+                self._condition.release()
+            inspection.started = time.time()
+            try:
+                inspection.result = inspection.function(*inspection.args)
+            except Exception, e:
+                log.error("inspection of %s failed", inspection.path, exc_info = e)
+                inspection.result = WorkerError(type(e), e, traceback.format_tb(sys.exc_info()[2]))
+            inspection.finished = time.time()
+            self._condition.acquire()
+            try:
+                self._done(inspection)
+            finally:
+                self._condition.release()
+            self._finished.put(inspection)
+            if self.pause:
+                time.sleep(self.pause)
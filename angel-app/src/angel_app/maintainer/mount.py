@@ -40,7 +40,7 @@ def setMountPoint(mountPoint, URLToMount):
     
     cc = clone.cloneFromURI(URLToMount)
     
-    if not (cc.ping() and cc.exists()):
+    if not cc.probe().exists:
         # don't fail, just mount at next startup
         log.warn("Can not connect to %s. Can not initialize mount point.", URLToMount)
         return
@@ -2,6 +2,7 @@ from logging import getLogger
 
 from angel_app.config import config
 from angel_app.resource.local.basic import Basic
+from angel_app.resource.local.repositoryIndex import getRepositoryIndex
 
 log = getLogger(__name__)
 AngelConfig = config.getConfig()
@@ -36,6 +37,16 @@ class QuotaManager(object):
         else:
             # quota defined:
             return quota
+
+    def usage(self, resource):
+        """
+        @return: the number of bytes used by the files signed with the same key as this 
+        resource, according to the repository index. None if the index is not available.
+        """
+        index = getRepositoryIndex()
+        if index is None:
+            return None
+        return index.totalSize(resource.keyUUID())
         
 def __readQuotasFromConfig(mounts, quotas):
     mounts = [name for name in mounts.itervalues()]
@@ -0,0 +1,359 @@
+"""
+The maintainer's schedule: when to inspect which resource next.
+
+Rather than walking the whole tree at a fixed pace, the maintainer keeps a persistent
+queue of the resources in the repository, ordered by the time their next inspection
+is due. After every inspection, the resource is scheduled again, with an interval that
+adapts to the resource:
+
+ - resources whose inspection failed are retried soon, backing off on repeated failures
+ - resources that changed (a new revision) are inspected again within minutes
+ - resources new to us are inspected again within the hour
+ - otherwise, the interval is doubled, up to maintainer.treetraversaltime, but it is kept
+   below half the time since the resource last changed (resources that change often are
+   likely to change again), and below a quarter of an hour for resources with fewer distinct
+   good clones than maintainer.replicationtarget
+
+Along with the schedule, the replication health of every resource (the number of distinct
+good, old, unreachable and bad clones found by the last inspection) is kept. When several
+resources are due, those furthest below the replication target are inspected first.
+
+The presenter expedites the resources it modifies (see expediteResource()). The
+schedule also records when a resource was last validated without the validation
+cache, so that every resource is deep scrubbed every maintainer.deepscrubinterval.
+"""
+
+import os
+import random
+import time
+from logging import getLogger
+
+from angel_app.config.config import getConfig
+from angel_app.resource.local.SqliteDeadProperties import Database
+
+log = getLogger(__name__)
+
+# the data base file, next to the metadata directory tree
+SCHEDULE_NAME = "schedule.sqlite"
+
+# the interval (in seconds) after which a changed resource is inspected again
+MIN_INTERVAL = 300.0
+# the interval after the first inspection of a resource
+NEW_INTERVAL = 3600.0
+# the maximum interval for resources with fewer good clones than the replication target
+UNDERREPLICATED_INTERVAL = 900.0
+# the maximum interval after failed inspections
+FAILURE_INTERVAL = 6 * 3600.0
+# the intervals are varied by this fraction, to spread the inspections
+JITTER = 0.1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS schedule (
+    path TEXT PRIMARY KEY,
+    due REAL,
+    interval REAL,
+    revision INTEGER,
+    changed REAL,
+    goodclones INTEGER,
+    oldclones INTEGER,
+    unreachableclones INTEGER,
+    badclones INTEGER,
+    failures INTEGER,
+    inspected REAL,
+    scrubbed REAL
+);
+CREATE INDEX IF NOT EXISTS schedule_due ON schedule (due);
+CREATE INDEX IF NOT EXISTS schedule_goodclones ON schedule (goodclones, due);
+"""
+
+COLUMNS = ["path", "due", "interval", "revision", "changed", "goodclones", "oldclones", "unreachableclones",
+           "badclones", "failures", "inspected", "scrubbed"]
+
+class Replication(object):
+    """
+    A python style struct: the number of distinct clones of a resource (not counting our own), 
+    as found by an inspection, see collect.iterateClones.
+    """
+    def __init__(self, good = 0, old = 0, unreachable = 0, bad = 0):
+        self.good = good
+        self.old = old # valid but out-dated
+        self.unreachable = unreachable
+        self.bad = bad # reachable but broken
+
+class ScheduleEntry(object):
+    """
+    A python style struct describing a scheduled resource.
+    """
+    def __init__(self, path, due, interval, revision, changed, goodClones, oldClones, unreachableClones, 
+                 badClones, failures, inspected, scrubbed):
+        # the path relative to the repository root, see Basic.relativePath()
+        self.path = path
+        # the time the next inspection is due
+        self.due = due
+        # the interval between the last two inspections, None if never inspected
+        self.interval = interval
+        # the revision found by the last inspection, and the time it last changed
+        self.revision = revision
+        self.changed = changed
+        # the replication health: the number of distinct clones found by the last inspection, 
+        # None if never inspected
+        self.goodClones = goodClones
+        self.oldClones = oldClones
+        self.unreachableClones = unreachableClones
+        self.badClones = badClones
+        # the number of consecutive failed inspections
+        self.failures = failures or 0
+        # the time of the last inspection, and that of the last one bypassing the validation cache
+        self.inspected = inspected
+        self.scrubbed = scrubbed
+
+    def __repr__(self):
+        return "ScheduleEntry(%r, due: %r, interval: %r)" % (self.path, self.due, self.interval)
+
+def _key(path):
+    """
+    @return the key of the resource with the given relative path in the schedule
+    """
+    return path.rstrip(os.sep) or os.sep
+
+def nextInterval(entry, isValid, revision, goodClones, maxInterval, replicationTarget, now):
+    """
+    @param entry: the ScheduleEntry of the resource, as before the inspection
+    @param isValid: whether the inspection succeeded
+    @param revision: the revision of the resource after the inspection (None if not valid)
+    @param goodClones: the number of distinct good clones found
+    @param maxInterval: the maximum interval
+    @param replicationTarget: the number of distinct good clones we would like to have
+    @param now: the time of the inspection
+    @return the interval (in seconds, without jitter) until the next inspection
+    """
+    if not isValid:
+        return min(MIN_INTERVAL * 2 ** entry.failures, FAILURE_INTERVAL, maxInterval)
+    if entry.revision is None:
+        # never inspected successfully before
+        interval = min(NEW_INTERVAL, maxInterval)
+    elif revision != entry.revision:
+        return MIN_INTERVAL
+    else:
+        interval = min(max(entry.interval, MIN_INTERVAL) * 2, maxInterval)
+    if entry.changed is not None:
+        interval = min(interval, max((now - entry.changed) / 2, MIN_INTERVAL))
+    if goodClones < replicationTarget:
+        interval = min(interval, UNDERREPLICATED_INTERVAL)
+    return interval
+
+class Schedule(object):
+    """
+    The persistent queue of the resources to inspect, by the time their next inspection is due.
+    """
+    def __init__(self, path, maxInterval, replicationTarget):
+        """
+        @param path: the path of the data base file
+        @param maxInterval: the maximum interval (in seconds) between two inspections of a resource
+        @param replicationTarget: the number of distinct good clones we would like every resource to have
+        """
+        self.database = Database(path, SCHEMA)
+        self.maxInterval = maxInterval
+        self.replicationTarget = replicationTarget
+        self._addMissingColumns()
+
+    def _addMissingColumns(self):
+        """
+        Schedules written by earlier versions lack the replication health columns.
+        """
+        existing = [row[1] for row in self.database.execute("PRAGMA table_info(schedule)")]
+        for column in COLUMNS:
+            if column not in existing:
+                self.database.execute("ALTER TABLE schedule ADD COLUMN %s INTEGER" % column)
+
+    def add(self, path, due = None):
+        """
+        Schedule the resource with the given relative path, unless it is already scheduled.
+
+        @param due: the time the first inspection is due, default now
+        @return whether the resource was added
+        """
+        if due is None:
+            due = time.time()
+        cursor = self.database.execute("INSERT OR IGNORE INTO schedule (path, due) VALUES (?, ?)", (_key(path), due))
+        return cursor.rowcount > 0
+
+    def expedite(self, path, due = None):
+        """
+        Make sure the resource with the given relative path is inspected no later than due.
+        """
+        if due is None:
+            due = time.time()
+        self.database.begin()
+        try:
+            self.add(path, due)
+            self.database.execute("UPDATE schedule SET due = MIN(due, ?) WHERE path = ?", (due, _key(path)))
+        except:
+            self.database.rollback()
+            raise
+        self.database.commit()
+
+    def remove(self, path):
+        """
+        Remove the resource with the given relative path, and all resources below it.
+        """
+        key = _key(path)
+        prefix = key.rstrip(os.sep) + os.sep
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        self.database.begin()
+        try:
+            self.database.execute("DELETE FROM schedule WHERE path = ?", (key,))
+            self.database.execute("DELETE FROM schedule WHERE path >= ? AND path < ?", (prefix, upper))
+        except:
+            self.database.rollback()
+            raise
+        self.database.commit()
+
+    def get(self, path):
+        """
+        @return the ScheduleEntry for the resource with the given relative path, None if there is none
+        """
+        row = self.database.execute("SELECT %s FROM schedule WHERE path = ?" % ", ".join(COLUMNS),
+                                    (_key(path),)).fetchone()
+        if row is None:
+            return None
+        return ScheduleEntry(*row)
+
+    def next(self, now = None):
+        """
+        @return the ScheduleEntry of the resource to inspect next, None if the schedule is empty: of the
+            resources that are due, the one with the fewest good clones (resources not inspected yet 
+            first), if it has fewer than the replication target, otherwise the one due first.
+        """
+        if now is None:
+            now = time.time()
+        row = self.database.execute(
+                    "SELECT %s FROM schedule WHERE due <= ? AND (goodclones IS NULL OR goodclones < ?) " % ", ".join(COLUMNS) +
+                    "ORDER BY goodclones, due LIMIT 1", (now, self.replicationTarget)).fetchone()
+        if row is None:
+            row = self.database.execute("SELECT %s FROM schedule ORDER BY due LIMIT 1" % ", ".join(COLUMNS)).fetchone()
+        if row is None:
+            return None
+        return ScheduleEntry(*row)
+
+    def due(self, now = None, limit = 1, exclude = ()):
+        """
+        @param limit: the maximum number of entries
+        @param exclude: the relative paths of resources to leave out (e.g. those being inspected)
+        @return the ScheduleEntries of the resources that are due, in the order of next()
+        """
+        if now is None:
+            now = time.time()
+        # resources not inspected yet come first (NULL sorts first), then those below the replication
+        # target by their number of good clones, and finally the rest by the time they are due
+        rows = self.database.execute(
+                    "SELECT %s FROM schedule WHERE due <= ? " % ", ".join(COLUMNS) +
+                    "ORDER BY goodclones >= ?, CASE WHEN goodclones < ? THEN goodclones END, due LIMIT ?",
+                    (now, self.replicationTarget, self.replicationTarget, limit + len(exclude)))
+        entries = [ScheduleEntry(*row) for row in rows if row[0] not in exclude]
+        return entries[:limit]
+
+    def record(self, entry, isValid, revision = None, replication = None, deepScrub = False, now = None):
+        """
+        Record the outcome of an inspection, and schedule the next one.
+
+        @param entry: the ScheduleEntry of the inspected resource, as before the inspection
+        @param isValid: whether the resource was valid after the inspection
+        @param revision: its revision (if valid)
+        @param replication: the Replication found by the inspection, None if unknown
+        @param deepScrub: whether the resource was validated without the validation cache
+        @return the updated ScheduleEntry
+        """
+        if now is None:
+            now = time.time()
+        if replication is None:
+            replication = Replication(entry.goodClones or 0, entry.oldClones or 0,
+                                      entry.unreachableClones or 0, entry.badClones or 0)
+        interval = nextInterval(entry, isValid, revision, replication.good, self.maxInterval, 
+                                self.replicationTarget, now)
+        due = now + interval * random.uniform(1 - JITTER, 1 + JITTER)
+        updated = ScheduleEntry(entry.path, due, interval, entry.revision, entry.changed,
+                                replication.good, replication.old, replication.unreachable, replication.bad,
+                                entry.failures, now, entry.scrubbed)
+        if isValid:
+            if entry.revision is not None and revision != entry.revision:
+                updated.changed = now
+            updated.revision = revision
+            updated.failures = 0
+            if deepScrub:
+                updated.scrubbed = now
+        else:
+            updated.failures += 1
+        self.database.execute(
+                "INSERT OR REPLACE INTO schedule (%s) VALUES (%s)" % (", ".join(COLUMNS), ", ".join(["?"] * len(COLUMNS))),
+                (updated.path, updated.due, updated.interval, updated.revision, updated.changed,
+                 updated.goodClones, updated.oldClones, updated.unreachableClones, updated.badClones,
+                 updated.failures, updated.inspected, updated.scrubbed))
+        return updated
+
+    def replicationLevels(self):
+        """
+        @return a dictionary mapping the number of distinct good clones to the number of resources
+            with that many good clones (None for the resources not inspected yet)
+        """
+        return dict(self.database.execute("SELECT goodclones, COUNT(*) FROM schedule GROUP BY goodclones").fetchall())
+
+    def underReplicated(self):
+        """
+        @return the ScheduleEntries of the resources with fewer good clones than the replication target, 
+            fewest good clones first
+        """
+        return [ScheduleEntry(*row) for row in self.database.execute(
+                    "SELECT %s FROM schedule WHERE goodclones < ? ORDER BY goodclones, path" % ", ".join(COLUMNS),
+                    (self.replicationTarget,))]
+
+    def dueCount(self, now = None):
+        """
+        @return the number of resources whose inspection is due
+        """
+        if now is None:
+            now = time.time()
+        return self.database.execute("SELECT COUNT(*) FROM schedule WHERE due <= ?", (now,)).fetchone()[0]
+
+    def __len__(self):
+        return self.database.execute("SELECT COUNT(*) FROM schedule").fetchone()[0]
+
+    def __str__(self):
+        levels = self.replicationLevels().items()
+        levels.sort()
+        return "Schedule(resources: %d, due: %d, replication levels: %s)" % \
+            (len(self), self.dueCount(), ", ".join(["%s: %d" % (level is None and "new" or level, count) for (level, count) in levels]))
+
+
+_schedule = None
+
+def getSchedule():
+    """
+    Implements a singleton for getting the process-wide Schedule.
+
+    @return the Schedule, None if it is not available
+    """
+    global _schedule
+    if _schedule is None:
+        config = getConfig()
+        try:
+            _schedule = Schedule(os.path.join(config.get("common", "angelhome"), SCHEDULE_NAME),
+                                 config.getint("maintainer", "treetraversaltime"),
+                                 config.getint("maintainer", "replicationtarget"))
+        except RuntimeError, e:
+            log.warn("maintainer schedule not available: %s", e)
+            return None
+    return _schedule
+
+def expediteResource(path):
+    """
+    Make sure the resource with the given relative path is inspected soon, e.g. because
+    it has been modified. Failures are logged only.
+    """
+    schedule = getSchedule()
+    if schedule is None:
+        return
+    try:
+        schedule.expedite(path)
+    except Exception, e:
+        log.warn("failed to update the maintainer schedule for %s", path, exc_info = e)
@@ -0,0 +1,287 @@
+"""
+Routines for downloading the contents of a file from several (equally new,
+good) clones at once.
+
+The file is split into segments, which the clones fetch concurrently with
+range requests. Segments are handed out one at a time, so fast clones end up
+doing more of the work than slow ones. When there are no segments left, idle
+clones help out with the segments still in progress on slower clones, and
+whichever copy arrives first is used.
+
+The segments are written into a single ResumableFileTransaction, which is
+only committed if the contents match the content signature. If the file has
+a block hash manifest, each segment is verified as it arrives, so a corrupt
+segment is fetched again from a different clone right away.
+"""
+
+import threading
+import time
+from logging import getLogger
+
+from angel_app import worker
+from angel_app.config.config import getConfig
+from angel_app.io import RateLimit
+from angel_app.io import bufferedReadLoop
+from angel_app.maintainer import sync
+from angel_app.resource.remote.exceptions import CloneContentError
+from angel_app.resource.remote.exceptions import CloneIOError
+from angel_app.resource.util import getHashObject
+
+cfg = getConfig()
+MAX_DOWNLOAD_SPEED = cfg.getint('common', 'maxdownloadspeed_kib') * 1024 # internally handled in bytes
+log = getLogger(__name__)
+
+# the size of the pieces handed out to the clones
+SEGMENT_SIZE = 4 * 1024 * 1024
+# files smaller than this are downloaded from a single clone
+MIN_SWARM_SIZE = 2 * SEGMENT_SIZE
+# the maximum number of clones we download from at the same time
+MAX_PEERS = 4
+# the number of failed segments after which we stop asking a clone
+MAX_FAILURES = 2
+# the maximum number of clones fetching the same segment towards the end of the download
+MAX_FETCHERS = 2
+
+class SegmentDone(Exception):
+    """
+    Raised to abort fetching a segment that another clone has delivered in the meantime.
+    """
+    pass
+
+class Segment(object):
+    """
+    A python style struct describing a byte range of the file.
+    """
+    def __init__(self, offset, length):
+        self.offset = offset
+        self.length = length
+        self.done = False
+        # the number of clones currently fetching this segment
+        self.fetchers = 0
+        # when the segment was first handed out
+        self.started = None
+
+    def __repr__(self):
+        return "Segment(%d, %d)" % (self.offset, self.length)
+
+class Swarm(object):
+    """
+    Keeps track of the segments of a single download, and hands them out to the clones.
+    """
+
+    def __init__(self, safe, offset, size, segmentSize = SEGMENT_SIZE, blockHashes = None):
+        """
+        @param safe: the file object to write the segments to
+        @param offset: the number of bytes already present at the beginning of the file
+        @param size: the size of the complete file
+        @param blockHashes: the block hash manifest of the file (as returned by Resource.blockHashes()), 
+            if given, offset and segmentSize must be multiples of the block size
+        """
+        self._lock = threading.Lock()
+        self.blockHashes = blockHashes
+        self.safe = safe
+        self.offset = offset
+        self.segments = [Segment(start, min(segmentSize, size - start))
+                         for start in range(offset, size, segmentSize)]
+        self.rateLimit = RateLimit(size - offset, MAX_DOWNLOAD_SPEED)
+        # number of bytes delivered per clone
+        self.delivered = {}
+        # the clones that delivered corrupt segments
+        self.corrupt = []
+
+    def nextSegment(self):
+        """
+        @return the next segment to be fetched, or None if there is nothing left to do
+        """
+        self._lock.acquire()
+        try:
+            for segment in self.segments:
+                if not segment.done and segment.fetchers == 0:
+                    segment.fetchers = 1
+                    segment.started = time.time()
+                    return segment
+            # help out with the segment that has been in progress for the longest time
+            candidate = None
+            for segment in self.segments:
+                if segment.done or segment.fetchers >= MAX_FETCHERS:
+                    continue
+                if candidate is None or segment.started < candidate.started:
+                    candidate = segment
+            if candidate is not None:
+                candidate.fetchers += 1
+            return candidate
+        finally:
+            self._lock.release()
+
+    def deliver(self, clone, segment, data):
+        """
+        Write the data of a segment to the file, unless another clone has been faster.
+        """
+        self._lock.acquire()
+        try:
+            segment.fetchers -= 1
+            if segment.done:
+                return
+            self.safe.seek(segment.offset)
+            self.safe.write(data)
+            segment.done = True
+            self.delivered[clone] = self.delivered.get(clone, 0) + len(data)
+        finally:
+            self._lock.release()
+
+    def abandon(self, segment):
+        """
+        Hand the segment back, e.g. after the clone failed to deliver it.
+        """
+        self._lock.acquire()
+        try:
+            segment.fetchers -= 1
+        finally:
+            self._lock.release()
+
+    def missing(self):
+        """
+        @return the segments that have not been delivered yet
+        """
+        return [segment for segment in self.segments if not segment.done]
+
+    def contiguousSize(self):
+        """
+        @return the number of bytes at the beginning of the file that are complete
+        """
+        size = self.offset
+        for segment in self.segments:
+            if not segment.done:
+                break
+            size += segment.length
+        return size
+
+    def fetchFrom(self, clone):
+        """
+        Fetch segments from clone, until there are none left or the clone fails repeatedly.
+        """
+        failures = 0
+        while failures < MAX_FAILURES:
+            segment = self.nextSegment()
+            if segment is None:
+                return
+            try:
+                data = fetchSegment(clone, segment, self.rateLimit)
+                self.verify(segment, data)
+            except SegmentDone:
+                self.abandon(segment)
+                continue
+            except KeyboardInterrupt:
+                self.abandon(segment)
+                raise
+            except CloneContentError, e:
+                self.abandon(segment)
+                self.corrupt.append(clone)
+                log.info("clone %r delivered corrupt data for %r: %s", clone, segment, e)
+                return
+            except Exception, e:
+                self.abandon(segment)
+                failures += 1
+                log.debug("clone %r failed to deliver %r: %r", clone, segment, e)
+                continue
+            self.deliver(clone, segment, data)
+        log.info("giving up on clone %r after %d failures", clone, failures)
+
+    def verify(self, segment, data):
+        """
+        Verify the data of a segment against the block hash manifest (if any).
+        
+        @raise CloneContentError: if the data is corrupt
+        """
+        if self.blockHashes is None:
+            return
+        verifier = sync.BlockVerifier(self.blockHashes, segment.offset)
+        verifier(data)
+        verifier.finish()
+
+
+def fetchSegment(clone, segment, rateLimit):
+    """
+    @return the contents of the segment as delivered by the clone
+    """
+    def abortIfDone(dummybuf):
+        if segment.done:
+            raise SegmentDone()
+
+    chunks = []
+    sync.fetchRange(clone, segment.offset, segment.length, [abortIfDone, chunks.append, rateLimit])
+    return "".join(chunks)
+
+def hashFile(path, size):
+    """
+    @return the hex digest of the first size bytes of the file at path
+    """
+    hashObj = getHashObject()
+    ff = open(path, 'rb')
+    try:
+        bufferedReadLoop(ff.read, 16384, size, [hashObj.update])
+    finally:
+        ff.close()
+    return hashObj.hexdigest()
+
+def download(resource, cloneList, segmentSize = SEGMENT_SIZE):
+    """
+    Download the contents of the first clone in cloneList into the resource's file, using
+    all clones in cloneList that have the same contents. The file is only replaced if the
+    contents match the (verified) content signature of the first clone. Otherwise, the
+    download is discarded and a CloneContentError is raised.
+
+    If the download fails, the data at the beginning of the file that has been downloaded
+    completely is kept for resuming.
+
+    @param resource: the local resource
+    @param cloneList: good clones of the resource, the first one is used as the reference
+    @see sync.readResponseIntoFile
+    """
+    referenceClone = cloneList[0]
+    expectedSignature = referenceClone.contentSignature()
+    if not referenceClone.validateMetaData():
+        raise CloneContentError("Metadata signature of clone %s is incorrect" % str(referenceClone))
+    resourceID = referenceClone.resourceID()
+    peers = [cc for cc in cloneList
+             if cc.contentSignature() == expectedSignature and cc.resourceID() == resourceID][:MAX_PEERS]
+    size = referenceClone.contentLength()
+    blockHashes = referenceClone.blockHashes()
+
+    t = sync.downloadTransaction(resourceID, expectedSignature)
+    offset = t.size()
+    if offset > size:
+        offset = 0
+    if blockHashes is not None:
+        # segments must consist of whole blocks, so that they can be verified on their own
+        blockSize = blockHashes[0]
+        offset -= offset % blockSize
+        segmentSize = max(1, segmentSize / blockSize) * blockSize
+    safe = t.open(resource.fp.path, append = False)
+    swarm = Swarm(safe, offset, size, segmentSize, blockHashes)
+    try:
+        t.truncate(offset)
+        log.info("downloading %d bytes of '%s' from %d clones", size - offset, str(referenceClone), len(peers))
+        t1 = time.time()
+        worker.threadedwork(swarm.fetchFrom, peers, len(peers))
+        for (clone, delivered) in swarm.delivered.items():
+            log.debug("clone %r delivered %d bytes", clone, delivered)
+        log.debug("speed: swarm download took %s sec", str(time.time() - t1))
+        missing = swarm.missing()
+        if len(missing) > 0 and len(swarm.corrupt) > 0:
+            raise CloneContentError("Clones %r delivered corrupt data for %s" % (swarm.corrupt, str(referenceClone)))
+        if len(missing) > 0:
+            raise CloneIOError("Failed to download %d segments of %s" % (len(missing), str(referenceClone)))
+        safe.flush()
+        if hashFile(t.safename, size) != expectedSignature:
+            t.discard()
+            raise CloneContentError("Content of clones %r does not match the content signature" % peers)
+    except Exception, e:
+        log.warn("Error while downloading from clones %r", peers, exc_info = e)
+        if t.safe is not None:
+            # keep what can be resumed
+            t.truncate(swarm.contiguousSize())
+        t.cleanup()
+        raise
+    else:
+        t.commit()
@@ -5,11 +5,20 @@ import os
 import time
 from logging import getLogger
 
+from twisted.web2 import responsecode
+
 from angel_app import elements
-from angel_app.singlefiletransaction import SingleFileTransaction
+from angel_app.singlefiletransaction import ResumableFileTransaction
 from angel_app.io import RateLimit
 from angel_app.io import bufferedReadLoop
 from angel_app.config.config import getConfig
+from angel_app.resource.remote.exceptions import CloneContentError
+from angel_app.resource.remote.exceptions import CloneError
+from angel_app.resource.remote.exceptions import CloneIOError
+from angel_app.resource.remote.httpRemote import contentRangeSize
+from angel_app.resource.remote.httpRemote import rangeHeader
+from angel_app.resource.util import BlockHasher
+from angel_app.resource.util import getHashObject
 from angel_app.worker import dowork
 
 cfg = getConfig()
@@ -33,26 +42,213 @@ def syncContents(resource, referenceClone):
         readResponseIntoFile(resource, referenceClone)
         
 
-def readResponseIntoFile(resource, referenceClone):
+def partialKey(resourceID, contentSignature):
+    """
+    @return the name under which the partial download of the given contents is kept
+    """
+    return "download-" + getHashObject(str(resourceID) + "\0" + contentSignature).hexdigest()
+
+def downloadTransaction(resourceID, contentSignature):
+    """
+    @return a ResumableFileTransaction for downloading the given contents
+    """
     try:
         tmppath = cfg.get('common', 'repository-tmp')
     except KeyError:
         tmppath = None
-    t = SingleFileTransaction(tmppath)
-    safe = t.open(resource.fp.path, 'wb')
-    stream = referenceClone.open()
-    size = long(stream.getheader('Content-Length'))
-    callbacks = [ safe.write, RateLimit(size, MAX_DOWNLOAD_SPEED) ]
+    return ResumableFileTransaction(partialKey(resourceID, contentSignature), tmppath)
+
+class BlockVerifier(object):
+    """
+    Verifies the consecutive blocks of a stream against a (signed) block hash manifest as 
+    they arrive. To be used as a callback, i.e. it is called with the consecutive buffers
+    read from the stream. A CloneContentError is raised as soon as a block doesn't match.
+    """
+    def __init__(self, blockHashes, offset = 0):
+        """
+        @param blockHashes: a tuple of the block size and the list of hex digests, as returned by Resource.blockHashes()
+        @param offset: the offset of the stream in the contents, must be at a block boundary
+        """
+        (self.blockSize, self.digests) = blockHashes
+        assert offset % self.blockSize == 0, "offset %d is not at a block boundary" % offset
+        self.offset = offset
+        # the number of bytes at the beginning of the contents that have been verified
+        self.verified = offset
+        self._hasher = BlockHasher(self.blockSize)
+        self._checked = 0
+
+    def __call__(self, buf):
+        self._hasher(buf)
+        self._check(self._hasher.digests)
+
+    def finish(self):
+        """
+        Verify the last (incomplete) block, too.
+        """
+        self._check(self._hasher.hexdigests())
+
+    def _check(self, digests):
+        for digest in digests[self._checked:]:
+            block = self.offset / self.blockSize + self._checked
+            if block >= len(self.digests) or digest != self.digests[block]:
+                raise CloneContentError("Block %d does not match the block hash manifest" % block)
+            self._checked += 1
+            self.verified += self.blockSize
+
+def readResponseIntoFile(resource, referenceClone):
+    """
+    Download the contents of the reference clone into the resource's file. The contents
+    are hashed as they arrive, and the file is only replaced if they match the (verified) 
+    content signature of the reference clone. Otherwise, the download is discarded and a 
+    CloneContentError is raised.
+    
+    If the download is interrupted, the data downloaded so far is kept (keyed by resource 
+    ID and content signature) and the next attempt -- from any clone with the same 
+    contents -- resumes where this one stopped.
+    
+    If the clone has a block hash manifest, each block is verified as it arrives. The download
+    is aborted at the first corrupt block, but the blocks before it are kept for resuming.
+    The blocks kept from a previous download are verified again before resuming.
+    Without a manifest, the resumed data can't be verified on its own. If the contents don't
+    match, the download is repeated from scratch, since the resumed data may be to blame 
+    rather than the clone.
+    """
+    expectedSignature = referenceClone.contentSignature()
+    if not referenceClone.validateMetaData():
+        raise CloneContentError("Metadata signature of clone %s is incorrect" % str(referenceClone))
+    blockHashes = referenceClone.blockHashes()
+    if not _download(resource, referenceClone, expectedSignature, blockHashes, True):
+        log.info("resumed download of '%s' does not match, downloading it from scratch", str(referenceClone))
+        _download(resource, referenceClone, expectedSignature, blockHashes, False)
+
+def _download(resource, referenceClone, expectedSignature, blockHashes, resume):
+    """
+    @see readResponseIntoFile
+    @param resume: whether to resume a previous download
+    @return True if the contents have been committed, False if they don't match the 
+        content signature, and resumed data that could not be verified may be to blame
+    @raise CloneContentError: if the contents delivered by the clone are corrupt
+    """
+    t = downloadTransaction(referenceClone.resourceID(), expectedSignature)
+    hashObj = getHashObject()
+    safe = t.open(resource.fp.path)
+    verifier = None
     try:
-        numbytesread = bufferedReadLoop(stream.read, 4096, size, callbacks)
-        assert numbytesread == size, "Download size does not match expected size"
+        if not resume:
+            t.truncate()
+        offset = t.size()
+        if blockHashes is not None and offset % blockHashes[0] != 0:
+            # resume at a block boundary, so that all blocks can be verified
+            offset -= offset % blockHashes[0]
+            t.truncate(offset)
+        if blockHashes is not None and offset > 0:
+            # the data we already have may be corrupt, too, only keep the blocks that match
+            verified = verifiedPrefix(t.safename, offset, blockHashes)
+            if verified < offset:
+                log.info("discarding partial download of '%s' from byte %d, it does not match the block hashes",
+                         str(referenceClone), verified)
+                offset = verified
+                t.truncate(offset)
+        if offset > 0:
+            # the hash must cover the data we already have
+            partial = open(t.safename, 'rb')
+            try:
+                bufferedReadLoop(partial.read, 16384, offset, [hashObj.update])
+            finally:
+                partial.close()
+        (stream, size) = openFrom(referenceClone, offset)
+        if size is None:
+            # the clone can't resume our partial download, start from scratch
+            t.truncate()
+            offset = 0
+            hashObj = getHashObject()
+            (stream, size) = openFrom(referenceClone, 0)
+        elif offset > 0:
+            log.info("resuming download of '%s' at byte %d", str(referenceClone), offset)
+        remaining = size - offset
+        callbacks = [ safe.write, hashObj.update, RateLimit(remaining, MAX_DOWNLOAD_SPEED) ]
+        if blockHashes is not None:
+            verifier = BlockVerifier(blockHashes, offset)
+            callbacks.append(verifier)
+        numbytesread = bufferedReadLoop(stream.read, 4096, remaining, callbacks)
+        assert numbytesread == remaining, "Download size does not match expected size"
+        if verifier is not None:
+            verifier.finish()
+        if hashObj.hexdigest() != expectedSignature:
+            t.discard()
+            if offset > 0 and verifier is None:
+                return False
+            raise CloneContentError("Content of clone %s does not match its content signature" % str(referenceClone))
     except Exception, e:
         log.warn("Error while downloading clone '%s'" % str(referenceClone), exc_info = e)
+        if verifier is not None and t.safe is not None:
+            # only keep the blocks that have been verified
+            t.truncate(verifier.verified)
         t.cleanup()
         raise
     else:
         t.commit()
+        return True
+
+def verifiedPrefix(path, length, blockHashes):
+    """
+    Verify the first length bytes of the file against the block hash manifest.
+    
+    @param length: must be at a block boundary
+    @return the number of bytes at the beginning of the file that match the manifest
+    """
+    verifier = BlockVerifier(blockHashes)
+    f = open(path, 'rb')
+    try:
+        try:
+            bufferedReadLoop(f.read, 16384, length, [verifier])
+        except CloneContentError:
+            pass
+    finally:
+        f.close()
+    return verifier.verified
+
+def openFrom(referenceClone, offset):
+    """
+    Request the contents of the clone from offset to the end.
+    
+    @return a tuple (stream, size) of the response and the total size of the contents. If 
+        the clone does not deliver the requested range, size is None.
+    """
+    if offset == 0:
+        stream = referenceClone.open()
+        return (stream, long(stream.getheader('Content-Length')))
+    stream = referenceClone.openFrom(offset)
+    if stream.status == responsecode.PARTIAL_CONTENT:
+        size = contentRangeSize(stream.getheader('Content-Range'))
+        if size is not None and size - offset == long(stream.getheader('Content-Length')):
+            return (stream, size)
+    log.debug("clone '%s' did not honour range request (status %d)", str(referenceClone), stream.status)
+    stream.close()
+    return (stream, None)
+    
+
+def fetchRange(clone, offset, length, callbacks):
+    """
+    Request a byte range of the contents of the clone and read it into the callbacks.
     
+    @param callbacks: list of callbacks to be called with each buffer read (see bufferedReadLoop)
+    @raise CloneError: if the clone doesn't honour the range request
+    @raise CloneIOError: if the clone doesn't deliver the complete range
+    """
+    endoffset = offset + length - 1 # the http range request includes the last byte
+    response = clone.remote.performRequest("GET", {'range': rangeHeader(offset, endoffset)})
+    if response.status != responsecode.PARTIAL_CONTENT or \
+            long(response.getheader('Content-Length')) != length:
+        response.close()
+        raise CloneError("Clone %s did not honour range request, status: %d" % (str(clone), response.status))
+    try:
+        bytesread = bufferedReadLoop(response.read, 16384, length, callbacks)
+    except:
+        response.close()
+        raise
+    if bytesread != length:
+        raise CloneIOError("Clone %s delivered %d instead of %d bytes" % (str(clone), bytesread, length))
 
 def updateMetaData(resource, referenceClone):    
     # then update the metadata
@@ -61,6 +257,15 @@ def updateMetaData(resource, referenceClone):
     for key in keysToBeUpdated:
         pp = referenceClone.getProperty(key)
         resource.deadProperties().set(pp)
+    
+    # optional keys must be removed if the reference clone doesn't have them, the 
+    # metadata signature would be broken otherwise
+    for key in elements.optionalSignedKeys:
+        pp = referenceClone.optionalProperty(key)
+        if pp is not None:
+            resource.deadProperties().set(pp)
+        elif resource.deadProperties().contains(key.qname()):
+            resource.deadProperties().delete(key.qname())
         
     
 def updateLocal(resource, referenceClone):
@@ -87,6 +292,18 @@ def broadCastAddress(localResource):
     return broadCastAddressToClones(localResource, localResource.clones())
 
     
+class _LocalResourceBroadCaster(object):
+    """
+    Class to be used as a callable callback for broadcasting the local
+    resource to the given remote clone. Unlike a closure, it can be passed 
+    to a worker process.
+    """
+    def __init__(self, localResource):
+        self.res = localResource
+    def __call__(self, clone):
+        clone.announce(self.res) # should never fail, as defined!
+        return 0
+
 def broadCastAddressToClones(localResource, targetClones):
     """
     Broadcast availability of local clone to remote destinations.
@@ -99,18 +316,7 @@ def broadCastAddressToClones(localResource, targetClones):
     
     t1 = time.time()
 
-    class _LocalResourceBroadCaster(object):
-        """
-        Class to be used as a callable callback for broadcasting the local
-        resource to the given remote clone. (Could also be done with a closure)
-        """
-        def __init__(self, localResource):
-            self.res = localResource
-        def __call__(self, clone):
-            clone.announce(self.res) # should never fail, as defined!
-            return 0
-
     broadcaster = _LocalResourceBroadCaster(localResource)
-    dowork(broadcaster, targetClones)
+    dowork(broadcaster, targetClones, threadsafe = True)
 
     log.debug("speed: broadcast took %s sec", str(time.time() - t1))
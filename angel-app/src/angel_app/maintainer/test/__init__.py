@@ -1 +1 @@
-all = ["clientTest", "collectTest", "mountTest"]
\ No newline at end of file
+all = ["clientTest", "collectTest", "inspectorTest", "mountTest", "scheduleTest"]
\ No newline at end of file
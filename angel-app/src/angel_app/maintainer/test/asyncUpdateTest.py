@@ -0,0 +1,104 @@
+"""
+Tests for the asynchronous inspection of resources.
+"""
+
+from angel_app.config import config
+from angel_app.maintainer import asyncUpdate
+from angel_app.maintainer import update
+from angel_app.resource.local.internal.resource import Crypto
+from angel_app.resource.local.resourceHandle import ResourceHandle
+from angel_app.resource.local.test.localResourceTest import LocalResourceTest
+from angel_app.resource.remote.clone import Clone
+from angel_app.resource.remote.propertyCache import getPropertyCache
+from angel_app.resource.remote.test.asyncRemoteTest import wait
+from twisted.internet import defer
+from twisted.internet import reactor
+
+AngelConfig = config.getConfig()
+providerport = AngelConfig.getint("provider","listenPort")
+
+# numeric loopback addresses other than 127.0.0.1, which would be eliminated as self references,
+# one per clone, since clones on the same host are considered doubles
+PEER = "127.0.0.2"
+UNREACHABLE = "127.0.0.3"
+BADPEER = "127.0.0.4"
+
+class AsyncUpdateTest(LocalResourceTest):
+
+    def setUp(self):
+        super(AsyncUpdateTest, self).setUp()
+        assert Clone().ping(), "locally running provider instance required"
+        getPropertyCache().clear()
+        # the reactor's thread pool is only started along with the reactor, which the tests don't run
+        reactor.suggestThreadPoolSize(4)
+        reactor.threadpool.start()
+        self.good = Clone(PEER, providerport, "/TEST/file.txt")
+        self.unreachable = Clone(UNREACHABLE, 1, "/TEST/file.txt")
+        # reachable, but a different resource
+        self.bad = Clone(BADPEER, providerport, "/TEST/")
+
+    def tearDown(self):
+        reactor.threadpool.stop()
+        super(AsyncUpdateTest, self).tearDown()
+
+    def testClonesFor(self):
+        checked = wait(asyncUpdate.clonesFor(self.testFile, [self.good, self.unreachable, self.bad],
+                                             self.testFile.publicKeyString(), self.testFile.resourceID()))
+        assert len(checked) == 3
+        assert set(checked) == set([(self.good, True, True), (self.unreachable, False, False), (self.bad, True, False)])
+
+    def testValidateClone(self):
+        """
+        Clones are validated by range digests if the local resource is valid, by their metadata
+        otherwise.
+        """
+        validate = asyncUpdate.ValidateClone(self.testFile)
+        assert validate._doByteRangeValidation
+        assert wait(validate(self.good))
+        assert not wait(validate(self.bad))
+        validate._doByteRangeValidation = False
+        assert wait(validate(self.good))
+        assert not wait(validate(self.bad))
+
+    def testUpdateResource(self):
+        self.testFile.deadProperties().set(update.clonesToElement([self.good, self.unreachable, self.bad]))
+        (isValid, dummybroadcastClones, prefetched, cloneLists) = wait(asyncUpdate.updateResource(self.testFile))
+        assert isValid
+        assert prefetched == {}
+        assert cloneLists.good == [self.good]
+        assert cloneLists.unreachable == [self.unreachable]
+        assert cloneLists.bad == [self.bad]
+        # the bad clone is dropped from the stored clones
+        stored = self.testFile.clones()
+        assert self.good in stored
+        assert self.bad not in stored
+
+    def testInspectTree(self):
+        self.testDirectory.deadProperties().set(update.clonesToElement([Clone(PEER, providerport, "/TEST/")]))
+        assert wait(asyncUpdate.inspectTree(ResourceHandle(self.testDirPath))) == 2
+
+    def testMaxInFlight(self):
+        """
+        No more than maxInFlight resources are inspected at a time.
+        """
+        for ii in range(5):
+            path = self.testDirPath + "/child%d" % ii
+            open(path, 'w').write(self.testText)
+            Crypto(path)._registerWithParent()
+        counts = {"running" : 0, "most" : 0}
+        def inspectResource(af, prefetchedClones = None):
+            counts["running"] += 1
+            counts["most"] = max(counts["most"], counts["running"])
+            inspecting = defer.Deferred()
+            def inspected():
+                counts["running"] -= 1
+                inspecting.callback((True, {}, True, None))
+            reactor.callLater(0.01, inspected)
+            return inspecting
+        original = asyncUpdate.inspectResource
+        asyncUpdate.inspectResource = inspectResource
+        try:
+            assert wait(asyncUpdate.inspectTree(ResourceHandle(self.testDirPath), 2)) == 7
+        finally:
+            asyncUpdate.inspectResource = original
+        assert counts["most"] == 2
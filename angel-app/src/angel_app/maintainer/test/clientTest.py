@@ -7,6 +7,7 @@ from angel_app.resource.remote.clone import Clone
 import unittest
 import os
 from angel_app.resource.local.basic import Basic
+from angel_app.resource.local.resourceHandle import ResourceHandle
 
 getConfig().container['common']['loglevel'] = 'DEBUG' # global loglevel
 try:
@@ -34,8 +35,9 @@ class CollectTest(unittest.TestCase):
         #print "parent writability: ", polM221eResource.parent().isWritableFile()
         #print "public key string: ", polM221eResource.publicKeyString()
         #print "parent public key string: ", polM221eResource.parent().publicKeyString()
-        assert polM221eResource not in client.getChildren(polResource)
-        print client.getChildren(polResource)
+        children = client.getChildren(ResourceHandle(polPath))
+        assert polM221eResource.fp.path not in [child.path for child in children]
+        print children
 
 
         
\ No newline at end of file
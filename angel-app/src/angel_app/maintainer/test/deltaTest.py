@@ -0,0 +1,78 @@
+"""
+Tests for updating a file by transferring only the blocks that changed.
+"""
+
+from angel_app.config import config
+from angel_app.maintainer import delta
+from angel_app.resource.local.basic import Basic
+from angel_app.resource.local.internal.resource import Crypto
+from angel_app.resource.local.test.localResourceTest import LocalResourceTest
+from angel_app.resource.remote.clone import Clone
+from angel_app.resource.remote.exceptions import CloneContentError
+from angel_app.resource.util import getHashObject
+import os
+import random
+
+AngelConfig = config.getConfig()
+
+BLOCKSIZE = 4096
+
+def randomData(size):
+    return "".join([chr(random.randint(0, 255)) for dummyii in range(size)])
+
+class DeltaTest(LocalResourceTest):
+
+    def setUp(self):
+        super(DeltaTest, self).setUp()
+        self.oldData = randomData(3 * BLOCKSIZE + 100)
+        self.newData = self.oldData[:3 * BLOCKSIZE] + randomData(2 * BLOCKSIZE)
+        self.bigFilePath = os.path.join(self.testDirPath, "big.bin")
+        open(self.bigFilePath, 'wb').write(self.newData)
+        bigFile = Crypto(self.bigFilePath)
+        bigFile.blockSize = BLOCKSIZE
+        bigFile._registerWithParent()
+        bigFile._updateMetadata()
+        self.clone = Clone("localhost", AngelConfig.getint("provider", "listenPort"), "/TEST/big.bin")
+        assert self.clone.ping(), "locally running provider instance required"
+        self.clone.getPropertyManager().invalidateCache()
+        # the outdated local copy
+        self.copyPath = os.path.join(self.testDirPath, "copy.bin")
+        open(self.copyPath, 'wb').write(self.oldData)
+
+    def testPlan(self):
+        """
+        Blocks found in the local copy must be copied, adjacent blocks must be merged.
+        """
+        digests = [getHashObject(cc * 10).hexdigest() for cc in "abcde"]
+        blocks = {digests[0] : (0, 10), digests[1] : (10, 10), digests[3] : (50, 10)}
+        runs = delta.plan((10, digests), 45, blocks)
+        assert [(run.offset, run.length, run.localOffset) for run in runs] == \
+            [(0, 20, 0), (20, 10, None), (30, 10, 50), (40, 5, None)]
+
+    def testAppend(self):
+        """
+        Appended data must be fetched, the rest copied from the local copy.
+        """
+        runs = delta.plan(self.clone.blockHashes(), len(self.newData), delta.localBlocks(self.copyPath, BLOCKSIZE))
+        assert [(run.offset, run.length, run.localOffset) for run in runs] == \
+            [(0, 3 * BLOCKSIZE, 0), (3 * BLOCKSIZE, 2 * BLOCKSIZE, None)]
+        assert delta.download(Basic(self.copyPath), self.clone)
+        assert self.newData == open(self.copyPath, 'rb').read()
+
+    def testNotWorthwhile(self):
+        """
+        If nothing can be re-used, nothing must be transferred.
+        """
+        open(self.copyPath, 'wb').write(randomData(len(self.oldData)))
+        assert not delta.download(Basic(self.copyPath), self.clone)
+        os.remove(self.copyPath)
+        assert not delta.download(Basic(self.copyPath), self.clone)
+
+    def testCorruptBlock(self):
+        """
+        A changed block that doesn't match the block hash manifest must be rejected, 
+        and the local copy must be left alone.
+        """
+        open(self.bigFilePath, 'wb').write(self.newData[:-1] + "x")
+        self.assertRaises(CloneContentError, delta.download, Basic(self.copyPath), self.clone)
+        assert self.oldData == open(self.copyPath, 'rb').read()
@@ -0,0 +1,123 @@
+"""
+Tests for the concurrent inspection of resources.
+"""
+
+from angel_app.maintainer import inspector
+from angel_app.maintainer.inspector import Inspector
+from angel_app.worker import WorkerError
+import threading
+import time
+import unittest
+
+class Recorder(object):
+    """
+    An inspection function that records the inspections running at the same time.
+    """
+    def __init__(self, duration = 0.05):
+        self.duration = duration
+        self.lock = threading.Lock()
+        self.running = []
+        self.started = []
+        self.maxRunning = 0
+        self.overlaps = []
+
+    def __call__(self, path):
+        self.lock.acquire()
+        try:
+            for other in self.running:
+                self.overlaps.append((other, path))
+            self.running.append(path)
+            self.started.append(path)
+            self.maxRunning = max(self.maxRunning, len(self.running))
+        finally:
+            self.lock.release()
+        time.sleep(self.duration)
+        self.lock.acquire()
+        try:
+            self.running.remove(path)
+        finally:
+            self.lock.release()
+        if path == "/fail":
+            raise ValueError(path)
+        return path
+
+def collect(anInspector):
+    finished = []
+    while len(anInspector) > 0:
+        finished.extend(anInspector.results(5))
+    return finished
+
+class InspectorTest(unittest.TestCase):
+
+    def testRelated(self):
+        assert inspector.related("/a", "/a/")
+        assert inspector.related("/a/b", "/a")
+        assert inspector.related("/", "/a/")
+        assert not inspector.related("/", "/a/b")
+        assert not inspector.related("/a", "/ab")
+        assert not inspector.related("/a/b", "/a/c")
+
+    def testConcurrency(self):
+        recorder = Recorder()
+        anInspector = Inspector(4, 4)
+        paths = ["/%d" % ii for ii in range(8)]
+        for path in paths:
+            anInspector.submit(path, set(), recorder, path)
+        finished = collect(anInspector)
+        assert sorted([inspection.result for inspection in finished]) == sorted(paths)
+        assert recorder.maxRunning == 4
+        assert anInspector.completed == 8
+
+    def testPerPeerLimit(self):
+        recorder = Recorder()
+        anInspector = Inspector(4, 1)
+        for ii in range(4):
+            anInspector.submit("/a%d" % ii, set(["a.example.org"]), recorder, "/a%d" % ii)
+            anInspector.submit("/b%d" % ii, set(["b.example.org"]), recorder, "/b%d" % ii)
+        collect(anInspector)
+        for (one, other) in recorder.overlaps:
+            assert one[1] != other[1], "%s and %s are cloned on the same peer" % (one, other)
+        assert recorder.maxRunning == 2
+
+    def testParentsBeforeChildren(self):
+        recorder = Recorder()
+        anInspector = Inspector(4, 4)
+        for path in ["/a", "/a/b", "/c", "/a/b/d", "/a/e"]:
+            anInspector.submit(path, set(), recorder, path)
+        collect(anInspector)
+        for (one, other) in recorder.overlaps:
+            assert not inspector.related(one, other), "%s and %s were inspected at the same time" % (one, other)
+        started = recorder.started
+        assert started.index("/a") < started.index("/a/b") < started.index("/a/b/d")
+        assert started.index("/a") < started.index("/a/e")
+
+    def testRootWhileChildrenInFlight(self):
+        """
+        The inspection of the root must neither wait for, nor hold back, the inspections of
+        resources further down the tree.
+        """
+        recorder = Recorder(0.2)
+        anInspector = Inspector(4, 4)
+        for path in ["/a/b", "/c/d", "/", "/e/f"]:
+            anInspector.submit(path, set(), recorder, path)
+        collect(anInspector)
+        assert recorder.maxRunning == 4
+        overlaps = [set(pair) for pair in recorder.overlaps]
+        assert set(["/a/b", "/"]) in overlaps
+        assert set(["/", "/e/f"]) in overlaps
+
+    def testFailure(self):
+        anInspector = Inspector(2, 2)
+        anInspector.submit("/fail", set(), Recorder(0), "/fail")
+        finished = collect(anInspector)
+        assert isinstance(finished[0].result, WorkerError)
+        assert finished[0].result.type() == ValueError
+
+    def testCapacity(self):
+        anInspector = Inspector(2, 2)
+        assert anInspector.capacity() == 4
+        assert anInspector.results(0) == []
+        anInspector.submit("/a", set(), Recorder(), "/a")
+        assert anInspector.capacity() == 3
+        collect(anInspector)
+        assert anInspector.capacity() == 4
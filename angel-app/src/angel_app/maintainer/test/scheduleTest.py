@@ -0,0 +1,140 @@
+"""
+Tests for the maintainer schedule.
+"""
+
+from angel_app.maintainer import client
+from angel_app.maintainer import schedule
+from angel_app.maintainer.schedule import Replication
+from angel_app.maintainer.schedule import Schedule
+from angel_app.maintainer.schedule import ScheduleEntry
+from angel_app.resource.local.resourceHandle import ResourceHandle
+from angel_app.resource.local.test.localResourceTest import LocalResourceTest
+import os
+import tempfile
+import unittest
+
+DAY = 86400.0
+
+def makeEntry(interval = None, revision = None, changed = None, failures = 0):
+    return ScheduleEntry("/foo", 0.0, interval, revision, changed, 0, 0, 0, 0, failures, None, None)
+
+class NextIntervalTest(unittest.TestCase):
+
+    def nextInterval(self, entry, isValid = True, revision = 1, goodClones = 5, now = 1000 * DAY):
+        return schedule.nextInterval(entry, isValid, revision, goodClones, DAY, 2, now)
+
+    def testNew(self):
+        assert self.nextInterval(makeEntry()) == schedule.NEW_INTERVAL
+
+    def testChanged(self):
+        assert self.nextInterval(makeEntry(DAY, 1), revision = 2) == schedule.MIN_INTERVAL
+
+    def testBackOff(self):
+        assert self.nextInterval(makeEntry(3600.0, 1)) == 7200.0
+        assert self.nextInterval(makeEntry(DAY, 1)) == DAY
+        # resources that changed recently are not left alone for long
+        assert self.nextInterval(makeEntry(3600.0, 1, changed = 1000 * DAY - 2000.0)) == 1000.0
+
+    def testUnderReplicated(self):
+        assert self.nextInterval(makeEntry(DAY, 1), goodClones = 1) == schedule.UNDERREPLICATED_INTERVAL
+
+    def testFailures(self):
+        intervals = [self.nextInterval(makeEntry(DAY, 1, failures = ff), isValid = False) for ff in range(10)]
+        assert intervals[0] == schedule.MIN_INTERVAL
+        assert intervals == sorted(intervals)
+        assert intervals[-1] == schedule.FAILURE_INTERVAL
+
+class ScheduleTest(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.schedulePath) = tempfile.mkstemp(".sqlite")
+        os.close(fd)
+        self.schedule = Schedule(self.schedulePath, DAY, 2)
+
+    def tearDown(self):
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.exists(self.schedulePath + suffix):
+                os.remove(self.schedulePath + suffix)
+
+    def testQueue(self):
+        assert self.schedule.next() is None
+        assert self.schedule.add("/a/", 20.0)
+        assert self.schedule.add("/b", 10.0)
+        assert not self.schedule.add("/a", 0.0)
+        assert self.schedule.next().path == "/b"
+        self.schedule.expedite("/a", 5.0)
+        assert self.schedule.next().path == "/a"
+        # expediting never postpones
+        self.schedule.expedite("/a", 30.0)
+        assert self.schedule.next().due == 5.0
+        assert len(self.schedule) == 2
+        assert self.schedule.dueCount(15.0) == 2
+
+    def testRecord(self):
+        self.schedule.add("/a")
+        entry = self.schedule.record(self.schedule.get("/a"), True, 1, Replication(3), True, now = 100.0)
+        assert self.schedule.get("/a").revision == 1
+        assert entry.changed is None
+        assert entry.scrubbed == 100.0
+        assert entry.due > 100.0
+        entry = self.schedule.record(entry, False, now = 200.0)
+        assert self.schedule.get("/a").failures == 1
+        entry = self.schedule.record(entry, True, 2, Replication(3), now = 300.0)
+        entry = self.schedule.get("/a")
+        assert (entry.revision, entry.changed, entry.failures, entry.goodClones) == (2, 300.0, 0, 3)
+        assert entry.interval == schedule.MIN_INTERVAL
+
+    def testReplicationDeficitFirst(self):
+        for path in ["/a", "/b", "/c", "/d"]:
+            self.schedule.add(path, 0.0)
+        # a resource that is not due yet is not preferred, however few clones it has
+        self.schedule.add("/e", 10 * DAY)
+        self.schedule.record(self.schedule.get("/a"), True, 1, Replication(3), now = 0.0)
+        self.schedule.record(self.schedule.get("/b"), True, 1, Replication(1, 2), now = 0.0)
+        self.schedule.record(self.schedule.get("/c"), True, 1, Replication(0, 0, 3), now = 0.0)
+        # "/d" has not been inspected yet, so it comes first, then the resource with fewest good clones
+        assert self.schedule.next(DAY).path == "/d"
+        self.schedule.record(self.schedule.get("/d"), True, 1, Replication(2), now = 0.0)
+        assert self.schedule.next(DAY).path == "/c"
+        self.schedule.record(self.schedule.get("/c"), True, 1, Replication(2), now = 0.0)
+        assert self.schedule.next(DAY).path == "/b"
+
+    def testDue(self):
+        for path in ["/a", "/b", "/c", "/d"]:
+            self.schedule.add(path, 0.0)
+        self.schedule.add("/e", 10 * DAY)
+        self.schedule.record(self.schedule.get("/a"), True, 1, Replication(3), now = 0.0)
+        self.schedule.record(self.schedule.get("/b"), True, 1, Replication(1), now = 0.0)
+        self.schedule.record(self.schedule.get("/c"), True, 1, Replication(0), now = 0.0)
+        assert [entry.path for entry in self.schedule.due(DAY, 10)] == ["/d", "/c", "/b", "/a"]
+        assert [entry.path for entry in self.schedule.due(DAY, 2, set(["/d"]))] == ["/c", "/b"]
+        assert [entry.path for entry in self.schedule.due(1.0, 10)] == ["/d"]
+
+    def testReplicationLevels(self):
+        for path in ["/a", "/b", "/c"]:
+            self.schedule.add(path, 0.0)
+        self.schedule.record(self.schedule.get("/a"), True, 1, Replication(3), now = 0.0)
+        self.schedule.record(self.schedule.get("/b"), True, 1, Replication(1, 1, 1, 1), now = 0.0)
+        assert self.schedule.replicationLevels() == {None: 1, 1: 1, 3: 1}
+        underReplicated = self.schedule.underReplicated()
+        assert [entry.path for entry in underReplicated] == ["/b"]
+        entry = underReplicated[0]
+        assert (entry.goodClones, entry.oldClones, entry.unreachableClones, entry.badClones) == (1, 1, 1, 1)
+        # an inspection that doesn't find out about the clones keeps the previous replication
+        entry = self.schedule.record(entry, False, now = 10.0)
+        assert (entry.goodClones, entry.oldClones) == (1, 1)
+
+    def testRemove(self):
+        self.schedule.add("/a")
+        self.schedule.add("/a/b")
+        self.schedule.add("/ab")
+        self.schedule.remove("/a/")
+        assert len(self.schedule) == 1
+        assert self.schedule.get("/ab") is not None
+
+class ReferencedTest(LocalResourceTest):
+
+    def testIsReferenced(self):
+        assert client.isReferenced(ResourceHandle(self.testFilePath))
+        assert client.isReferenced(ResourceHandle(self.testDirPath))
+        assert not client.isReferenced(ResourceHandle(os.path.join(self.testDirPath, "unlinked")))
@@ -0,0 +1,76 @@
+"""
+Tests for downloading a file from several clones at once.
+"""
+
+from angel_app.config import config
+from angel_app.maintainer import swarm
+from angel_app.maintainer import sync
+from angel_app.resource.local.basic import Basic
+from angel_app.resource.local.internal.resource import Crypto
+from angel_app.resource.local.test.localResourceTest import LocalResourceTest
+from angel_app.resource.remote.clone import Clone
+from angel_app.resource.remote.exceptions import CloneContentError
+import os
+import random
+
+AngelConfig = config.getConfig()
+
+class SwarmTest(LocalResourceTest):
+
+    def setUp(self):
+        super(SwarmTest, self).setUp()
+        self.bigFilePath = os.path.join(self.testDirPath, "big.bin")
+        self.data = "".join([chr(random.randint(0, 255)) for dummyii in range(100000)])
+        open(self.bigFilePath, 'wb').write(self.data)
+        bigFile = Crypto(self.bigFilePath)
+        # use blocks that are smaller than the segments
+        bigFile.blockSize = 4096
+        bigFile._registerWithParent()
+        bigFile._updateMetadata()
+        # the provider and the presenter serve the same repository
+        self.clones = [Clone("localhost", AngelConfig.getint("provider", "listenPort"), "/TEST/big.bin"),
+                       Clone("localhost", AngelConfig.getint("presenter", "listenPort"), "/TEST/big.bin")]
+        assert self.clones[0].ping(), "locally running provider instance required"
+        for cc in self.clones:
+            cc.getPropertyManager().invalidateCache()
+        self.copyPath = os.path.join(self.testDirPath, "copy.bin")
+
+    def testDownload(self):
+        swarm.download(Basic(self.copyPath), self.clones, segmentSize = 8192)
+        assert self.data == open(self.copyPath, 'rb').read()
+
+    def testInvalidContents(self):
+        """
+        Contents that don't match the content signature must be discarded.
+        """
+        open(self.bigFilePath, 'wb').write(self.data[:-1] + chr((ord(self.data[-1]) + 1) % 256))
+        self.assertRaises(CloneContentError, swarm.download, Basic(self.copyPath), self.clones, 8192)
+        assert not os.path.exists(self.copyPath)
+
+    def testCorruptSegment(self):
+        """
+        Segments that don't match the block hash manifest must be rejected, while the 
+        segments before them are kept for resuming.
+        """
+        corrupt = chr((ord(self.data[50000]) + 1) % 256)
+        open(self.bigFilePath, 'wb').write(self.data[:50000] + corrupt + self.data[50001:])
+        self.assertRaises(CloneContentError, swarm.download, Basic(self.copyPath), self.clones, 8192)
+        assert not os.path.exists(self.copyPath)
+        t = sync.downloadTransaction(self.clones[0].resourceID(), self.clones[0].contentSignature())
+        assert t.size() == 49152
+        t.discard()
+
+    def testSegments(self):
+        ss = swarm.Swarm(None, 10, 100, 40)
+        assert [(segment.offset, segment.length) for segment in ss.segments] == [(10, 40), (50, 40), (90, 10)]
+        first = ss.nextSegment()
+        second = ss.nextSegment()
+        third = ss.nextSegment()
+        assert ss.contiguousSize() == 10
+        # when all segments are handed out, the oldest one is fetched a second time
+        assert ss.nextSegment() is first
+        first.done = True
+        assert ss.contiguousSize() == 50
+        assert ss.nextSegment() is second
+        assert ss.nextSegment() is third
+        assert ss.nextSegment() is None
@@ -0,0 +1,117 @@
+"""
+Tests for synchronizing a local resource from a single clone.
+"""
+
+from angel_app.maintainer import sync
+from angel_app.resource.local.basic import Basic
+from angel_app.resource.local.test.localResourceTest import LocalResourceTest
+from angel_app.resource.remote.clone import Clone
+from angel_app.resource.remote.exceptions import CloneContentError
+from angel_app.resource.util import BLOCK_SIZE
+from angel_app.resource.util import getHashObject
+from angel_app.singlefiletransaction import ResumableFileTransaction
+import os
+
+class SyncTest(LocalResourceTest):
+
+    def setUp(self):
+        super(SyncTest, self).setUp()
+        self.remoteFile = Clone("localhost", path = "/TEST/file.txt")
+        assert self.remoteFile.ping(), "locally running provider instance required"
+        self.remoteFile.getPropertyManager().invalidateCache()
+        self.copyPath = os.path.join(self.testDirPath, "copy.txt")
+
+    def testReadResponseIntoFile(self):
+        """
+        Content that matches the content signature must be committed.
+        """
+        sync.readResponseIntoFile(Basic(self.copyPath), self.remoteFile)
+        assert self.testText == open(self.copyPath).read()
+
+    def testReadInvalidResponseIntoFile(self):
+        """
+        Content that doesn't match the content signature must be discarded.
+        """
+        open(self.testFilePath, 'w').write("tampered with")
+        self.assertRaises(CloneContentError, sync.readResponseIntoFile, Basic(self.copyPath), self.remoteFile)
+        assert not os.path.exists(self.copyPath)
+
+    def partialTransaction(self):
+        return ResumableFileTransaction(sync.partialKey(self.remoteFile.resourceID(), self.remoteFile.contentSignature()))
+
+    def testResume(self):
+        """
+        An interrupted download must be resumed.
+        """
+        t = self.partialTransaction()
+        t.open(self.copyPath).write(self.testText[:5])
+        t.cleanup()
+        sync.readResponseIntoFile(Basic(self.copyPath), self.remoteFile)
+        assert self.testText == open(self.copyPath).read()
+        assert self.partialTransaction().size() == 0
+
+    def testResumeBroken(self):
+        """
+        A broken partial download must never end up in the file. Since the test file has 
+        a block hash manifest, the (incomplete) block is fetched again.
+        """
+        t = self.partialTransaction()
+        t.open(self.copyPath).write("garbage")
+        t.cleanup()
+        sync.readResponseIntoFile(Basic(self.copyPath), self.remoteFile)
+        assert self.testText == open(self.copyPath).read()
+        assert self.partialTransaction().size() == 0
+
+    def testResumeBrokenWithoutManifest(self):
+        """
+        Without a block hash manifest, a broken partial download can't be told from a broken
+        clone: the download is repeated from scratch, rather than blaming the clone.
+        """
+        self.remoteFile.blockHashes = lambda: None
+        t = self.partialTransaction()
+        t.open(self.copyPath).write("garbage")
+        t.cleanup()
+        sync.readResponseIntoFile(Basic(self.copyPath), self.remoteFile)
+        assert self.testText == open(self.copyPath).read()
+        assert self.partialTransaction().size() == 0
+
+    def testResumeCorruptBlocks(self):
+        """
+        Complete blocks of a partial download that don't match the block hash manifest
+        must be fetched again, rather than failing the download.
+        """
+        self.testText = "".join([chr(ii % 256) * BLOCK_SIZE for ii in range(3)])
+        open(self.testFilePath, 'w').write(self.testText)
+        self.testFile._updateMetadata()
+        self.remoteFile.getPropertyManager().invalidateCache()
+        t = self.partialTransaction()
+        # the first block is intact, the second one is not
+        t.open(self.copyPath).write(self.testText[:BLOCK_SIZE] + "x" * (BLOCK_SIZE + 10))
+        t.cleanup()
+        sync.readResponseIntoFile(Basic(self.copyPath), self.remoteFile)
+        assert self.testText == open(self.copyPath).read()
+
+    def testVerifiedPrefix(self):
+        data = "0123456789ab"
+        blockHashes = (4, [getHashObject(data[ii:ii + 4]).hexdigest() for ii in range(0, 12, 4)])
+        path = self.copyPath
+        open(path, 'w').write(data)
+        assert sync.verifiedPrefix(path, 12, blockHashes) == 12
+        open(path, 'w').write("0123x56789ab")
+        assert sync.verifiedPrefix(path, 12, blockHashes) == 4
+
+    def testBlockVerifier(self):
+        """
+        Blocks must be verified as soon as they are complete.
+        """
+        data = "0123456789"
+        blockHashes = (4, [getHashObject(data[ii:ii + 4]).hexdigest() for ii in range(0, 10, 4)])
+        verifier = sync.BlockVerifier(blockHashes, 4)
+        verifier(data[4:7])
+        assert verifier.verified == 4
+        verifier(data[7:])
+        assert verifier.verified == 8
+        verifier.finish()
+        verifier = sync.BlockVerifier(blockHashes)
+        self.assertRaises(CloneContentError, verifier, "0x23")
+        assert verifier.verified == 0
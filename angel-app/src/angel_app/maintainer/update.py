@@ -2,11 +2,16 @@
 Routines for updating a local resource from _all_ accessible remote clones.
 """
 
+import time
 from itertools import chain
 from logging import getLogger
 
+from angel_app import worker
 from angel_app.maintainer import collect
+from angel_app.maintainer import delta
+from angel_app.maintainer import swarm
 from angel_app.maintainer import sync
+from angel_app.resource.local.repositoryIndex import indexResource
 from angel_app.resource.remote.clone import clonesToElement
 from angel_app.resource import childLink
 from angel_app.resource.remote import exceptions as cloneExceptions
@@ -24,6 +29,17 @@ def updateResourceFromClone(resource, referenceClone):
     @return True, if the resource is valid after update, False otherwise
     """
 
+    if not needsUpdate(resource, referenceClone):
+        # all is fine
+        return True
+    else:
+        sync.updateLocal(resource, referenceClone)
+        return resource.validate()
+
+def needsUpdate(resource, referenceClone):
+    """
+    @return whether the local resource is invalid or older than the reference clone
+    """
     try:
         # this will fail, if the resource does not (yet) actually exist on the file system
         old = referenceClone.revision() > resource.revision()
@@ -36,23 +52,92 @@ def updateResourceFromClone(resource, referenceClone):
         # TODO: throws an HTTPError, which is certainly inappropriate..
         old = True
     
-    if resource.exists() and resource.validate() and not old:
-        # all is fine
+    return old or not (resource.exists() and resource.validate())
+
+def updateResourceFromDelta(resource, referenceClone):
+    """
+    Update an outdated file by transferring only the blocks that changed.
+    
+    @param resource the local resource
+    @param referenceClone a (valid, up-to-date) reference clone
+    
+    @return True, if the resource is valid after update, False if the update 
+        failed or a delta transfer is not possible or not worthwhile
+    """
+    if referenceClone.isCollection():
+        return False
+    if not resource.exists() or resource.isCollection():
+        return False
+    if not needsUpdate(resource, referenceClone):
         return True
-    else:
-        sync.updateLocal(resource, referenceClone)
-        return resource.validate()
+    if not delta.download(resource, referenceClone):
+        return False
+    sync.updateMetaData(resource, referenceClone)
+    return resource.validate()
+
+def updateResourceFromSwarm(resource, cloneList):
+    """
+    Update a large file by downloading it from several clones at once.
+    
+    @param resource the local resource
+    @param cloneList a list of (valid, up-to-date) reference clones
+    
+    @return True, if the resource is valid after update, False if the update 
+        failed or downloading from several clones is not worthwhile
+    """
+    if len(cloneList) < 2:
+        return False
+    referenceClone = cloneList[0]
+    if referenceClone.isCollection():
+        return False
+    if resource.exists() and resource.isCollection():
+        return False
+    if referenceClone.contentLength() < swarm.MIN_SWARM_SIZE:
+        return False
+    if not needsUpdate(resource, referenceClone):
+        return True
+    swarm.download(resource, cloneList)
+    sync.updateMetaData(resource, referenceClone)
+    return resource.validate()
 
-def updateResourceFromClones(resource, cloneList):
+def updateResourceFromClones(resource, cloneList, badClones = None):
     """
     Step through a list of clones, synchronizing the local resource, until the resource is valid.
+    
+    @param badClones: if not None, a list to which the clones are appended that turn out to 
+        deliver content that doesn't match their content signature
     """
+    try:
+        if updateResourceFromDelta(resource, cloneList[0]):
+            return
+    except KeyboardInterrupt:
+        raise
+    except cloneExceptions.CloneContentError, e:
+        log.info("Clone %s delivered invalid content: %s", cloneList[0].toURI(), e)
+        if badClones is not None:
+            badClones.append(cloneList[0])
+        cloneList = cloneList[1:]
+    except Exception, e:
+        log.info("Failed to update local resource from changed blocks only", exc_info = e)
+    
+    try:
+        if updateResourceFromSwarm(resource, cloneList):
+            return
+    except KeyboardInterrupt:
+        raise
+    except Exception, e:
+        log.info("Failed to update local resource from several clones at once", exc_info = e)
+        
     for clone in cloneList:
         try:
             if updateResourceFromClone(resource, clone):
                 return
         except KeyboardInterrupt:
             raise
+        except cloneExceptions.CloneContentError, e:
+            log.info("Clone %s delivered invalid content: %s", clone.toURI(), e)
+            if badClones is not None:
+                badClones.append(clone)
         except Exception, e:
             log.info("Failed to update local resource from clone: %s", clone.toURI(),  exc_info = e)
     assert False, "Failed to update local resource %s from clone list." % resource.fp.path
@@ -89,11 +174,13 @@ def discoverResourceID(af):
                 return cl.id
         raise KeyError, "Resource " + af.fp.path + " not found in parent's links: " + af.parent().childLinks()
 
-def discoverSeedClones(af):
+def discoverSeedClones(af, prefetchedClones = None):
     """
     Either return the resource's clones directly (if they exist), or inherit
     them from the parent.
     
+    @param prefetchedClones: a dictionary as returned by prefetchChildClones() for the parent. 
+        Seed clones found in there are replaced by their prefetched counterparts.
     @return: tuple (seedClones, inheritedClones)
     """
     seedclones = []
@@ -104,7 +191,44 @@ def discoverSeedClones(af):
     # clone results in a good, usable clonelist, so we always try to avoid having
     # an empty clone list by always inheriting clones additionally.
     from angel_app.resource.local.propertyManager import inheritClones
-    return (seedclones, inheritClones(af))
+    inheritedclones = inheritClones(af)
+    
+    if prefetchedClones:
+        seedclones = [prefetchedClones.get(prefetchKey(cc), cc) for cc in seedclones]
+        inheritedclones = [prefetchedClones.get(prefetchKey(cc), cc) for cc in inheritedclones]
+    return (seedclones, inheritedclones)
+
+def prefetchKey(clone):
+    """
+    The key of a clone in the dictionary returned by prefetchChildClones(). Inherited clones
+    of collections lack the trailing "/" of the prefetched ones, so we ignore it.
+    """
+    return clone.toURI().rstrip("/")
+
+def prefetchChildren(clone):
+    """
+    @return the prefetched children of the clone, see Clone.prefetchChildren
+    """
+    return clone.prefetchChildren()
+
+def prefetchChildClones(cloneList):
+    """
+    Fetch the metadata of the children of all clones in cloneList, with a single request per clone.
+    Errors are ignored, the children of the respective clones will simply be probed individually.
+    
+    @param cloneList: reachable clones of a collection
+    @return: a dictionary mapping prefetchKey(clone) to a prefetched Clone, for all the children 
+        of the clones in cloneList
+    """
+    prefetchedClones = {}
+    results = worker.dowork(prefetchChildren, cloneList, threadsafe = True)
+    for cc in results:
+        if isinstance(results[cc], worker.WorkerError):
+            log.debug("prefetching children of %r failed: %r", cc, results[cc])
+            continue
+        for child in results[cc]:
+            prefetchedClones[prefetchKey(child)] = child
+    return prefetchedClones
     
 def discoverPublicKey(af):
     if af.exists():
@@ -146,41 +270,49 @@ def discoverBroadCastClones(lclone, cloneList):
             log.debug("got a clone error from %r while discovering broadcast clones: %s", c, repr(e))
     return collect.eliminateDNSDoubles(collect.eliminateSelfReferences(broadcastClones))
 
-def updateResource(lresource):
+def updateResource(lresource, prefetchedClones = None, deepScrub = False):
     """
     Inspect the resource, updating it if necessary.
-    Returns a tuple containing (isValid, newGoodClones)
+    
+    @param prefetchedClones: the children's clones as prefetched for the parent of lresource, or None
+    @param deepScrub: if True, the local resource is validated without relying on the validation cache
+    @return a tuple containing (isValid, newGoodClones, prefetchedChildClones, cloneLists), where 
+        prefetchedChildClones is the dictionary to be passed on to updateResource() for the children 
+        of a valid collection, and cloneLists the collect.CloneLists found
     """
-    (thisClones, inheritedClones) = discoverSeedClones(lresource) 
+    (thisClones, inheritedClones) = discoverSeedClones(lresource, prefetchedClones) 
     cloneLists = collect.iterateClones(
                       lresource,
                       thisClones + inheritedClones,
                       discoverPublicKey(lresource), 
                       discoverResourceID(lresource))
    
-    # When we have no local clones yet, we will have to download the complete
-    # remote clone to validate it, which sucks in terms of speed.
-    # Then, when we have downloaded all clones, we proceed below by redownloading
-    # it again in order to create/update the local clone.
-    # TODO: optimize!!!
+    # When we have no valid local clone yet, only the metadata of the remote clones
+    # has been verified so far. Their contents are verified while we download them,
+    # clones that turn out to be broken are moved to the bad clones.
     if cloneLists.good == []:
         log.info("no good clones found for %s", lresource.fp.path)
     else:
-        updateResourceFromClones(lresource, cloneLists.good)
+        updateResourceFromClones(lresource, cloneLists.good, cloneLists.bad)
+        cloneLists.good = [cc for cc in cloneLists.good if cc not in cloneLists.bad]
 
     if lresource.exists():
         storeClones(lresource, cloneLists.good, cloneLists.old + cloneLists.unreachable)
         removeUnreferencedChildren(lresource)
-        if lresource.validate():
+        if lresource.validate(deepScrub):
+            indexResource(lresource, time.time())
             # Gather the clones to which we want to announce this local resource
             # by taking good, old and bad clones and announcing ourselves to them
             # if they don't know about us yet:
             log.debug("lresource is valid: %s, collecting clones for broadcast...", lresource)
             broadcastClones = discoverBroadCastClones(lresource.makeClone(), chain(cloneLists.good, cloneLists.old, cloneLists.bad))
-            return (True, broadcastClones)
+            prefetchedChildClones = {}
+            if lresource.isCollection():
+                prefetchedChildClones = prefetchChildClones(cloneLists.good + cloneLists.old)
+            return (True, broadcastClones, prefetchedChildClones, cloneLists)
         else:
             log.warn("Resource was not valid after update: %s", lresource.fp.path)
-            return (False, [])
+            return (False, [], {}, cloneLists)
     else:
         log.warn("update did not create local resource for %s", lresource.fp.path)
-        return (False, [])
+        return (False, [], {}, cloneLists)
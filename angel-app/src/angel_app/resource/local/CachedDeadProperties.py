@@ -0,0 +1,112 @@
+import os
+from logging import getLogger
+
+from zope.interface import implements
+
+from angel_app.resource.IDeadPropertyStore import IDeadPropertyStore
+from angel_app.resource.local.metadataCache import getMetadataCache
+
+log = getLogger(__name__)
+
+class CachedDeadProperties(object):
+    """
+    A DeadPropertyStore that answers reads from the process-wide MetadataCache, and
+    passes them on to another store (the backing store) only if the cache misses.
+
+    The backing store must provide a stamp() method, returning a cheap (e.g. a stat)
+    identification of the current version of the resource's metadata, or None if it
+    can not tell (in which case the cache is bypassed). Cached properties are used only
+    while the stamp remains the same.
+    """
+    implements(IDeadPropertyStore)
+
+    def __init__(self, _store):
+        self.store = _store
+        self.cache = getMetadataCache()
+        path = self.store.resource.relativePath().rstrip(os.sep) or os.sep
+        self.key = (self.store.__class__.__name__, path)
+
+    def _update(self, qname, element):
+        """
+        Update the cache after a modification of the property.
+        """
+        stamp = self.store.stamp()
+        if stamp is None:
+            self.cache.invalidate(self.key)
+        else:
+            self.cache.update(self.key, stamp, qname, element)
+
+    def get(self, qname):
+        """
+        @param qname (see twisted.web2.dav.davxml) of the property to look for.
+        """
+        # the stamp must be taken before reading, so that a concurrent modification
+        # can not be cached with the stamp of the old version
+        stamp = self.store.stamp()
+        if stamp is None:
+            return self.store.get(qname)
+        (found, element) = self.cache.lookup(self.key, stamp, qname)
+        if found:
+            return element
+        element = self.store.get(qname)
+        self.cache.update(self.key, stamp, qname, element)
+        return element
+
+    def set(self, property):
+        """
+        @param property -- an instance of twisted.web2.dav.davxml.WebDAVElement
+        """
+        self.store.set(property)
+        self._update(property.qname(), property)
+
+    def delete(self, qname):
+        """
+        @param qname (see twisted.web2.dav.davxml) of the property to look for.
+        """
+        try:
+            self.store.delete(qname)
+        finally:
+            self._update(qname, None)
+
+    def contains(self, qname):
+        """
+        @param qname (see twisted.web2.dav.davxml) of the property to look for.
+        """
+        return self.get(qname) is not None
+
+    def list(self):
+        """
+        """
+        return self.store.list()
+
+    def remove(self):
+        """
+        Remove this entry (and those of the resources below it) from the data base.
+        """
+        (storeName, path) = self.key
+        prefix = path.rstrip(os.sep) + os.sep
+        try:
+            self.store.remove()
+        finally:
+            self.cache.invalidateWhere(lambda key: key[0] == storeName and
+                                       (key[1] == path or key[1].startswith(prefix)))
+
+    def begin(self):
+        """
+        Start a batch of modifications, if the backing store supports them.
+        """
+        if hasattr(self.store, "begin"):
+            self.store.begin()
+
+    def commit(self):
+        if hasattr(self.store, "commit"):
+            self.store.commit()
+
+    def rollback(self):
+        """
+        Discard a batch of modifications. Since we don't know which modifications
+        have been discarded, the cache is cleared.
+        """
+        if hasattr(self.store, "rollback"):
+            self.store.rollback()
+        self.cache.clear()
@@ -1,6 +1,7 @@
 import os
 import cPickle
 import shutil
+import time
 from logging import getLogger
 
 from zope.interface import implements
@@ -8,10 +9,16 @@ from twisted.python.filepath import FilePath
 
 from angel_app.config.config import getConfig
 from angel_app.resource.IDeadPropertyStore import IDeadPropertyStore
+from angel_app.resource.local.elementCodec import DECODE_ERRORS
+from angel_app.resource.local.elementCodec import decode
+from angel_app.resource.local.elementCodec import encode
 from angel_app.singlefiletransaction import SingleFileTransaction
 
 log = getLogger(__name__)
 
+# the (coarsest) granularity of file modification times we expect, in seconds
+MTIME_GRANULARITY = 2
+
 # the root of the angel-app directory tree
 home = getConfig().get("common","angelhome")
 
@@ -41,7 +48,10 @@ class DirectoryDeadProperties(object):
     def __init__(self, _resource):
         self.resource = _resource
         self.metadataPath = FilePath(metadata + os.sep + self.resource.relativePath())
-        self.__sanitize()
+        # the properties read so far, by qname, along with the identity of the file they were read from
+        self._cache = {}
+        # the metadata directory is checked (and created) when it is first accessed
+        self._sanitized = False
     
     def _fileNameFor(self, qname):
         """
@@ -56,25 +66,70 @@ class DirectoryDeadProperties(object):
         returned (if the constructor is doing some non-blocking shizzle, that is).
         So we provide a separate file system sanity check which we call before every call to this
         that hits the file system, to e.g. ensure that the containing directory exists.
+        
+        The check is only done until it has succeeded once (and again after remove()).
         """
+        if self._sanitized:
+            return
         # perform sanity check:
         if os.path.exists(self.metadataPath.path):
-            assert self.metadataPath.isdir(), \
-                "metadata store must be a directory: " + self.metaDataPath.path
+            assert os.path.isdir(self.metadataPath.path), \
+                "metadata store must be a directory: " + self.metadataPath.path
         else:
             log.info("Creating metadata store for: %s", self.metadataPath.path)
             os.mkdir(self.metadataPath.path)
+        self._sanitized = True
+    
+    def _stamp(self, fileName):
+        """
+        @return a tuple identifying the current version of the property file, None if there is none.
+            Since the file is replaced by a rename, a modification always changes the inode number.
+        """
+        try:
+            st = os.stat(fileName)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime, st.st_size)
+        
+    def stamp(self):
+        """
+        @return a cheap identification of the current version of the properties, see CachedDeadProperties.
+            Every modification renames a file into (or removes one from) the metadata directory, which
+            updates the modification time of the directory. Since that time may be coarse (e.g. one second),
+            None is returned while it is too recent to tell later modifications apart.
+        """
+        try:
+            st = os.stat(self.metadataPath.path)
+        except OSError:
+            return None
+        if time.time() - st.st_mtime < MTIME_GRANULARITY:
+            return None
+        return (st.st_ino, st.st_mtime)
         
     def get(self, qname):
         """
         @param qname (see twisted.web2.dav.davxml) of the property to look for.
+        @return the property, None if it does not exist (or can not be read)
         """
         self.__sanitize()
-        obj = None
+        fileName = self._fileNameFor(qname)
+        # a single stat tells us whether the property exists, and whether we have read it already
+        stamp = self._stamp(fileName)
+        if stamp is None:
+            if self._cache.has_key(qname):
+                del self._cache[qname]
+            return None
+        if self._cache.has_key(qname) and self._cache[qname][0] == stamp:
+            return self._cache[qname][1]
         try:
-            obj = cPickle.load(open(self._fileNameFor(qname)))
-        except (IOError, EOFError, cPickle.PickleError):
+            f = open(fileName, 'rb')
+            try:
+                obj = decode(f.read())
+            finally:
+                f.close()
+        except (IOError,) + DECODE_ERRORS:
             return None
+        self._cache[qname] = (stamp, obj)
         return obj
 
     def set(self, property):
@@ -82,59 +137,53 @@ class DirectoryDeadProperties(object):
         @param property -- an instance of twisted.web2.dav.davxml.WebDAVElement
         """
         self.__sanitize()
+        qname = property.qname()
+        if self._cache.has_key(qname):
+            del self._cache[qname]
+        fileName = self._fileNameFor(qname)
         transaction = SingleFileTransaction()
         try:
-            f = transaction.open(self._fileNameFor(property.qname()), 'wb')
-            cPickle.dump(property, f)
+            f = transaction.open(fileName, 'wb')
+            f.write(encode(property))
             f.close()
         except cPickle.PickleError, e:
             transaction.cleanup()
-            log.warn("A problem occured while saving property %s:", property.qname(), exc_info = e)
+            log.warn("A problem occured while saving property %s:", qname, exc_info = e)
             raise
         else:
             transaction.commit()
+        self._cache[qname] = (self._stamp(fileName), property)
         
     def delete(self, qname):
         """
         @param qname (see twisted.web2.dav.davxml) of the property to look for.
         """
         self.__sanitize()
+        if self._cache.has_key(qname):
+            del self._cache[qname]
         os.remove(self._fileNameFor(qname))
 
     def contains(self, qname):
         """
         @param qname (see twisted.web2.dav.davxml) of the property to look for.
         """
-        # hm, if the pickle file is corrupt, we should not return true...
-        # I think it is good style to define that if contains() is true, get()
-        # should not crash.
-        # TODO: optimize?
-        # Therefore, even if slow, we try get() in order to figure out contains():
-        self.__sanitize()
-        fileNames = os.listdir(self.metadataPath.path)
-        if qname[1] in fileNames:
-            q = None
-            try:
-                q = self.get(qname)
-            except Exception, e:
-                log.debug("Error on contains(%r) -> assume non existant", qname, exc_info = e)
-                return False
-            else:
-                return True
-            if q is None:
-                return False
-        else:
-            return False
+        # if the pickle file is corrupt, we should not return true: I think it is good 
+        # style to define that if contains() is true, get() should not crash.
+        # Since get() caches what it read, the get() following a contains() is cheap.
+        return self.get(qname) is not None
 
     def list(self):
         """
         """
         self.__sanitize()
-        return [("DAV:", fileName) for fileName in os.listdir(self.metadataPath.path)]
+        # property names never start with a dot (but the file of the RecordDeadProperties does)
+        return [("DAV:", fileName) for fileName in os.listdir(self.metadataPath.path) 
+                if not fileName.startswith(".")]
     
     def remove(self):
         """
         Remove this entry from the data base.
         """
         shutil.rmtree(self.metadataPath.path, ignore_errors = True)
-        
\ No newline at end of file
+        self._cache = {}
+        self._sanitized = False
@@ -0,0 +1,256 @@
+import os
+import errno
+import cPickle
+import shutil
+from logging import getLogger
+
+from zope.interface import implements
+from twisted.python.filepath import FilePath
+
+from angel_app.resource.IDeadPropertyStore import IDeadPropertyStore
+from angel_app.resource.local.DirectoryDeadProperties import metadata
+from angel_app.resource.local.elementCodec import DECODE_ERRORS
+from angel_app.resource.local.elementCodec import decode
+from angel_app.resource.local.elementCodec import encode
+from angel_app.singlefiletransaction import SingleFileTransaction
+
+try:
+    import fcntl
+except ImportError: # not available on windows
+    fcntl = None
+
+log = getLogger(__name__)
+
+# the name of the file holding the record in a resource's metadata directory
+RECORD_NAME = ".properties"
+
+
+class RecordDeadProperties(object):
+    """
+    An implementation of a DeadPropertyStore (i.e. store for persistent properties).
+    Like the DirectoryDeadProperties, we keep the dead properties in a directory tree
+    _parallel_ to the resource tree. But rather than one file per property, all properties
+    of a resource are kept in a single record file in the resource's metadata directory,
+    which is replaced atomically on every modification.
+
+    The record is read once and only read again if the file changes. The properties are only
+    decoded when they are asked for.
+
+    Resources with metadata in the DirectoryDeadProperties layout (one pickle file per
+    property) are migrated to a record on first access.
+    """
+    implements(IDeadPropertyStore)
+
+    def __init__(self, _resource):
+        self.resource = _resource
+        self.metadataPath = FilePath(metadata + os.sep + self.resource.relativePath())
+        self.recordPath = os.path.join(self.metadataPath.path, RECORD_NAME)
+        # the encoded properties by qname, as last read from (or written to) the record file
+        self._encoded = None
+        # the identity of the record file corresponding to self._encoded
+        self._stamp = None
+        # the properties decoded so far, by qname
+        self._decoded = {}
+
+    def _currentStamp(self):
+        """
+        @return a tuple identifying the current version of the record file, None if there is none.
+            Since the file is replaced by a rename, a modification always changes the inode number.
+        """
+        try:
+            st = os.stat(self.recordPath)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime, st.st_size)
+
+    def stamp(self):
+        """
+        @return a cheap identification of the current version of the properties, see CachedDeadProperties
+        """
+        return self._currentStamp()
+
+    def _load(self, locked = False):
+        """
+        @param locked: whether we already hold the lock
+        @return the dictionary of encoded properties by qname, read from the record file if it changed
+        """
+        stamp = self._currentStamp()
+        if self._encoded is not None and stamp == self._stamp:
+            return self._encoded
+        if stamp is None:
+            self._encoded = self._migrate(locked)
+            self._stamp = self._currentStamp()
+        else:
+            self._encoded = self._read()
+            self._stamp = stamp
+        self._decoded = {}
+        return self._encoded
+
+    def _read(self):
+        try:
+            f = open(self.recordPath, 'rb')
+            try:
+                return cPickle.load(f)
+            finally:
+                f.close()
+        except (IOError, EOFError, cPickle.PickleError), e:
+            log.warn("Failed to read metadata record %s", self.recordPath, exc_info = e)
+            return {}
+
+    def _write(self, encoded):
+        """
+        Atomically replace the record file. Must hold the lock.
+        """
+        transaction = SingleFileTransaction()
+        try:
+            f = transaction.open(self.recordPath, 'wb')
+            cPickle.dump(encoded, f, cPickle.HIGHEST_PROTOCOL)
+            f.close()
+        except (IOError, cPickle.PickleError), e:
+            transaction.cleanup()
+            log.warn("A problem occured while saving metadata record %s:", self.recordPath, exc_info = e)
+            raise
+        else:
+            transaction.commit()
+        self._encoded = encoded
+        self._stamp = self._currentStamp()
+
+    def _lock(self):
+        """
+        Acquire an exclusive lock on the metadata directory, for the read-modify-write cycle
+        of a modification (the presenter, provider and maintainer may all modify the metadata).
+
+        @return a handle for _unlock
+        """
+        if not os.path.isdir(self.metadataPath.path):
+            log.info("Creating metadata store for: %s", self.metadataPath.path)
+            try:
+                os.makedirs(self.metadataPath.path)
+            except OSError, e:
+                # the directory may have been created concurrently
+                if e.errno != errno.EEXIST:
+                    raise
+        if fcntl is None:
+            return None
+        fd = os.open(self.metadataPath.path, os.O_RDONLY)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+
+    def _unlock(self, fd):
+        if fd is None:
+            return
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def _migrate(self, locked):
+        """
+        Move the properties from the DirectoryDeadProperties layout (if there are any)
+        into a record.
+
+        @param locked: whether we already hold the lock
+        @return the dictionary of encoded properties by qname
+        """
+        if not os.path.isdir(self.metadataPath.path):
+            return {}
+        names = [name for name in os.listdir(self.metadataPath.path) if name != RECORD_NAME and
+                    os.path.isfile(os.path.join(self.metadataPath.path, name))]
+        if not names:
+            return {}
+        fd = None
+        if not locked:
+            fd = self._lock()
+        try:
+            if os.path.exists(self.recordPath):
+                # someone else was faster
+                return self._read()
+            encoded = {}
+            for name in names:
+                path = os.path.join(self.metadataPath.path, name)
+                try:
+                    f = open(path, 'rb')
+                    try:
+                        property = decode(f.read())
+                    finally:
+                        f.close()
+                except (IOError,) + DECODE_ERRORS, e:
+                    log.info("Not migrating unreadable property file %s", path, exc_info = e)
+                    continue
+                encoded[property.qname()] = encode(property)
+            log.info("Migrating %d properties of %s to a metadata record", len(encoded), self.metadataPath.path)
+            self._write(encoded)
+            for name in names:
+                os.remove(os.path.join(self.metadataPath.path, name))
+            return encoded
+        finally:
+            self._unlock(fd)
+
+    def _modify(self, modification):
+        """
+        Apply the modification to the (current) encoded properties, and write them back.
+
+        @param modification: a callable that modifies the dictionary of encoded properties it is passed
+        """
+        fd = self._lock()
+        try:
+            encoded = dict(self._load(True))
+            modification(encoded)
+            self._write(encoded)
+        finally:
+            self._unlock(fd)
+
+    def get(self, qname):
+        """
+        @param qname (see twisted.web2.dav.davxml) of the property to look for.
+        """
+        encoded = self._load()
+        if not self._decoded.has_key(qname):
+            if not encoded.has_key(qname):
+                return None
+            try:
+                self._decoded[qname] = decode(encoded[qname])
+            except DECODE_ERRORS, e:
+                log.warn("Failed to decode property %r of %s", qname, self.recordPath, exc_info = e)
+                return None
+        return self._decoded[qname]
+
+    def set(self, property):
+        """
+        @param property -- an instance of twisted.web2.dav.davxml.WebDAVElement
+        """
+        qname = property.qname()
+        def setProperty(encoded):
+            encoded[qname] = encode(property)
+        self._modify(setProperty)
+        self._decoded[qname] = property
+
+    def delete(self, qname):
+        """
+        @param qname (see twisted.web2.dav.davxml) of the property to look for.
+        """
+        def deleteProperty(encoded):
+            if encoded.has_key(qname):
+                del encoded[qname]
+        self._modify(deleteProperty)
+        if self._decoded.has_key(qname):
+            del self._decoded[qname]
+
+    def contains(self, qname):
+        """
+        @param qname (see twisted.web2.dav.davxml) of the property to look for.
+        """
+        # as with the DirectoryDeadProperties, a property that can't be decoded doesn't count
+        return self.get(qname) is not None
+
+    def list(self):
+        """
+        """
+        return self._load().keys()
+
+    def remove(self):
+        """
+        Remove this entry from the data base.
+        """
+        shutil.rmtree(self.metadataPath.path, ignore_errors = True)
+        self._encoded = None
+        self._stamp = None
+        self._decoded = {}
@@ -0,0 +1,347 @@
+import os
+import cPickle
+import threading
+from logging import getLogger
+
+from zope.interface import implements
+
+from angel_app.config.config import getConfig
+from angel_app.resource.IDeadPropertyStore import IDeadPropertyStore
+from angel_app.resource.local.DirectoryDeadProperties import metadata
+from angel_app.resource.local.RecordDeadProperties import RECORD_NAME
+from angel_app.resource.local.elementCodec import DECODE_ERRORS
+from angel_app.resource.local.elementCodec import decode
+from angel_app.resource.local.elementCodec import encode
+
+try:
+    import sqlite3
+except ImportError: # python < 2.5
+    try:
+        from pysqlite2 import dbapi2 as sqlite3
+    except ImportError:
+        sqlite3 = None
+
+log = getLogger(__name__)
+
+# the data base file, next to the metadata directory tree
+DATABASE_NAME = "metadata.sqlite"
+
+# how long (in seconds) to wait for another process (e.g. the provider, while
+# the maintainer is writing) to release its lock on the data base
+BUSY_TIMEOUT = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS properties (
+    path TEXT NOT NULL,
+    namespace TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value BLOB NOT NULL,
+    PRIMARY KEY (path, namespace, name)
+);
+CREATE TABLE IF NOT EXISTS resources (
+    path TEXT NOT NULL PRIMARY KEY,
+    version INTEGER NOT NULL
+)
+"""
+
+# give the properties of a resource a new version (a row in the resources table, missing until
+# the first modification), in the same transaction as the modification it accounts for. The
+# versions are random rather than counted, so that a rolled back version is not reused.
+BUMP_VERSION = "INSERT OR REPLACE INTO resources (path, version) VALUES (?, random())"
+
+def _key(resource):
+    """
+    @return the key of the resource's properties in the data base, i.e. its relative path
+        without a trailing separator (collections and files are not distinguished, as with the
+        metadata directory tree)
+    """
+    return resource.relativePath().rstrip(os.sep) or os.sep
+
+def _subtreePrefix(key):
+    """
+    @return the common prefix of the keys of all resources below the resource with the given key
+    """
+    return key.rstrip(os.sep) + os.sep
+
+class BatchAborted(Exception):
+    """
+    Raised by the outermost commit() of a batch of modifications, if a batch nested in it
+    has been rolled back (and with it, the whole batch).
+    """
+    pass
+
+class Database(object):
+    """
+    A handle on a sqlite data base (e.g. the metadata data base). Connections can not be shared
+    between threads (nor between forked processes), so every thread gets a connection of its own.
+
+    Modifications are committed right away unless they are part of a batch, see begin().
+    """
+    def __init__(self, path, schema = SCHEMA):
+        """
+        @param path: the path of the data base file
+        @param schema: the SQL statements creating the tables (and indices), if they don't exist yet
+        """
+        if sqlite3 is None:
+            raise RuntimeError("The sqlite data bases require sqlite3 (or pysqlite2).")
+        self.path = path
+        self.schema = schema
+        self.local = threading.local()
+
+    def _connect(self):
+        log.debug("opening metadata data base: %s", self.path)
+        # isolation_level None: no implicit transactions, we start them ourselves
+        connection = sqlite3.connect(self.path, timeout = BUSY_TIMEOUT, isolation_level = None)
+        connection.text_factory = str
+        # write ahead logging lets readers proceed while another process is writing
+        mode = connection.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        if mode.lower() != "wal":
+            log.info("sqlite does not support write ahead logging, using journal mode %s", mode)
+        else:
+            # safe with the WAL: a crash may lose the last transactions, but not corrupt the data base
+            connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(self.schema)
+        return connection
+
+    def connection(self):
+        """
+        @return the connection of the current thread
+        """
+        if getattr(self.local, "pid", None) != os.getpid():
+            self.local.connection = self._connect()
+            self.local.pid = os.getpid()
+            self.local.depth = 0
+            self.local.aborted = False
+        return self.local.connection
+
+    def execute(self, statement, parameters = ()):
+        return self.connection().execute(statement, parameters)
+
+    def begin(self):
+        """
+        Start a batch of modifications, which are committed in a single transaction by
+        the matching call to commit(). Batches may be nested, only the outermost one is
+        committed. If a nested batch is rolled back, so is the whole batch, and the
+        outermost commit() raises a BatchAborted.
+        """
+        connection = self.connection()
+        if self.local.depth == 0:
+            # take the write lock right away, rather than on the first modification
+            connection.execute("BEGIN IMMEDIATE")
+        self.local.depth += 1
+
+    def commit(self):
+        """
+        @raise BatchAborted: if this is the outermost batch, and a nested batch has been rolled back
+        """
+        self.connection()
+        if self.local.depth == 0:
+            return
+        self.local.depth -= 1
+        if self.local.depth > 0:
+            return
+        if self.local.aborted:
+            self.local.aborted = False
+            self.local.connection.execute("ROLLBACK")
+            raise BatchAborted("a nested batch of modifications of %s has been rolled back" % self.path)
+        self.local.connection.execute("COMMIT")
+
+    def rollback(self):
+        """
+        Discard the batch of modifications, along with all enclosing batches.
+        """
+        self.connection()
+        if self.local.depth == 0:
+            return
+        self.local.connection.execute("ROLLBACK")
+        self.local.depth -= 1
+        self.local.aborted = self.local.depth > 0
+        if self.local.aborted:
+            # until the outermost batch ends, further modifications go into a transaction that
+            # is rolled back then, rather than being committed one by one
+            self.local.connection.execute("BEGIN IMMEDIATE")
+
+_database = None
+
+def getDatabase():
+    """
+    @return the process-wide handle on the metadata data base
+    """
+    global _database
+    if _database is None:
+        home = getConfig().get("common", "angelhome")
+        _database = Database(os.path.join(home, DATABASE_NAME))
+    return _database
+
+class SqliteDeadProperties(object):
+    """
+    An implementation of a DeadPropertyStore (i.e. store for persistent properties).
+    The dead properties of all resources are kept in a single (indexed) table of a
+    sqlite data base, keyed by the path of the resource relative to the repository root
+    and the qname of the property.
+
+    Several modifications (e.g. those of Crypto.update()) can be committed at once,
+    see begin() and commit().
+    """
+    implements(IDeadPropertyStore)
+
+    def __init__(self, _resource):
+        self.resource = _resource
+        self.database = getDatabase()
+        self.key = _key(self.resource)
+
+    def stamp(self):
+        """
+        @return a cheap identification of the current version of the properties, see CachedDeadProperties.
+            This is the version of the resource's properties, which every modification of them
+            changes, whichever connection commits it.
+        """
+        row = self.database.execute("SELECT version FROM resources WHERE path = ?", (self.key,)).fetchone()
+        if row is None:
+            return 0
+        return row[0]
+
+    def _modify(self, statement, parameters):
+        """
+        Execute a modification of the resource's properties, along with the change of their version.
+        """
+        self.begin()
+        try:
+            self.database.execute(statement, parameters)
+            self.database.execute(BUMP_VERSION, (self.key,))
+        except:
+            self.rollback()
+            raise
+        self.commit()
+
+    def get(self, qname):
+        """
+        @param qname (see twisted.web2.dav.davxml) of the property to look for.
+        """
+        row = self.database.execute(
+                    "SELECT value FROM properties WHERE path = ? AND namespace = ? AND name = ?",
+                    (self.key, qname[0], qname[1])).fetchone()
+        if row is None:
+            return None
+        try:
+            return decode(str(row[0]))
+        except DECODE_ERRORS, e:
+            log.warn("Failed to decode property %r of %s", qname, self.key, exc_info = e)
+            return None
+
+    def set(self, property):
+        """
+        @param property -- an instance of twisted.web2.dav.davxml.WebDAVElement
+        """
+        (namespace, name) = property.qname()
+        self._modify(
+                    "INSERT OR REPLACE INTO properties (path, namespace, name, value) VALUES (?, ?, ?, ?)",
+                    (self.key, namespace, name, sqlite3.Binary(encode(property))))
+
+    def delete(self, qname):
+        """
+        @param qname (see twisted.web2.dav.davxml) of the property to look for.
+        """
+        self._modify(
+                    "DELETE FROM properties WHERE path = ? AND namespace = ? AND name = ?",
+                    (self.key, qname[0], qname[1]))
+
+    def contains(self, qname):
+        """
+        @param qname (see twisted.web2.dav.davxml) of the property to look for.
+        """
+        # as with the DirectoryDeadProperties, a property that can't be decoded doesn't count
+        return self.get(qname) is not None
+
+    def list(self):
+        """
+        """
+        return [(namespace, name) for (namespace, name) in self.database.execute(
+                    "SELECT namespace, name FROM properties WHERE path = ?", (self.key,))]
+
+    def remove(self):
+        """
+        Remove this entry (and those of all resources below it) from the data base.
+        """
+        prefix = _subtreePrefix(self.key)
+        # a range rather than a LIKE query, so the primary key index is used
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        self.begin()
+        try:
+            self.database.execute(
+                    "INSERT OR REPLACE INTO resources (path, version) SELECT DISTINCT path, random() " +
+                    "FROM properties WHERE path = ? OR (path >= ? AND path < ?)", (self.key, prefix, upper))
+            self.database.execute("DELETE FROM properties WHERE path = ?", (self.key,))
+            self.database.execute("DELETE FROM properties WHERE path >= ? AND path < ?", (prefix, upper))
+        except:
+            self.rollback()
+            raise
+        self.commit()
+
+    def begin(self):
+        """
+        Start a batch of modifications, see Database.begin().
+        """
+        self.database.begin()
+
+    def commit(self):
+        """
+        Commit a batch of modifications, see Database.commit().
+        """
+        self.database.commit()
+
+    def rollback(self):
+        """
+        Discard a batch of modifications, see Database.rollback().
+        """
+        self.database.rollback()
+
+def convert(metadataRoot = metadata, database = None):
+    """
+    Copy the properties from a metadata directory tree (as kept by the DirectoryDeadProperties,
+    or the RecordDeadProperties) into the data base. Properties already in the data base are
+    replaced. The directory tree is left alone.
+
+    This is meant to be run while angel-app is not running.
+
+    @return the number of properties copied
+    """
+    if database is None:
+        database = getDatabase()
+    count = 0
+    database.begin()
+    try:
+        for (dirpath, dirnames, filenames) in os.walk(metadataRoot):
+            key = os.sep + dirpath[len(metadataRoot):].strip(os.sep)
+            properties = []
+            if RECORD_NAME in filenames:
+                f = open(os.path.join(dirpath, RECORD_NAME), 'rb')
+                try:
+                    properties = [decode(value) for value in cPickle.load(f).values()]
+                finally:
+                    f.close()
+            else:
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        f = open(path, 'rb')
+                        try:
+                            properties.append(decode(f.read()))
+                        finally:
+                            f.close()
+                    except (IOError,) + DECODE_ERRORS, e:
+                        log.info("Not converting unreadable property file %s", path, exc_info = e)
+            for property in properties:
+                (namespace, name) = property.qname()
+                database.execute(
+                        "INSERT OR REPLACE INTO properties (path, namespace, name, value) VALUES (?, ?, ?, ?)",
+                        (key, namespace, name, sqlite3.Binary(encode(property))))
+                count += 1
+            if properties:
+                database.execute(BUMP_VERSION, (key,))
+    except:
+        database.rollback()
+        raise
+    database.commit()
+    log.info("converted %d properties from %s", count, metadataRoot)
+    return count
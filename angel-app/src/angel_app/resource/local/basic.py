@@ -14,6 +14,10 @@ from angel_app.resource import childLink
 from angel_app.resource.local.contentManager import ContentManager
 from angel_app.resource.local import propertyManager
 from angel_app.resource.local.renderManager import RenderManager
+from angel_app.resource.local.repositoryIndex import unindexResource
+from angel_app.resource.local.validationCache import fileIdentity
+from angel_app.resource.local.validationCache import forgetResource
+from angel_app.resource.local.validationCache import getValidationCache
 from angel_app.resource.resource import Resource
 from angel_app.resource.remote.clone import Clone
 from angel_app.resource.util import getHashObject
@@ -41,15 +45,27 @@ class Basic(DAVFile, Resource):
         # disallow the creation of resources outside of the repository
         self.assertInRepository()
         
-        self._dead_properties = propertyManager.getDefaultPropertyManager(self)
+        # the managers are created when they are first needed
+        self._dead_properties = None
+        self.contentManager = None
+        self.renderManager = None
+    
+    def __reduce__(self):
+        # pickle as the path (e.g. to pass the resource to a worker process), the
+        # managers are created again when they are first needed
+        return (self.__class__, (self.fp.path,))
         
-        self.contentManager = ContentManager(self)
-        self.renderManager = RenderManager(self)
+    def deadProperties(self):
+        if self._dead_properties is None:
+            self._dead_properties = propertyManager.getDefaultPropertyManager(self)
+        return self._dead_properties
         
     def getPropertyManager(self):
         return self.deadProperties()
     
     def getContentManager(self):
+        if self.contentManager is None:
+            self.contentManager = ContentManager(self)
         return self.contentManager
     
     def resourceName(self):
@@ -87,6 +103,9 @@ class Basic(DAVFile, Resource):
         if self.isRepositoryRoot():
             raise Exception("Cowardly refusing to delete the root directory.")
         
+        # as long as the resource exists
+        relativePath = self.relativePath()
+        
         if self.isCollection():    
             shutil.rmtree(self.fp.path, ignore_errors = True)
         else:
@@ -94,6 +113,8 @@ class Basic(DAVFile, Resource):
             
         # try to remove metadata as well
         self.getPropertyManager().remove()
+        unindexResource(relativePath)
+        forgetResource(relativePath)
 
     def isWritableFile(self):
         """
@@ -107,6 +128,34 @@ class Basic(DAVFile, Resource):
         """
         return self.publicKeyString() in keyRing      
     
+    def validate(self, deep = False):
+        """
+        Validate the contents and metadata, unless the resource has been found valid
+        before and neither its file nor its metadata has changed since (see validationCache).
+        
+        @param deep: if True, always hash the contents and verify the signature (and
+            update the validation cache)
+        @return boolean
+        """
+        cache = getValidationCache()
+        if cache is None:
+            return Resource.validate(self)
+        identity = fileIdentity(self)
+        if identity is None:
+            return Resource.validate(self)
+        path = self.relativePath()
+        if not deep and cache.isValid(path, identity):
+            return True
+        isValid = Resource.validate(self)
+        try:
+            if isValid:
+                cache.add(path, identity)
+            else:
+                cache.invalidate(path)
+        except Exception, e:
+            log.warn("failed to update the validation cache for %s", self.fp.path, exc_info = e)
+        return isValid
+    
     def verify(self):
         """
         DEPRECATED.
@@ -194,6 +243,8 @@ class Basic(DAVFile, Resource):
 
     def render(self, req):
         """You know what you doing. override render method (for GET) in twisted.web2.static.py"""
+        if self.renderManager is None:
+            self.renderManager = RenderManager(self)
         return self.renderManager.render(req)
 
 
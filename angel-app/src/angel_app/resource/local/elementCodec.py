@@ -0,0 +1,177 @@
+"""
+A compact encoding of the metadata elements, as kept by the dead property stores.
+
+Pickled WebDAVElement object graphs are large (every element carries its class
+and instance dictionary) and slow to load. The angel-app elements are encoded
+as nested tuples instead (the index of the element type, followed by the
+children, where text is kept as a plain string), serialized with marshal. Since
+the encoding is canonical, the elements are materialized without going through
+the validation of the WebDAVElement constructor. The children of the elements
+that may have many of them (Children, Clones, BlockHashes) are only materialized
+when they are accessed.
+
+Elements that can't be encoded this way (e.g. properties set by WebDAV clients
+via PROPPATCH) are pickled, as are the properties stored by older versions, so
+decode() accepts either.
+"""
+
+import cPickle
+import marshal
+
+from twisted.web2.dav.element.base import PCDATAElement
+from twisted.web2.dav import davxml
+
+from angel_app import elements
+
+# the first byte of the compact encoding (a pickle never starts with it)
+MAGIC = "\x01"
+
+# the marshal format version, version 1 is available since python 2.4
+MARSHAL_VERSION = 1
+
+# the element types of the compact encoding, the index in this list identifies the type.
+# NEVER reorder or remove entries, append new ones at the end.
+ELEMENT_TYPES = [
+                 elements.Revision,
+                 elements.ContentSignature,
+                 elements.PublicKeyString,
+                 elements.Encrypted,
+                 elements.Child,
+                 elements.Children,
+                 elements.MetaDataSignature,
+                 elements.ResourceID,
+                 elements.Clone,
+                 elements.Clones,
+                 elements.UUID,
+                 elements.ForceLocalCache,
+                 elements.BlockSize,
+                 elements.BlockHashes,
+                 elements.Digest,
+                 davxml.HRef
+                 ]
+
+# the exceptions raised by decode() for corrupt data
+DECODE_ERRORS = (EOFError, ValueError, cPickle.PickleError)
+
+def _toTuple(element):
+    """
+    @return the nested tuple representation of the element
+    @raise KeyError: if the element (or one of its children) can't be represented
+    """
+    if element.__dict__.has_key("_representation"):
+        # a lazy element whose children have not been materialized (nor modified)
+        return element._representation
+    if element.attributes:
+        raise KeyError("attributes are not supported: %r" % element)
+    representation = [_typeIndex[element.__class__]]
+    for child in element.children:
+        if isinstance(child, PCDATAElement):
+            representation.append(child.data)
+        else:
+            representation.append(_toTuple(child))
+    return tuple(representation)
+
+def _materializeChildren(representation, _new = object.__new__, _str = str, _PCDATA = PCDATAElement):
+    """
+    @return the tuple of the child elements for the nested tuple representation of an element
+    """
+    children = []
+    append = children.append
+    for child in representation[1:]:
+        if type(child) is _str:
+            pcdata = _new(_PCDATA)
+            pcdata.data = child
+            append(pcdata)
+        else:
+            append(_fromTuple(child))
+    return tuple(children)
+
+def _fromTuple(representation, _new = object.__new__):
+    """
+    @return the element for its nested tuple representation
+    """
+    elementType = ELEMENT_TYPES[representation[0]]
+    lazyType = _lazyTypes.get(elementType)
+    if lazyType is not None:
+        element = _new(lazyType)
+        element._representation = representation
+    else:
+        element = _new(elementType)
+        element.children = _materializeChildren(representation)
+    element.attributes = {}
+    return element
+
+def _plainElement(elementType, children, attributes):
+    """
+    @return an element of the given type, as it was pickled
+    """
+    element = object.__new__(elementType)
+    element.children = children
+    element.attributes = attributes
+    return element
+
+class _LazyElement(object):
+    """
+    Mixin for elements with (potentially) many children, which are only materialized 
+    when they are accessed, e.g. for a WebDAV response. Until then, the element holds
+    its nested tuple representation.
+    """
+    def _getChildren(self):
+        try:
+            return self.__dict__["_children"]
+        except KeyError:
+            children = _materializeChildren(self.__dict__["_representation"])
+            self.__dict__["_children"] = children
+            return children
+
+    def _setChildren(self, children):
+        self.__dict__["_children"] = children
+        if self.__dict__.has_key("_representation"):
+            del self.__dict__["_representation"]
+
+    children = property(_getChildren, _setChildren)
+
+    def __reduce__(self):
+        # pickle as the plain element
+        return (_plainElement, (self.plainType, self.children, self.attributes))
+
+class LazyChildren(_LazyElement, elements.Children):
+    plainType = elements.Children
+
+class LazyClones(_LazyElement, elements.Clones):
+    plainType = elements.Clones
+
+class LazyBlockHashes(_LazyElement, elements.BlockHashes):
+    plainType = elements.BlockHashes
+
+_lazyTypes = {
+              elements.Children    : LazyChildren,
+              elements.Clones      : LazyClones,
+              elements.BlockHashes : LazyBlockHashes
+              }
+
+_typeIndex = dict([(elementType, index) for (index, elementType) in enumerate(ELEMENT_TYPES)])
+for (elementType, lazyType) in _lazyTypes.items():
+    _typeIndex[lazyType] = _typeIndex[elementType]
+
+def encode(element):
+    """
+    @return the string representation of a property element, as stored
+    """
+    try:
+        return MAGIC + marshal.dumps(_toTuple(element), MARSHAL_VERSION)
+    except KeyError:
+        return cPickle.dumps(element, cPickle.HIGHEST_PROTOCOL)
+
+def decode(data):
+    """
+    @return the property element for its string representation, as returned by encode(),
+        or as pickled by older versions
+    @raise one of DECODE_ERRORS: if data is corrupt
+    """
+    if data[:1] == MAGIC:
+        try:
+            return _fromTuple(marshal.loads(data[1:]))
+        except (TypeError, IndexError), e:
+            raise ValueError("corrupt element: %s" % e)
+    return cPickle.loads(data)
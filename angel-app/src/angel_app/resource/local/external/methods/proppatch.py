@@ -213,7 +213,10 @@ def pingBack(clone, request, publicKeyString, resourceID, lresource):
     else:
         clone = clones[0]
     del clones
-    if not clone.ping() or not clone.exists():
+    probe = clone.probe()
+    if probe.exists:
+        clone = probe.clone
+    else:
         dns_resolved_ips = resolvedns( clone.getHost() )
         ip_address = str(request.remoteAddr.host)
         if not ip_address in dns_resolved_ips: # only fallback to IP if nodename does not already resolve to it
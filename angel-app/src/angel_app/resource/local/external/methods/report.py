@@ -0,0 +1,112 @@
+"""
+WebDAV REPORT method, providing the digests of byte ranges of a file.
+
+This lets a peer check samples of our contents against its own copy,
+transferring only the digests rather than the sampled data itself.
+"""
+
+__all__ = ["ReportMixin"]
+
+import os
+import stat
+from logging import getLogger
+
+from twisted.internet import threads
+from twisted.web2 import responsecode
+from twisted.web2 import stream
+from twisted.web2.dav.method.report import http_REPORT
+from twisted.web2.http import HTTPError, Response, StatusResponse
+from twisted.web2.http_headers import MimeType
+
+from angel_app import elements
+from angel_app.resource.util import getHashObject
+
+log = getLogger(__name__)
+
+# the maximum number of ranges in a single request
+MAX_RANGES = 1024
+# the maximum number of bytes to be hashed for a single request
+MAX_BYTES = 16 * 1024 * 1024
+
+def parseByteRange(byteRange, size):
+    """
+    @param byteRange: a string "first-last", as in an http range request
+    @param size: the size of the file
+    @return a tuple (first, last) of offsets, where last is clipped to the end of the file
+    @raise ValueError: if the range is invalid or starts beyond the end of the file
+    """
+    (first, last) = [int(offset) for offset in byteRange.split("-")]
+    if first < 0 or last < first or first >= size:
+        raise ValueError("invalid byte range: %s" % byteRange)
+    return (first, min(last, size - 1))
+
+def rangeDigest(f, first, last):
+    """
+    @return the hex digest of the bytes first through last (inclusive) of the file f
+    """
+    hashObj = getHashObject()
+    f.seek(first)
+    remaining = last + 1 - first
+    while remaining > 0:
+        buf = f.read(min(remaining, 16384))
+        if len(buf) == 0:
+            break
+        hashObj.update(buf)
+        remaining -= len(buf)
+    return hashObj.hexdigest()
+
+def rangeDigests(path, ranges):
+    """
+    @param ranges: a list of (first, last) tuples, see parseByteRange()
+    @return the list of the hex digests of the byte ranges of the file
+    """
+    f = open(path, 'rb')
+    try:
+        return [rangeDigest(f, first, last) for (first, last) in ranges]
+    finally:
+        f.close()
+
+class ReportMixin(object):
+
+    http_REPORT = http_REPORT
+
+    def report_DAV__rangeDigestReport(self, request, report):
+        """
+        Respond to a rangeDigestReport with the digests of the requested byte ranges,
+        in the order in which they were requested.
+        
+        The ranges are hashed in a thread, so that other requests are served meanwhile. 
+        (http_REPORT does not accept a Deferred, so the response is returned right away, 
+        and its body follows once the digests are known.)
+        """
+        if self.isCollection():
+            raise HTTPError(StatusResponse(
+                       responsecode.FORBIDDEN, "Range digests are not available for collections."))
+
+        size = os.stat(self.fp.path)[stat.ST_SIZE]
+        try:
+            ranges = [parseByteRange(str(br), size) for br in report.childrenOfType(elements.ByteRange)]
+        except ValueError, e:
+            raise HTTPError(StatusResponse(responsecode.BAD_REQUEST, str(e)))
+        if len(ranges) > MAX_RANGES or sum([last + 1 - first for (first, last) in ranges]) > MAX_BYTES:
+            raise HTTPError(StatusResponse(
+                       responsecode.REQUEST_ENTITY_TOO_LARGE, "Too many byte ranges requested."))
+
+        body = stream.ProducerStream()
+        def hashed(hexdigests):
+            digests = [elements.RangeDigest(
+                            elements.ByteRange("%d-%d" % (first, last)),
+                            elements.Digest(hexdigest))
+                       for ((first, last), hexdigest) in zip(ranges, hexdigests)]
+            log.debug("computed %d range digests for %s", len(digests), self.fp.path)
+            body.write(elements.RangeDigestReport(*digests).toxml())
+            body.finish()
+        def failed(failure):
+            log.warn("range digests of %s failed: %s", self.fp.path, failure.getErrorMessage())
+            # the peer sees the connection dropped
+            body.finish(failure)
+        threads.deferToThread(rangeDigests, self.fp.path, ranges).addCallbacks(hashed, failed)
+        return Response(
+                    responsecode.OK,
+                    {"content-type": MimeType("text", "xml")},
+                    body)
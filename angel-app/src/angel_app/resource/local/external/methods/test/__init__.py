@@ -2,4 +2,4 @@
 Resources facing the public network are simply resources that deny all destructive method requests.
 """
 
-all = ["proppatchTest"]
\ No newline at end of file
+all = ["proppatchTest", "reportTest"]
\ No newline at end of file
@@ -0,0 +1,80 @@
+"""
+Tests for the range digest REPORT.
+"""
+
+legalMatters = """
+ Copyright (c) 2006, etoy.VENTURE ASSOCIATION
+ All rights reserved.
+ 
+ Redistribution and use in source and binary forms, with or without modification, 
+ are permitted provided that the following conditions are met:
+ *  Redistributions of source code must retain the above copyright notice, 
+    this list of conditions and the following disclaimer.
+ *  Redistributions in binary form must reproduce the above copyright notice, 
+    this list of conditions and the following disclaimer in the documentation 
+    and/or other materials provided with the distribution.
+ *  Neither the name of etoy.CORPORATION nor the names of its contributors may be used to 
+    endorse or promote products derived from this software without specific prior 
+    written permission.
+ 
+ THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY 
+ EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES 
+ OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT 
+ SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, 
+ SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT 
+ OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) 
+ HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+ OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS 
+ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE. 
+"""
+
+from angel_app import elements
+from angel_app.config import config
+from angel_app.maintainer import collect
+from angel_app.resource.local.test.localResourceTest import LocalResourceTest
+from angel_app.resource.remote.clone import Clone
+from twisted.web2 import responsecode
+
+AngelConfig = config.getConfig()
+providerport = AngelConfig.getint("provider","listenPort")
+
+class ReportTest(LocalResourceTest):
+
+    def makeTestClone(self):
+        self.testClone = Clone("localhost", providerport, "/TEST/file.txt")
+        self.testClone.getPropertyManager().invalidateCache()
+
+    def testRangeDigests(self):
+        """
+        The digests reported by the provider must match the local chunk hashes, 
+        in the order of the request. Ranges beyond the end of the file are clipped.
+        """
+        chunks = [(3, 4), (0, 1), (5, 100)]
+        digests = self.testClone.getChunkHashes(chunks)
+        assert digests == [self.testFile.getChunkHash(3, 4),
+                           self.testFile.getChunkHash(0, 1),
+                           self.testFile.getChunkHash(5, len(self.testText) - 5)]
+
+    def testInvalidRange(self):
+        """
+        Ranges starting beyond the end of the file are rejected, so are collections.
+        """
+        assert self.testClone.getChunkHashes([(len(self.testText), 1)]) is None
+        body = elements.RangeDigestReport(elements.ByteRange("0-1")).toxml()
+        response = Clone("localhost", providerport, "/TEST/").remote.performRequest("REPORT", {}, body)
+        response.read()
+        assert response.status == responsecode.FORBIDDEN
+
+    def testAcceptableChunk(self):
+        """
+        The provider's clone of the test file is identical to the local file.
+        """
+        assert collect.acceptableChunk(self.testFile, self.testClone, 
+                                       self.testFile.publicKeyString(), self.testFile.resourceID())
+
+    def testAcceptableBlocks(self):
+        """
+        The provider's clone of the test file matches its block hash manifest.
+        """
+        assert self.testClone.blockHashes() is not None
+        assert collect.acceptableBlocks(self.testClone)
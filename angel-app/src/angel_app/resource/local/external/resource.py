@@ -7,6 +7,7 @@ from twisted.web2.http import HTTPError
 
 from angel_app.resource.local.basic import Basic
 from angel_app.resource.local.external.methods import proppatch
+from angel_app.resource.local.external.methods import report
 
 log = getLogger(__name__)
 
@@ -19,7 +20,7 @@ def forbidden(method):
     raise HTTPError(StatusResponse(responsecode.FORBIDDEN, error))
 
 
-class External(proppatch.ProppatchMixin, Basic):
+class External(proppatch.ProppatchMixin, report.ReportMixin, Basic):
     """
     WebDAV resource interface for provider. All destructive methods are forbidden.
 
@@ -27,6 +28,9 @@ class External(proppatch.ProppatchMixin, Basic):
     into the network. Specifically, ater a GET request has been successfully handled, a method
     is dispathced that verifies if the host from which the GET request originated is now itself
     offering a clone of that resource (see http_GET for details).
+    
+    Peers validating their clones may ask for the digests of byte ranges of a file with 
+    a REPORT request (see report.ReportMixin).
     """
     
     def __init__(self, path,
@@ -7,7 +7,10 @@ from twisted.web2.dav.element import rfc2518
 
 from angel_app import elements
 from angel_app.config.internal import loadKeysFromFile
+from angel_app.maintainer.schedule import expediteResource
+from angel_app.resource import util
 from angel_app.resource.local.basic import Basic
+from angel_app.resource.local.repositoryIndex import indexResource
 from angel_app.resource.local.internal.methods import copy, delete, lock, mkcol, move, put
 
 log = getLogger(__name__)
@@ -27,6 +30,9 @@ class Crypto(
     
     keyRing = loadKeysFromFile()
     
+    # the block size of the block hash manifest of files
+    blockSize = util.BLOCK_SIZE
+    
     def __init__(self, path,
                  defaultType="text/plain",
                  indexNames=None):
@@ -121,8 +127,21 @@ class Crypto(
         in the tree can be referenced by another one (Unix mount analogy).
         Therefore, it is not possible to use a directory's name as the 
         value to be signed.
+        
+        For files, a manifest of the digests of fixed size blocks of the contents 
+        is computed along the way and stored (and signed) as well, so that single 
+        blocks can be verified on their own.
         """
-        signature = self._computeContentHexDigest()
+        if self.isCollection():
+            signature = self._computeContentHexDigest()
+            if self.deadProperties().contains(elements.BlockHashes.qname()):
+                self.deadProperties().delete(elements.BlockHashes.qname())
+        else:
+            blockHasher = util.BlockHasher(self.blockSize)
+            signature = self._computeContentHexDigest(blockHasher)
+            self.deadProperties().set(
+                                      util.blockHashesToElement(blockHasher.blockSize, blockHasher.hexdigests())
+                                      )
         
         self.deadProperties().set(
                                   elements.ContentSignature.fromString( signature )
@@ -282,6 +301,17 @@ class Crypto(
 
         super(Crypto, self).remove()
     
+    def _signAndSeal(self):
+        """
+        Sign the contents, bump the revision number and seal the metadata -- as
+        a single batch of modifications to the property store.
+        """
+        self._signContent()
+
+        self.bumpRevisionNumber()
+
+        self.seal()
+
     def update(self, recursionLimit = 0):
         
         if not self.isWritableFile(): 
@@ -290,11 +320,10 @@ class Crypto(
         if self.isEncrypted():
             self.encrypt()
 
-        self._signContent()
-
-        self.bumpRevisionNumber()
-
-        self.seal()
+        self.deadProperties().batch(self._signAndSeal)
+        indexResource(self)
+        # let the maintainer announce the new revision soon
+        expediteResource(self.relativePath())
         
         # certainly not going to hurt if we do this:
         self.fp.restat()
@@ -35,6 +35,8 @@ from angel_app.log import getLogger
 from angel_app.resource.local.basic import Basic as EResource
 from angel_app.resource.local.internal.resource import Crypto
 from angel_app.resource.local.internal.resource import Crypto as IResource
+from angel_app.resource import util
+from angel_app.resource.remote.clone import Clone
 from angel_app.resource.local.test.basicResourceTest import BasicResourceTest
 from twisted.web2 import responsecode
 import angel_app.resource.local.basic as bb
@@ -64,6 +66,19 @@ class ResourceTest(BasicResourceTest):
         local repository.
         """
         assert self.testDirectory.contentSignature() == self.testDirectory._signContent()
+
+    def testBlockHashes(self):
+        """
+        Files have a signed block hash manifest, collections don't. Remote clones must 
+        validate either way.
+        """
+        assert self.testFile.blockHashes() == (util.BLOCK_SIZE, [self.testFile.contentSignature()])
+        assert self.testDirectory.blockHashes() is None
+        remoteFile = Clone("localhost", AngelConfig.getint("presenter","listenPort"), "/TEST/file.txt")
+        assert remoteFile.blockHashes() == self.testFile.blockHashes()
+        assert remoteFile.validateMetaData()
+        assert self.testClone.blockHashes() is None
+        assert self.testClone.validateMetaData()
         
     def testDenyRemoteResourceModification(self):
         """
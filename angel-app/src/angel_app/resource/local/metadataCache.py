@@ -0,0 +1,190 @@
+"""
+A process-wide cache of the (decoded) properties of local resources, shared by all
+resources (and property managers) for the same path.
+
+Resources are created over and over again (by the graph walker, for the parent when
+inheriting clones, for the children in directory listings, ...), and each of them
+would otherwise read (and decode) its metadata from the store again. The cache is
+bounded in size (least recently used entries are dropped first). An entry is only
+valid as long as the stamp of the metadata store it was read with (see
+CachedDeadProperties) remains the same, so modifications by other processes are
+noticed.
+"""
+
+import os
+import threading
+import time
+from logging import getLogger
+
+log = getLogger(__name__)
+
+# the maximum number of resources for which we keep properties
+MAX_ENTRIES = 10000
+# the fraction of the entries that is dropped when the cache is full
+EVICT_FRACTION = 0.1
+# the interval (in seconds) at which the statistics are logged
+REPORT_INTERVAL = 3600.0
+
+class MetadataCache(object):
+    """
+    A thread-safe LRU cache, mapping a key identifying the metadata of a local resource
+    to the stamp of the metadata and a dictionary of property elements by qname.
+    Properties that are known to be missing are cached with the value None.
+    """
+
+    def __init__(self, maxEntries = MAX_ENTRIES):
+        self.maxEntries = maxEntries
+        self._lock = threading.Lock()
+        # map from key to [stamp, time of last access, {qname: element}]
+        self._entries = {}
+        self._pid = os.getpid()
+        self._lastReport = time.time()
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def _checkFork(self):
+        """
+        The cached properties are still valid in a forked child, but the lock might have
+        been held by another thread of the parent at the time of the fork.
+        """
+        if self._pid == os.getpid():
+            return
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _entry(self, key, stamp):
+        """
+        @return the entry for key, or None, if there is none or its stamp differs. Must hold the lock.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] != stamp:
+            del self._entries[key]
+            self.stale += 1
+            return None
+        return entry
+
+    def lookup(self, key, stamp, qname):
+        """
+        @param key: the key of the resource's metadata
+        @param stamp: the current stamp of the metadata
+        @param qname: the qname of the requested property
+        @return a tuple (found, element), where element is None if the property is known
+            to be missing
+        """
+        self._checkFork()
+        now = time.time()
+        self._lock.acquire()
+        try:
+            if now - self._lastReport > REPORT_INTERVAL:
+                self._lastReport = now
+                log.info("local metadata cache: %s", self)
+            entry = self._entry(key, stamp)
+            if entry is not None and entry[2].has_key(qname):
+                entry[1] = now
+                self.hits += 1
+                return (True, entry[2][qname])
+            self.misses += 1
+            return (False, None)
+        finally:
+            self._lock.release()
+
+    def update(self, key, stamp, qname, element):
+        """
+        Add a property (None, if it is missing) to the cache, read from (or written to) the
+        metadata with the given stamp. Properties cached for a different stamp are dropped.
+        """
+        self._checkFork()
+        now = time.time()
+        self._lock.acquire()
+        try:
+            entry = self._entry(key, stamp)
+            if entry is None:
+                entry = [stamp, now, {}]
+                self._entries[key] = entry
+                if len(self._entries) > self.maxEntries:
+                    self._evict()
+            entry[2][qname] = element
+            entry[1] = now
+        finally:
+            self._lock.release()
+
+    def _evict(self):
+        """
+        Drop the least recently used entries. Must hold the lock.
+        """
+        numEvict = max(1, int(self.maxEntries * EVICT_FRACTION))
+        byAccess = [(entry[1], key) for (key, entry) in self._entries.iteritems()]
+        byAccess.sort()
+        for (dummytime, key) in byAccess[:numEvict]:
+            del self._entries[key]
+        self.evictions += numEvict
+
+    def invalidate(self, key):
+        """
+        Forget everything about the resource.
+        """
+        self._checkFork()
+        self._lock.acquire()
+        try:
+            if self._entries.has_key(key):
+                del self._entries[key]
+        finally:
+            self._lock.release()
+
+    def invalidateWhere(self, predicate):
+        """
+        Forget everything about the resources whose keys satisfy the predicate,
+        e.g. all resources below a removed collection.
+        """
+        self._checkFork()
+        self._lock.acquire()
+        try:
+            for key in [key for key in self._entries.keys() if predicate(key)]:
+                del self._entries[key]
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """
+        Forget everything.
+        """
+        self._checkFork()
+        self._lock.acquire()
+        try:
+            self._entries = {}
+        finally:
+            self._lock.release()
+
+    def hitRate(self):
+        """
+        @return the fraction of the lookups that were answered from the cache
+        """
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return float(self.hits) / lookups
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        return "MetadataCache(entries: %d, hits: %d, misses: %d, hit rate: %.2f, stale: %d, evictions: %d)" % \
+            (len(self._entries), self.hits, self.misses, self.hitRate(), self.stale, self.evictions)
+
+
+cache = None # holder for the process-wide MetadataCache
+def getMetadataCache():
+    """
+    Implements a singleton for getting the process-wide MetadataCache.
+
+    @return: MetadataCache instance
+    """
+    global cache
+    if cache is None:
+        cache = MetadataCache()
+    return cache
@@ -9,7 +9,11 @@ from logging import getLogger
 
 from twisted.web2 import responsecode
 from twisted.web2.dav.element.base import WebDAVElement
+from angel_app.config.config import getConfig
+from angel_app.resource.local.CachedDeadProperties import CachedDeadProperties
 from angel_app.resource.local.DirectoryDeadProperties import DirectoryDeadProperties
+from angel_app.resource.local.RecordDeadProperties import RecordDeadProperties
+from angel_app.resource.local.SqliteDeadProperties import SqliteDeadProperties
 from twisted.web2.http import HTTPError, StatusResponse
 from zope.interface import implements
 
@@ -22,6 +26,14 @@ from angel_app.admin.secretKey import defaultPublicKey
 
 log = getLogger(__name__)
 
+def parentHandle(resource):
+    """
+    @return a ResourceHandle on the parent of the (local) resource, which is all we need
+        for looking up the properties a resource inherits.
+    """
+    from angel_app.resource.local.resourceHandle import ResourceHandle
+    return ResourceHandle(os.path.dirname(resource.fp.path.rstrip(os.sep)))
+
 def getOnePublicKey(resource):
     """
     This is used in the initialization phase of a resource's meta-data:
@@ -30,7 +42,7 @@ def getOnePublicKey(resource):
     if resource.isRepositoryRoot():
         return defaultPublicKey()
     else:
-        return resource.parent().publicKeyString()
+        return parentHandle(resource).publicKeyString()
 
   
 def inheritClones(resource):
@@ -48,7 +60,7 @@ def inheritClones(resource):
     if resource.isRepositoryRoot():
         return []
 
-    parentClones = resource.parent().clones()
+    parentClones = parentHandle(resource).clones()
     
     def adaptPaths(parentClone):
         """
@@ -110,9 +122,18 @@ defaultMetaData = {
                    elements.Children.qname()           : _children_qname
                    }
 
+# the dead property store implementations, by the value of the common.metadatastore option
+deadPropertyStores = {
+                      "record"    : RecordDeadProperties,
+                      "directory" : DirectoryDeadProperties,
+                      "sqlite"    : SqliteDeadProperties
+                      }
+
 def getDefaultPropertyManager(_resource):
     #return PropertyManager(_resource, xattrPropertyStore(_resource))
-    return PropertyManager(_resource,  DirectoryDeadProperties(_resource))
+    store = deadPropertyStores[getConfig().get("common", "metadatastore")]
+    # reads are answered from the process-wide metadata cache where possible
+    return PropertyManager(_resource, CachedDeadProperties(store(_resource)))
 
 class PropertyManager(object):
     """
@@ -131,9 +152,8 @@ class PropertyManager(object):
         self.resource = _resource
          
         self.store = _store
-        # create a per-instance copy of the default generators
-        # TODO: review: is this necessary?
-        self.defaultValues = dict(defaultMetaData.items())
+        # the default generators are shared (and never modified)
+        self.defaultValues = defaultMetaData
 
     def isCollection(self):
         """
@@ -142,7 +162,7 @@ class PropertyManager(object):
         return self.resource.isCollection()
     
     def contains(self, element):
-        return (self.store.contains(element) or (element in self.defaultValues.keys()))
+        return (self.defaultValues.has_key(element) or self.store.contains(element))
     
     def list(self):
         union = (set(self.store.list()) | set(self.defaultValues.keys()))
@@ -154,6 +174,25 @@ class PropertyManager(object):
         """
         return self.store.delete(qname)
 
+    def batch(self, function, *args):
+        """
+        Call the function, committing the modifications it makes to the property store
+        at once, if the store supports batches of modifications (see SqliteDeadProperties),
+        otherwise as they happen.
+        
+        @return the return value of the function
+        """
+        if not hasattr(self.store, "begin"):
+            return function(*args)
+        self.store.begin()
+        try:
+            result = function(*args)
+        except:
+            self.store.rollback()
+            raise
+        self.store.commit()
+        return result
+
     def getByElement(self, property):
         return self.get(property.qname())
 
@@ -161,13 +200,15 @@ class PropertyManager(object):
         
         assert type(qname) == type(WebDAVElement.qname())
         
-        # the property is available in the property store
-        if self.store.contains(qname):
-            return self.store.get(qname)
+        # the property is available in the property store (a single lookup,
+        # the stores return None for properties they don't have)
+        dp = self.store.get(qname)
+        if dp is not None:
+            return dp
         
         # the property is not available in the property store,
         # but we have an initializer   
-        if qname in self.defaultValues.keys():
+        if self.defaultValues.has_key(qname):
             dp = self.defaultValues[qname](self)
             try:
                 # try to write the metadata -- this may fail e.g. if 
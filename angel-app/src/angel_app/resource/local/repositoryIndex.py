@@ -0,0 +1,241 @@
+"""
+A persistent index of the resources in the local repository.
+
+The index keeps a summary of the metadata of every resource (resource ID, key UUID,
+revision, content signature, size, modification time, the time it was last validated
+and the known clones) in a sqlite data base, so the maintainer, the quota code and
+status tools can enumerate and filter resources without walking the repository and
+reading the metadata of every resource.
+
+The presenter updates the index whenever it modifies a resource, the maintainer
+whenever it has inspected one. The index is a cache: it can always be rebuilt from
+the repository (see rebuild()), and failures to update it are logged, but otherwise
+ignored.
+"""
+
+import os
+from logging import getLogger
+
+from angel_app.config.config import getConfig
+from angel_app.resource.local.SqliteDeadProperties import Database
+
+log = getLogger(__name__)
+
+# the data base file, next to the metadata directory tree
+INDEX_NAME = "index.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS resources (
+    path TEXT PRIMARY KEY,
+    resourceid TEXT,
+    keyuuid TEXT,
+    revision INTEGER,
+    contentsignature TEXT,
+    collection INTEGER,
+    size INTEGER,
+    mtime REAL,
+    validated REAL,
+    clones TEXT
+);
+CREATE INDEX IF NOT EXISTS resources_resourceid ON resources (resourceid);
+CREATE INDEX IF NOT EXISTS resources_keyuuid ON resources (keyuuid);
+CREATE INDEX IF NOT EXISTS resources_validated ON resources (validated);
+"""
+
+COLUMNS = ["path", "resourceid", "keyuuid", "revision", "contentsignature", "collection",
+           "size", "mtime", "validated", "clones"]
+
+class IndexEntry(object):
+    """
+    A python style struct describing a resource, as found in the index.
+    """
+    def __init__(self, path, resourceID, keyUUID, revision, contentSignature,
+                 isCollection, size, mtime, validated, clones):
+        # the path relative to the repository root, see Basic.relativePath()
+        self.path = path
+        self.resourceID = resourceID
+        # the key UUID as a string
+        self.keyUUID = keyUUID
+        self.revision = revision
+        self.contentSignature = contentSignature
+        self.isCollection = bool(isCollection)
+        # the size and modification time of the file
+        self.size = size
+        self.mtime = mtime
+        # the time the resource was last found valid by the maintainer, None if never
+        self.validated = validated
+        # the URIs of the known clones
+        self.clones = clones
+
+    def __repr__(self):
+        return "IndexEntry(%r, revision: %r, validated: %r)" % (self.path, self.revision, self.validated)
+
+def _key(path):
+    """
+    @return the key of the resource with the given relative path in the index (collections and
+        files are not distinguished, as with the metadata)
+    """
+    return path.rstrip(os.sep) or os.sep
+
+def _entryFromRow(row):
+    clones = row[9] and row[9].split("\n") or []
+    return IndexEntry(*(list(row[:9]) + [clones]))
+
+class RepositoryIndex(object):
+    """
+    The index of the resources in the local repository.
+    """
+    def __init__(self, path):
+        self.database = Database(path, SCHEMA)
+
+    def update(self, resource, validated = None):
+        """
+        Record the current metadata of the resource.
+
+        @param resource: a local resource
+        @param validated: the time the resource was found valid, None to keep the time recorded before
+        """
+        path = _key(resource.relativePath())
+        st = os.stat(resource.fp.path)
+        clones = "\n".join([cc.toURI() for cc in resource.clones()])
+        self.database.execute(
+            "INSERT OR REPLACE INTO resources (%s) VALUES (?, ?, ?, ?, ?, ?, ?, ?, " % ", ".join(COLUMNS) +
+            "COALESCE(?, (SELECT validated FROM resources WHERE path = ?)), ?)",
+            (path, str(resource.resourceID()), str(resource.keyUUID()), resource.revision(),
+             resource.contentSignature(), int(resource.isCollection()), st.st_size, st.st_mtime,
+             validated, path, clones))
+
+    def remove(self, path):
+        """
+        Remove the resource with the given relative path, and all resources below it.
+        """
+        key = _key(path)
+        prefix = key.rstrip(os.sep) + os.sep
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        self.database.begin()
+        try:
+            self.database.execute("DELETE FROM resources WHERE path = ?", (key,))
+            self.database.execute("DELETE FROM resources WHERE path >= ? AND path < ?", (prefix, upper))
+        except:
+            self.database.rollback()
+            raise
+        self.database.commit()
+
+    def get(self, path):
+        """
+        @return the IndexEntry for the resource with the given relative path, None if there is none
+        """
+        row = self.database.execute("SELECT %s FROM resources WHERE path = ?" % ", ".join(COLUMNS),
+                                    (_key(path),)).fetchone()
+        if row is None:
+            return None
+        return _entryFromRow(row)
+
+    def entries(self, keyUUID = None, resourceID = None, validatedBefore = None):
+        """
+        @param keyUUID: if given, only the resources signed with this key
+        @param resourceID: if given, only the resources with this resource ID
+        @param validatedBefore: if given, only the resources not validated since this time
+        @return a list of the matching IndexEntries, ordered by path
+        """
+        conditions = []
+        parameters = []
+        if keyUUID is not None:
+            conditions.append("keyuuid = ?")
+            parameters.append(str(keyUUID))
+        if resourceID is not None:
+            conditions.append("resourceid = ?")
+            parameters.append(str(resourceID))
+        if validatedBefore is not None:
+            conditions.append("(validated IS NULL OR validated < ?)")
+            parameters.append(validatedBefore)
+        statement = "SELECT %s FROM resources" % ", ".join(COLUMNS)
+        if conditions:
+            statement += " WHERE " + " AND ".join(conditions)
+        statement += " ORDER BY path"
+        return [_entryFromRow(row) for row in self.database.execute(statement, parameters)]
+
+    def totalSize(self, keyUUID = None):
+        """
+        @return the total size of the files (signed with the given key, if any)
+        """
+        if keyUUID is None:
+            row = self.database.execute("SELECT SUM(size) FROM resources WHERE collection = 0").fetchone()
+        else:
+            row = self.database.execute("SELECT SUM(size) FROM resources WHERE collection = 0 AND keyuuid = ?",
+                                        (str(keyUUID),)).fetchone()
+        return row[0] or 0
+
+    def __len__(self):
+        return self.database.execute("SELECT COUNT(*) FROM resources").fetchone()[0]
+
+    def rebuild(self, root):
+        """
+        Replace the index with the resources found by following the children links from
+        the root resource. The validation times are kept.
+        """
+        from angel_app.graph import graphWalker
+        validated = dict(self.database.execute("SELECT path, validated FROM resources").fetchall())
+        self.database.begin()
+        try:
+            self.database.execute("DELETE FROM resources")
+            def indexNode(resource, dummybackPack):
+                if not resource.exists():
+                    return (False, None)
+                self.update(resource, validated.get(_key(resource.relativePath())))
+                return (True, None)
+            for dummyresult in graphWalker(root, lambda resource: resource.children(), indexNode):
+                continue
+        except:
+            self.database.rollback()
+            raise
+        self.database.commit()
+        log.info("rebuilt repository index with %d resources", len(self))
+
+
+_index = None
+
+def getRepositoryIndex():
+    """
+    Implements a singleton for getting the process-wide RepositoryIndex.
+
+    @return the RepositoryIndex, None if it is disabled in the configuration (or not available)
+    """
+    global _index
+    if _index is None:
+        config = getConfig()
+        if not config.getboolean("common", "repositoryindex"):
+            return None
+        try:
+            _index = RepositoryIndex(os.path.join(config.get("common", "angelhome"), INDEX_NAME))
+        except RuntimeError, e:
+            log.warn("repository index not available: %s", e)
+            return None
+    return _index
+
+def indexResource(resource, validated = None):
+    """
+    Update the index for the resource, if the index is enabled. Failures are logged only.
+
+    @see RepositoryIndex.update
+    """
+    index = getRepositoryIndex()
+    if index is None:
+        return
+    try:
+        index.update(resource, validated)
+    except Exception, e:
+        log.warn("failed to update the repository index for %s", resource.fp.path, exc_info = e)
+
+def unindexResource(path):
+    """
+    Remove the resource with the given relative path (and those below it) from the index, 
+    if the index is enabled. Failures are logged only.
+    """
+    index = getRepositoryIndex()
+    if index is None:
+        return
+    try:
+        index.remove(path)
+    except Exception, e:
+        log.warn("failed to update the repository index for %s", path, exc_info = e)
@@ -0,0 +1,113 @@
+"""
+A lightweight handle on a local resource, for code that only looks at the metadata
+of (many) resources, such as the maintainer's traversal of the repository, and the
+lookup of the properties a resource inherits from its parents.
+
+A Basic resource is a full DAVFile along with its content, render and property managers.
+A ResourceHandle is just the path of the resource, the property manager is only created
+when the metadata is first accessed.
+"""
+
+import os
+import urllib
+
+from twisted.python.filepath import FilePath
+
+from angel_app.resource import childLink
+from angel_app.resource.local import propertyManager
+from angel_app.resource.local.basic import keyRing
+from angel_app.resource.local.basic import repository
+from angel_app.resource.resource import Resource
+
+class ResourceHandle(Resource):
+    """
+    A read-mostly view of a local resource, providing the Resource methods that need nothing
+    but the metadata. Use a Basic resource (see basic()) for anything involving the content.
+    """
+    __slots__ = ("path", "_propertyManager")
+
+    def __init__(self, path):
+        """
+        @param path: the path of the resource in the local file system, below the repository root
+        """
+        self.path = os.path.abspath(path)
+        self._propertyManager = None
+
+    def __repr__(self):
+        return "ResourceHandle(%r)" % self.path
+
+    def _getFilePath(self):
+        # rarely needed (e.g. when a default property is persisted), so it is not kept
+        return FilePath(self.path)
+
+    fp = property(_getFilePath)
+
+    def basic(self):
+        """
+        @return the Basic resource for the same path
+        """
+        from angel_app.resource.local.basic import Basic
+        return Basic(self.path)
+
+    def getPropertyManager(self):
+        if self._propertyManager is None:
+            self._propertyManager = propertyManager.getDefaultPropertyManager(self)
+        return self._propertyManager
+
+    def isCollection(self):
+        return os.path.isdir(self.path)
+
+    def isRepositoryRoot(self):
+        """
+        Returns true, if the resource is the repository's root resource, false otherwise.
+        """
+        return self.path == repository.path
+
+    def resourceName(self):
+        """
+        @return the "file name" of the resource, return "/" for the repository root
+        """
+        if self.isRepositoryRoot():
+            return os.sep
+        return os.path.basename(self.path)
+
+    def relativePath(self):
+        """
+        @see Basic.relativePath
+        """
+        if self.isRepositoryRoot():
+            return os.sep
+        assert self.path.startswith(repository.path + os.sep), \
+            "Path (%s) lies outside of repository." % self.path
+        path = self.path[len(repository.path):]
+        if self.isCollection():
+            path += os.sep
+        return path
+
+    def relativeURL(self):
+        """
+        @return: a URL-quoted representation of self.relativePath()
+        """
+        return urllib.pathname2url(self.relativePath())
+
+    def isWritableFile(self):
+        """
+        @see Basic.isWritableFile
+        """
+        return self.publicKeyString() in keyRing
+
+    def parent(self):
+        """
+        @return a handle on this resource's parent, None for the repository root
+        """
+        if self.isRepositoryRoot():
+            return None
+        return ResourceHandle(os.path.dirname(self.path))
+
+    def children(self):
+        """
+        @return handles on the child resources of this resource, as referenced in its meta data
+        @see Basic.children
+        """
+        childLinks = childLink.parseChildren(self.childLinks())
+        return [ResourceHandle(os.sep.join([self.path, cc.name])) for cc in childLinks]
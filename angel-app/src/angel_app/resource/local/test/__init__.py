@@ -1 +1 @@
-all = ["localResourceTest", "localResourceTest", "propertyStoreTest", "ZODBPropertyManagerTest"]
\ No newline at end of file
+all = ["localResourceTest", "localResourceTest", "metadataCacheTest", "propertyStoreTest", "repositoryIndexTest", "resourceHandleTest", "directoryDeadPropertiesTest", "elementCodecTest", "recordDeadPropertiesTest", "sqliteDeadPropertiesTest", "validationCacheTest", "ZODBPropertyManagerTest"]
\ No newline at end of file
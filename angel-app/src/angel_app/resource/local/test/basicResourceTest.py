@@ -139,8 +139,24 @@ class BasicResourceTest(LocalResourceTest):
         @return: an object that minimally supports the read() method, which in turn returns the stream contents as a string.
         """
         assert self.testDirectory.open().read() == REPR_DIRECTORY
-        
-        
+
+    def testPrefetchChildren(self):
+        """
+        A single Depth: 1 PROPFIND must provide the properties of all children.
+        """
+        children = self.testClone.prefetchChildren()
+        assert [cc.path for cc in children] == ["/TEST/file.txt"]
+        child = children[0]
+        assert child.prefetched is not None
+        for ee in child.getPropertyManager().cachedProperties:
+            assert ee.qname() in child.getPropertyManager().propertyCache
+        (resourceID, revision) = (child.resourceID(), child.revision())
+        # the cache is shared with all clones for the same URI, so we have to drop it for comparison
+        fresh = Clone(self.testClone.host, self.testClone.port, "/TEST/file.txt")
+        fresh.getPropertyManager().invalidateCache()
+        assert resourceID == fresh.resourceID()
+        assert revision == fresh.revision()
+
     def testClones(self):
         """
         Since the dirResource was freshly created, its clones must all be inherited from the parent.
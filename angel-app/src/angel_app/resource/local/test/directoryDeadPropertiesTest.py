@@ -0,0 +1,55 @@
+"""
+Tests for the directory based dead property store.
+"""
+
+from angel_app import elements
+from angel_app.resource.IDeadPropertyStore import IDeadPropertyStore
+from angel_app.resource.local.DirectoryDeadProperties import DirectoryDeadProperties
+from angel_app.resource.local.test.localResourceTest import LocalResourceTest
+import os
+import shutil
+import zope.interface.verify
+
+class DirectoryDeadPropertiesTest(LocalResourceTest):
+
+    def setUp(self):
+        super(DirectoryDeadPropertiesTest, self).setUp()
+        # start over with an empty store
+        path = DirectoryDeadProperties(self.testFile).metadataPath.path
+        shutil.rmtree(path, True)
+        os.makedirs(path)
+
+    def testInterfaceCompliance(self):
+        assert zope.interface.verify.verifyClass(IDeadPropertyStore, DirectoryDeadProperties)
+
+    def testSetGetDelete(self):
+        store = DirectoryDeadProperties(self.testFile)
+        revision = elements.Revision.fromString("42")
+        assert not store.contains(revision.qname())
+        store.set(revision)
+        assert store.contains(revision.qname())
+        assert revision.qname() in store.list()
+        assert store.get(revision.qname()).toxml() == revision.toxml()
+        store.delete(revision.qname())
+        assert not store.contains(revision.qname())
+        assert store.get(revision.qname()) is None
+
+    def testCacheInvalidation(self):
+        """
+        Modifications by one store must be visible to other stores of the same resource,
+        even after they have read (and cached) the property.
+        """
+        first = DirectoryDeadProperties(self.testFile)
+        second = DirectoryDeadProperties(self.testFile)
+        first.set(elements.Revision.fromString("1"))
+        assert str(second.get(elements.Revision.qname())) == "1"
+        first.set(elements.Revision.fromString("2"))
+        assert str(second.get(elements.Revision.qname())) == "2"
+        first.delete(elements.Revision.qname())
+        assert second.get(elements.Revision.qname()) is None
+
+    def testCorruptProperty(self):
+        store = DirectoryDeadProperties(self.testFile)
+        open(store._fileNameFor(elements.Revision.qname()), 'wb').write("garbage")
+        assert not store.contains(elements.Revision.qname())
+        assert store.get(elements.Revision.qname()) is None
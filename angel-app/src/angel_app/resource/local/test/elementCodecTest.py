@@ -0,0 +1,82 @@
+"""
+Tests for the compact encoding of metadata elements.
+"""
+
+from angel_app import elements
+from angel_app.resource.local import elementCodec
+from angel_app.resource.util import blockHashesToElement
+from angel_app.resource.remote.clone import Clone
+from angel_app.resource.remote.clone import clonesToElement
+from twisted.web2.dav import davxml
+import cPickle
+import unittest
+
+def makeChildren(count):
+    return elements.Children(*[
+                               elements.Child(
+                                              davxml.HRef("child%d" % ii),
+                                              elements.ResourceID.fromString("/child%d(2010, 7, 24)" % ii),
+                                              elements.UUID.fromString("0ed3a0e2-b9a1-4e5c-8e8a-1b9c1d2ab3%02d" % (ii % 100))
+                                              )
+                               for ii in range(count)])
+
+class ElementCodecTest(unittest.TestCase):
+
+    def assertRoundTrip(self, element):
+        data = elementCodec.encode(element)
+        decoded = elementCodec.decode(data)
+        assert isinstance(decoded, element.__class__)
+        assert decoded == element
+        assert decoded.toxml() == element.toxml()
+        return data
+
+    def testTextElements(self):
+        for element in [elements.Revision.fromString("42"),
+                        elements.ContentSignature.fromString("abc"),
+                        elements.Encrypted.fromString("0"),
+                        elements.ResourceID.fromString(""),
+                        elements.MetaDataSignature.fromString("(1L, 2L)")]:
+            assert self.assertRoundTrip(element).startswith(elementCodec.MAGIC)
+
+    def testTrees(self):
+        clones = clonesToElement([Clone("localhost", 6221, "/foo"), Clone("example.org", 6221, "/bar")])
+        blockHashes = blockHashesToElement(1024, ["aa", "bb"])
+        for element in [makeChildren(0), makeChildren(100), clones, blockHashes]:
+            assert self.assertRoundTrip(element).startswith(elementCodec.MAGIC)
+
+    def testLazy(self):
+        """
+        The children of large elements must be materialized on access only, and elements that 
+        were not accessed be encoded as they were.
+        """
+        children = makeChildren(10)
+        data = elementCodec.encode(children)
+        decoded = elementCodec.decode(data)
+        assert isinstance(decoded, elements.Children)
+        assert not decoded.__dict__.has_key("_children")
+        assert elementCodec.encode(decoded) == data
+        assert len(decoded.children) == 10
+        assert decoded == children
+        # modified elements are encoded as such
+        decoded.children = decoded.children[:5]
+        assert elementCodec.decode(elementCodec.encode(decoded)) == makeChildren(5)
+        # pickled as plain elements
+        assert cPickle.loads(cPickle.dumps(decoded, cPickle.HIGHEST_PROTOCOL)).__class__ is elements.Children
+
+    def testCompact(self):
+        children = makeChildren(100)
+        assert len(elementCodec.encode(children)) < len(cPickle.dumps(children, cPickle.HIGHEST_PROTOCOL))
+
+    def testPickleFallback(self):
+        """
+        Elements we don't know must be pickled, and pickles (e.g. stored by older versions) be decoded.
+        """
+        self.assertRoundTrip(davxml.GETContentType.fromString("text/plain"))
+        assert not elementCodec.encode(davxml.GETContentType.fromString("text/plain")).startswith(elementCodec.MAGIC)
+        revision = elements.Revision.fromString("7")
+        assert elementCodec.decode(cPickle.dumps(revision)) == revision
+
+    def testCorrupt(self):
+        data = elementCodec.encode(makeChildren(3))
+        for corrupt in [data[:-5], elementCodec.MAGIC + "garbage", elementCodec.MAGIC]:
+            self.assertRaises(elementCodec.DECODE_ERRORS, elementCodec.decode, corrupt)
@@ -0,0 +1,100 @@
+"""
+Tests for the process-wide local metadata cache.
+"""
+
+from angel_app import elements
+from angel_app.resource.local.CachedDeadProperties import CachedDeadProperties
+from angel_app.resource.local.RecordDeadProperties import RecordDeadProperties
+from angel_app.resource.local.metadataCache import MetadataCache
+from angel_app.resource.local.test.localResourceTest import LocalResourceTest
+import unittest
+
+class MetadataCacheTest(unittest.TestCase):
+
+    def testLookup(self):
+        cache = MetadataCache()
+        revision = elements.Revision.fromString("1")
+        cache.update("a", 1, revision.qname(), revision)
+        cache.update("a", 1, elements.BlockHashes.qname(), None)
+        assert cache.lookup("a", 1, revision.qname()) == (True, revision)
+        assert cache.lookup("a", 1, elements.BlockHashes.qname()) == (True, None)
+        assert cache.lookup("a", 1, elements.ResourceID.qname()) == (False, None)
+        assert cache.lookup("b", 1, revision.qname()) == (False, None)
+        assert cache.hits == 2
+        assert cache.misses == 2
+        assert cache.hitRate() == 0.5
+
+    def testStale(self):
+        """
+        Properties cached for a different stamp must not be returned.
+        """
+        cache = MetadataCache()
+        revision = elements.Revision.fromString("1")
+        cache.update("a", 1, revision.qname(), revision)
+        assert cache.lookup("a", 2, revision.qname()) == (False, None)
+        assert cache.stale == 1
+        assert len(cache) == 0
+
+    def testEviction(self):
+        """
+        The least recently used entries must be dropped first.
+        """
+        cache = MetadataCache(maxEntries = 10)
+        revision = elements.Revision.fromString("1")
+        for ii in range(10):
+            cache.update(ii, 1, revision.qname(), revision)
+        for ii in range(1, 10):
+            cache.lookup(ii, 1, revision.qname())
+        cache.update(10, 1, revision.qname(), revision)
+        assert len(cache) == 10
+        assert cache.lookup(0, 1, revision.qname()) == (False, None)
+        assert cache.lookup(10, 1, revision.qname()) == (True, revision)
+
+    def testInvalidateWhere(self):
+        cache = MetadataCache()
+        revision = elements.Revision.fromString("1")
+        for key in ["/a", "/a/b", "/ab"]:
+            cache.update(key, 1, revision.qname(), revision)
+        cache.invalidateWhere(lambda key: key == "/a" or key.startswith("/a/"))
+        assert cache.lookup("/ab", 1, revision.qname()) == (True, revision)
+        assert len(cache) == 1
+
+class CachedDeadPropertiesTest(LocalResourceTest):
+
+    def setUp(self):
+        super(CachedDeadPropertiesTest, self).setUp()
+        self.cache = MetadataCache()
+
+    def makeStore(self):
+        store = CachedDeadProperties(RecordDeadProperties(self.testFile))
+        store.cache = self.cache
+        return store
+
+    def testSharedCache(self):
+        """
+        Stores for the same resource must share the cached properties.
+        """
+        self.makeStore().set(elements.Revision.fromString("1"))
+        assert str(self.makeStore().get(elements.Revision.qname())) == "1"
+        assert self.cache.hits == 1
+
+    def testExternalModification(self):
+        """
+        Modifications that bypass the cache (e.g. by another process) must be noticed.
+        """
+        store = self.makeStore()
+        store.set(elements.Revision.fromString("1"))
+        RecordDeadProperties(self.testFile).set(elements.Revision.fromString("2"))
+        assert str(store.get(elements.Revision.qname())) == "2"
+        RecordDeadProperties(self.testFile).delete(elements.Revision.qname())
+        assert not store.contains(elements.Revision.qname())
+
+    def testRemove(self):
+        """
+        Removing a collection must drop the cached properties of the resources below it.
+        """
+        self.makeStore().set(elements.Revision.fromString("1"))
+        directory = CachedDeadProperties(RecordDeadProperties(self.testDirectory))
+        directory.cache = self.cache
+        directory.remove()
+        assert len(self.cache) == 0
@@ -0,0 +1,54 @@
+"""
+Tests for the record based dead property store.
+"""
+
+from angel_app import elements
+from angel_app.resource.IDeadPropertyStore import IDeadPropertyStore
+from angel_app.resource.local.DirectoryDeadProperties import DirectoryDeadProperties
+from angel_app.resource.local.RecordDeadProperties import RecordDeadProperties
+from angel_app.resource.local.test.localResourceTest import LocalResourceTest
+import os
+import shutil
+import zope.interface.verify
+
+class RecordDeadPropertiesTest(LocalResourceTest):
+
+    def testInterfaceCompliance(self):
+        assert zope.interface.verify.verifyClass(IDeadPropertyStore, RecordDeadProperties)
+
+    def testSetGetDelete(self):
+        store = RecordDeadProperties(self.testFile)
+        revision = elements.Revision.fromString("42")
+        store.set(revision)
+        assert store.contains(revision.qname())
+        assert revision.qname() in store.list()
+        assert store.get(revision.qname()).toxml() == revision.toxml()
+        store.delete(revision.qname())
+        assert not store.contains(revision.qname())
+        assert store.get(revision.qname()) is None
+
+    def testSharedRecord(self):
+        """
+        Modifications by one store must be visible to other stores of the same resource.
+        """
+        first = RecordDeadProperties(self.testFile)
+        second = RecordDeadProperties(self.testFile)
+        first.set(elements.Revision.fromString("1"))
+        assert str(second.get(elements.Revision.qname())) == "1"
+        second.set(elements.Revision.fromString("2"))
+        assert str(first.get(elements.Revision.qname())) == "2"
+
+    def testMigration(self):
+        """
+        Properties stored one file per property must be moved to the record.
+        """
+        path = RecordDeadProperties(self.testFile).metadataPath.path
+        shutil.rmtree(path, True)
+        os.makedirs(path)
+        old = DirectoryDeadProperties(self.testFile)
+        old.set(elements.Revision.fromString("7"))
+        old.set(elements.ResourceID.fromString("foo"))
+        store = RecordDeadProperties(self.testFile)
+        assert str(store.get(elements.Revision.qname())) == "7"
+        assert str(store.get(elements.ResourceID.qname())) == "foo"
+        assert os.listdir(store.metadataPath.path) == [".properties"]
@@ -0,0 +1,66 @@
+"""
+Tests for the repository index.
+"""
+
+from angel_app.resource.local.repositoryIndex import RepositoryIndex
+from angel_app.resource.local.test.localResourceTest import LocalResourceTest
+import os
+import tempfile
+
+class RepositoryIndexTest(LocalResourceTest):
+
+    def setUp(self):
+        super(RepositoryIndexTest, self).setUp()
+        (fd, self.indexPath) = tempfile.mkstemp(".sqlite")
+        os.close(fd)
+        self.index = RepositoryIndex(self.indexPath)
+
+    def tearDown(self):
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.exists(self.indexPath + suffix):
+                os.remove(self.indexPath + suffix)
+        super(RepositoryIndexTest, self).tearDown()
+
+    def testUpdate(self):
+        self.index.update(self.testFile)
+        entry = self.index.get(self.testFile.relativePath())
+        assert entry.resourceID == str(self.testFile.resourceID())
+        assert entry.keyUUID == str(self.testFile.keyUUID())
+        assert entry.revision == self.testFile.revision()
+        assert entry.contentSignature == self.testFile.contentSignature()
+        assert entry.size == len(self.testText)
+        assert not entry.isCollection
+        assert entry.validated is None
+        assert entry.clones == [cc.toURI() for cc in self.testFile.clones()]
+        # the validation time is kept, unless a new one is given
+        self.index.update(self.testFile, 42.0)
+        self.index.update(self.testFile)
+        assert self.index.get(self.testFile.relativePath()).validated == 42.0
+        assert self.index.get("/nonexistent") is None
+
+    def testEntries(self):
+        self.index.update(self.testDirectory, 10.0)
+        self.index.update(self.testFile, 20.0)
+        assert len(self.index) == 2
+        assert [entry.path for entry in self.index.entries()] == ["/TEST", "/TEST/file.txt"]
+        assert [entry.path for entry in self.index.entries(validatedBefore = 15.0)] == ["/TEST"]
+        assert len(self.index.entries(keyUUID = self.testFile.keyUUID())) == 2
+        assert self.index.entries(keyUUID = "foo") == []
+        assert [entry.path for entry in self.index.entries(resourceID = self.testFile.resourceID())] == ["/TEST/file.txt"]
+        assert self.index.totalSize() == len(self.testText)
+        assert self.index.totalSize(self.testFile.keyUUID()) == len(self.testText)
+
+    def testRemove(self):
+        """
+        Removing a collection must remove the resources below it.
+        """
+        self.index.update(self.testDirectory)
+        self.index.update(self.testFile)
+        self.index.remove(self.testDirectory.relativePath())
+        assert len(self.index) == 0
+
+    def testRebuild(self):
+        self.index.update(self.testFile, 42.0)
+        self.index.rebuild(self.testDirectory)
+        assert [entry.path for entry in self.index.entries()] == ["/TEST", "/TEST/file.txt"]
+        assert self.index.get(self.testFile.relativePath()).validated == 42.0
@@ -0,0 +1,48 @@
+"""
+Tests for the lightweight resource handles.
+"""
+
+from angel_app.resource.local.basic import Basic
+from angel_app.resource.local.basic import repository
+from angel_app.resource.local.resourceHandle import ResourceHandle
+from angel_app.resource.local.test.localResourceTest import LocalResourceTest
+
+class ResourceHandleTest(LocalResourceTest):
+
+    def testSlots(self):
+        handle = ResourceHandle(self.testFilePath)
+        assert not hasattr(handle, "__dict__")
+        # the property manager is created when the metadata is first accessed
+        assert handle._propertyManager is None
+        handle.revision()
+        assert handle._propertyManager is not None
+
+    def testPaths(self):
+        for resource in [self.testFile, self.testDirectory, Basic(repository.path)]:
+            handle = ResourceHandle(resource.fp.path)
+            assert handle.relativePath() == resource.relativePath()
+            assert handle.resourceName() == resource.resourceName()
+            assert handle.isCollection() == resource.isCollection()
+            assert handle.isRepositoryRoot() == resource.isRepositoryRoot()
+            assert handle.basic().fp.path == resource.fp.path
+        assert ResourceHandle(repository.path).parent() is None
+        assert ResourceHandle(self.testFilePath).parent().path == self.testDirectory.fp.path
+
+    def testMetadata(self):
+        """
+        A handle must see the same metadata as the resource.
+        """
+        handle = ResourceHandle(self.testFilePath)
+        assert handle.revision() == self.testFile.revision()
+        assert handle.resourceID() == self.testFile.resourceID()
+        assert handle.keyUUID() == self.testFile.keyUUID()
+        assert handle.clones() == self.testFile.clones()
+        assert handle.isWritableFile() == self.testFile.isWritableFile()
+        assert [child.path for child in ResourceHandle(self.testDirPath).children()] == \
+            [child.fp.path for child in self.testDirectory.children()]
+
+    def testLazyManagers(self):
+        resource = Basic(self.testFilePath)
+        assert resource.contentManager is None
+        assert resource.getContentManager() is resource.getContentManager()
+        assert resource.getPropertyManager() is resource.deadProperties()
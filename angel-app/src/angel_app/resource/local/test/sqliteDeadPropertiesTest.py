@@ -0,0 +1,140 @@
+"""
+Tests for the sqlite based dead property store.
+"""
+
+from angel_app import elements
+from angel_app.resource.IDeadPropertyStore import IDeadPropertyStore
+from angel_app.resource.local.DirectoryDeadProperties import DirectoryDeadProperties
+from angel_app.resource.local.DirectoryDeadProperties import metadata
+from angel_app.resource.local.SqliteDeadProperties import SqliteDeadProperties
+from angel_app.resource.local.SqliteDeadProperties import BatchAborted
+from angel_app.resource.local.SqliteDeadProperties import Database
+from angel_app.resource.local.SqliteDeadProperties import convert
+from angel_app.resource.local.test.localResourceTest import LocalResourceTest
+import os
+import shutil
+import tempfile
+import zope.interface.verify
+
+class SqliteDeadPropertiesTest(LocalResourceTest):
+
+    def setUp(self):
+        super(SqliteDeadPropertiesTest, self).setUp()
+        (fd, self.databasePath) = tempfile.mkstemp(".sqlite")
+        os.close(fd)
+
+    def tearDown(self):
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.exists(self.databasePath + suffix):
+                os.remove(self.databasePath + suffix)
+        super(SqliteDeadPropertiesTest, self).tearDown()
+
+    def makeStore(self, resource):
+        store = SqliteDeadProperties(resource)
+        store.database = Database(self.databasePath)
+        return store
+
+    def testInterfaceCompliance(self):
+        assert zope.interface.verify.verifyClass(IDeadPropertyStore, SqliteDeadProperties)
+
+    def testSetGetDelete(self):
+        store = self.makeStore(self.testFile)
+        revision = elements.Revision.fromString("42")
+        store.set(revision)
+        assert store.contains(revision.qname())
+        assert store.list() == [revision.qname()]
+        assert store.get(revision.qname()).toxml() == revision.toxml()
+        store.delete(revision.qname())
+        assert not store.contains(revision.qname())
+        assert store.get(revision.qname()) is None
+
+    def testBatch(self):
+        store = self.makeStore(self.testFile)
+        other = Database(self.databasePath)
+        store.begin()
+        store.set(elements.Revision.fromString("1"))
+        store.begin()
+        store.set(elements.ResourceID.fromString("foo"))
+        store.commit()
+        # not committed before the outermost batch is
+        assert other.execute("SELECT COUNT(*) FROM properties").fetchone()[0] == 0
+        store.commit()
+        assert other.execute("SELECT COUNT(*) FROM properties").fetchone()[0] == 2
+
+        store.begin()
+        store.set(elements.Revision.fromString("2"))
+        store.rollback()
+        assert str(store.get(elements.Revision.qname())) == "1"
+
+    def testNestedRollback(self):
+        """
+        Rolling back a nested batch aborts the whole batch, which the outermost commit reports.
+        """
+        store = self.makeStore(self.testFile)
+        store.set(elements.Revision.fromString("1"))
+        store.begin()
+        store.set(elements.Revision.fromString("2"))
+        store.begin()
+        store.rollback()
+        store.set(elements.ResourceID.fromString("foo"))
+        # not committed on its own
+        assert Database(self.databasePath).execute("SELECT COUNT(*) FROM properties").fetchone()[0] == 1
+        self.assertRaises(BatchAborted, store.commit)
+        assert str(store.get(elements.Revision.qname())) == "1"
+        assert store.get(elements.ResourceID.qname()) is None
+        # the batch is over, modifications are committed right away again
+        store.set(elements.Revision.fromString("3"))
+        assert Database(self.databasePath).execute("SELECT COUNT(*) FROM properties").fetchone()[0] == 1
+
+    def testRemove(self):
+        """
+        Removing a collection's properties must remove those of its children as well.
+        """
+        directory = self.makeStore(self.testDirectory)
+        directory.set(elements.Revision.fromString("1"))
+        self.makeStore(self.testFile).set(elements.Revision.fromString("1"))
+        directory.remove()
+        assert self.makeStore(self.testFile).list() == []
+        assert directory.list() == []
+
+    def testConvert(self):
+        # start over with the properties of the test file in the directory layout
+        shutil.rmtree(os.path.join(metadata, "TEST", "file.txt"), True)
+        old = DirectoryDeadProperties(self.testFile)
+        old.set(elements.Revision.fromString("7"))
+        old.set(elements.ResourceID.fromString("foo"))
+        database = Database(self.databasePath)
+        assert convert(metadata + os.sep + "TEST", database) >= 2
+        # convert the (relative) paths as if the test directory was the metadata root
+        store = self.makeStore(self.testFile)
+        store.key = os.sep + "file.txt"
+        assert str(store.get(elements.Revision.qname())) == "7"
+        assert str(store.get(elements.ResourceID.qname())) == "foo"
+
+    def testStamp(self):
+        """
+        The stamp must change with every modification of the resource's properties, whichever
+        connection commits it, and only then.
+        """
+        store = self.makeStore(self.testFile)
+        other = self.makeStore(self.testFile)
+        directory = self.makeStore(self.testDirectory)
+        stamp = store.stamp()
+        other.set(elements.Revision.fromString("1"))
+        assert store.stamp() != stamp
+        stamp = store.stamp()
+        # a fresh connection sees the same version
+        assert self.makeStore(self.testFile).stamp() == stamp
+        # modifications of other resources don't matter
+        directory.set(elements.Revision.fromString("1"))
+        assert store.stamp() == stamp
+        other.begin()
+        other.set(elements.Revision.fromString("2"))
+        other.rollback()
+        assert store.stamp() == stamp
+        other.delete(elements.Revision.qname())
+        assert store.stamp() != stamp
+        stamp = store.stamp()
+        other.set(elements.Revision.fromString("3"))
+        directory.remove()
+        assert store.stamp() != stamp
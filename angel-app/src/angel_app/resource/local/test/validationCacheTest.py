@@ -0,0 +1,62 @@
+"""
+Tests for the validation cache.
+"""
+
+from angel_app.resource.local.test.localResourceTest import LocalResourceTest
+from angel_app.resource.local.validationCache import ValidationCache
+from angel_app.resource.local.validationCache import fileIdentity
+from angel_app.resource.local.validationCache import getValidationCache
+import os
+import tempfile
+
+class ValidationCacheTest(LocalResourceTest):
+
+    def setUp(self):
+        super(ValidationCacheTest, self).setUp()
+        (fd, self.cachePath) = tempfile.mkstemp(".sqlite")
+        os.close(fd)
+        self.cache = ValidationCache(self.cachePath)
+
+    def tearDown(self):
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.exists(self.cachePath + suffix):
+                os.remove(self.cachePath + suffix)
+        super(ValidationCacheTest, self).tearDown()
+
+    def testIdentity(self):
+        identity = fileIdentity(self.testFile)
+        assert identity == fileIdentity(self.testFile)
+        open(self.testFilePath, 'a').write("more")
+        assert identity != fileIdentity(self.testFile)
+
+    def testIsValid(self):
+        path = self.testFile.relativePath()
+        identity = fileIdentity(self.testFile)
+        assert not self.cache.isValid(path, identity)
+        self.cache.add(path, identity)
+        assert self.cache.isValid(path, identity)
+        assert not self.cache.isValid(path, identity[:-1] + ("foo",))
+        self.cache.invalidate(path)
+        assert not self.cache.isValid(path, identity)
+        # removing a collection forgets the resources below it
+        self.cache.add(path, identity)
+        self.cache.remove(self.testDirectory.relativePath())
+        assert len(self.cache) == 0
+        assert (self.cache.hits, self.cache.misses) == (1, 3)
+
+    def testDeepScrub(self):
+        """
+        Contents that rot without changing the identity of the file are only
+        found to be invalid by a deep validation.
+        """
+        if getValidationCache() is None:
+            return
+        assert self.testFile.validate()
+        f = open(self.testFilePath, 'r+')
+        f.write("L")
+        f.close()
+        # pretend the corruption went unnoticed by the file system
+        getValidationCache().add(self.testFile.relativePath(), fileIdentity(self.testFile))
+        assert self.testFile.validate()
+        assert not self.testFile.validate(deep = True)
+        assert not self.testFile.validate()
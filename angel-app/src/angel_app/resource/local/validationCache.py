@@ -0,0 +1,164 @@
+"""
+A persistent cache of the validation results of local resources.
+
+Validating a resource means hashing all of its contents and verifying the RSA
+signature of its metadata, and the maintainer does so several times for every
+resource it inspects. Once a resource has been found valid, we record the identity
+of its file (inode, size, modification and change time) along with a digest of
+its signed metadata (and signature). As long as both remain the same, the resource
+is known to be valid without hashing and verifying it again.
+
+The file identity does not change if the contents rot on disk, so every once in a
+while the maintainer validates a resource without the cache, see maintainer.schedule
+and maintainer.deepscrubinterval.
+"""
+
+import os
+import time
+from logging import getLogger
+
+from angel_app.config.config import getConfig
+from angel_app.resource.local.SqliteDeadProperties import Database
+from angel_app.resource.util import getHashObject
+
+log = getLogger(__name__)
+
+# the data base file, next to the metadata directory tree
+CACHE_NAME = "validation.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS validations (
+    path TEXT PRIMARY KEY,
+    inode INTEGER,
+    size INTEGER,
+    mtime INTEGER,
+    ctime INTEGER,
+    contentsignature TEXT,
+    metadatadigest TEXT,
+    validated REAL
+);
+"""
+
+def _key(path):
+    """
+    @return the key of the resource with the given relative path in the cache
+    """
+    return path.rstrip(os.sep) or os.sep
+
+def _nanoseconds(seconds):
+    # os.stat() has no st_mtime_ns on python 2
+    return long(seconds * 1000000000)
+
+def fileIdentity(resource):
+    """
+    @return a tuple identifying the current version of the resource's file and metadata,
+        None if the resource can't be found (or its metadata is incomplete)
+    """
+    try:
+        st = os.stat(resource.fp.path)
+        digest = getHashObject(resource.publicKeyString())
+        digest.update(resource.signableMetadata())
+        digest.update(resource.metaDataSignature())
+        return (st.st_ino, st.st_size, _nanoseconds(st.st_mtime), _nanoseconds(st.st_ctime),
+                resource.contentSignature(), digest.hexdigest())
+    except (OSError, KeyError):
+        return None
+
+class ValidationCache(object):
+    """
+    The resources found valid, by relative path, along with the identity of their
+    file and metadata at the time.
+    """
+    def __init__(self, path):
+        self.database = Database(path, SCHEMA)
+        # statistics
+        self.hits = 0
+        self.misses = 0
+
+    def isValid(self, path, identity):
+        """
+        @param path: the relative path of the resource
+        @param identity: the current identity of the resource, see fileIdentity()
+        @return whether the resource has been found valid with that identity
+        """
+        row = self.database.execute(
+                    "SELECT inode, size, mtime, ctime, contentsignature, metadatadigest " +
+                    "FROM validations WHERE path = ?", (_key(path),)).fetchone()
+        if row is not None and tuple(row) == identity:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, path, identity, validated = None):
+        """
+        Record that the resource with the given relative path and identity is valid.
+        """
+        if validated is None:
+            validated = time.time()
+        self.database.execute(
+                    "INSERT OR REPLACE INTO validations (path, inode, size, mtime, ctime, " +
+                    "contentsignature, metadatadigest, validated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (_key(path),) + tuple(identity) + (validated,))
+
+    def invalidate(self, path):
+        """
+        Forget the resource with the given relative path, e.g. because it was found invalid.
+        """
+        self.database.execute("DELETE FROM validations WHERE path = ?", (_key(path),))
+
+    def remove(self, path):
+        """
+        Forget the resource with the given relative path, and all resources below it.
+        """
+        key = _key(path)
+        prefix = key.rstrip(os.sep) + os.sep
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        self.database.begin()
+        try:
+            self.database.execute("DELETE FROM validations WHERE path = ?", (key,))
+            self.database.execute("DELETE FROM validations WHERE path >= ? AND path < ?", (prefix, upper))
+        except:
+            self.database.rollback()
+            raise
+        self.database.commit()
+
+    def __len__(self):
+        return self.database.execute("SELECT COUNT(*) FROM validations").fetchone()[0]
+
+    def __str__(self):
+        return "ValidationCache(entries: %d, hits: %d, misses: %d)" % (len(self), self.hits, self.misses)
+
+
+_cache = None
+
+def getValidationCache():
+    """
+    Implements a singleton for getting the process-wide ValidationCache.
+
+    @return the ValidationCache, None if it is disabled in the configuration (or not available)
+    """
+    global _cache
+    if _cache is None:
+        config = getConfig()
+        if config.getint("maintainer", "deepscrubinterval") == 0:
+            return None
+        try:
+            _cache = ValidationCache(os.path.join(config.get("common", "angelhome"), CACHE_NAME))
+        except RuntimeError, e:
+            log.warn("validation cache not available: %s", e)
+            return None
+    return _cache
+
+def forgetResource(path):
+    """
+    Remove the resource with the given relative path (and those below it) from the cache,
+    if the cache is enabled. Failures are logged only.
+    """
+    cache = getValidationCache()
+    if cache is None:
+        return
+    try:
+        cache.remove(path)
+    except Exception, e:
+        log.warn("failed to update the validation cache for %s", path, exc_info = e)
@@ -0,0 +1,182 @@
+"""
+Asynchronous versions of the Clone operations that talk to the network, returning
+Deferreds (see asyncRemote).
+
+They operate on ordinary Clone instances, and share the request bodies, the parsing
+of the responses and the process-wide property cache with the blocking methods of
+Clone. Once the properties of a clone have been fetched asynchronously (e.g. by
+probe() or fetchProperties()), the blocking property accessors of the clone (and
+thus the validation code in maintainer.collect) find them in the cache.
+"""
+
+from logging import getLogger
+
+from twisted.internet import defer
+from twisted.web2 import responsecode
+from twisted.web2.dav import davxml
+
+from angel_app.resource.remote.asyncRemote import AsyncHTTPRemote
+from angel_app.resource.remote.asyncRemote import NETWORK_ERRORS
+from angel_app.resource.remote.clone import PROBE_TIMEOUTS
+from angel_app.resource.remote.clone import ProbeResult
+from angel_app.resource.remote.clone import makeCloneBody
+from angel_app.resource.remote.clone import rangeDigestReportBody
+from angel_app.resource.remote.exceptions import BaseCloneError
+from angel_app.resource.remote.exceptions import CloneError
+from angel_app.resource.remote.exceptions import CloneIOError
+from angel_app.resource.remote.httpRemote import rangeHeader
+from angel_app.resource.remote.propertyCache import getPropertyCache
+from angel_app.resource.remote.propertyManager import PropertyManager
+from angel_app.resource.remote.propertyManager import checkPropfindStatus
+from angel_app.resource.remote.propertyManager import makePropfindRequestBody
+from angel_app.resource.remote.propertyManager import okProperties
+from angel_app.resource.util import getHashObject
+
+log = getLogger(__name__)
+
+def remoteOf(clone):
+    """
+    @return the AsyncHTTPRemote for the clone
+    """
+    return AsyncHTTPRemote(clone.host, clone.port, clone.path)
+
+def _toCloneIOError(failure, clone):
+    """
+    Errback translating network failures into a CloneIOError, like the blocking property accessors do.
+    """
+    failure.trap(*NETWORK_ERRORS)
+    raise CloneIOError("request to clone %r failed: %s" % (clone, failure.getErrorMessage()))
+
+def probe(clone, withProperties = True):
+    """
+    @see Clone.probe
+    @return a Deferred firing with a ProbeResult
+    """
+    log.debug("probe %r", clone)
+    try:
+        clone.validatePath()
+    except CloneError:
+        return defer.fail()
+    (headers, body) = clone.probeRequest(withProperties)
+    responding = remoteOf(clone).performRequest("PROPFIND", headers, body, PROBE_TIMEOUTS)
+    def gotResponse(response):
+        if response.status == responsecode.MOVED_PERMANENTLY:
+            return probe(clone._redirectClone(response.getheader("location")), withProperties)
+        return clone.probeResult(response.status, response.body, withProperties)
+    def failed(failure):
+        failure.trap(*NETWORK_ERRORS)
+        log.debug("clone %r not reachable: %s", clone, failure.getErrorMessage())
+        return ProbeResult(clone)
+    return responding.addCallbacks(gotResponse, failed)
+
+def fetchProperties(clone):
+    """
+    Make sure the frequently needed properties of the clone (see PropertyManager.cachedProperties)
+    are in the property cache.
+
+    @return a Deferred firing with the clone, or failing with a CloneError (or subclass)
+    """
+    manager = clone.getPropertyManager()
+    if getPropertyCache().lookup(manager.cacheKey, [pp.qname() for pp in manager.cachedProperties]) is not None:
+        return defer.succeed(clone)
+    responding = remoteOf(clone).performRequest("PROPFIND", {"Depth" : "0"},
+                                                makePropfindRequestBody(PropertyManager.cachedProperties))
+    def gotResponse(response):
+        checkPropfindStatus(manager.remote, response.status)
+        manager.cacheProperties(okProperties(davxml.WebDAVDocument.fromString(response.body)))
+        return clone
+    return responding.addCallbacks(gotResponse, _toCloneIOError, errbackArgs = (clone,))
+
+def prefetchChildren(clone):
+    """
+    @see Clone.prefetchChildren
+    @return a Deferred firing with the list of child Clones
+    """
+    log.debug("prefetching children of %r", clone)
+    manager = clone.getPropertyManager()
+    responding = remoteOf(clone).performRequest("PROPFIND", {"Depth" : "1"},
+                                                makePropfindRequestBody(PropertyManager.cachedProperties))
+    def gotResponse(response):
+        checkPropfindStatus(manager.remote, response.status)
+        return clone.childClones(manager.childPropertiesFrom(davxml.WebDAVDocument.fromString(response.body)))
+    return responding.addCallbacks(gotResponse, _toCloneIOError, errbackArgs = (clone,))
+
+def cloneList(clone):
+    """
+    @see Clone.cloneList
+    @return a Deferred firing with the list of the clones registered with the clone (empty if
+        they can't be found)
+    """
+    def failed(failure):
+        failure.trap(BaseCloneError, KeyError)
+        log.debug("no clone list from %r: %s", clone, failure.getErrorMessage())
+        return []
+    return fetchProperties(clone).addCallbacks(lambda dummy: clone.cloneList(), failed)
+
+def getChunkHashes(clone, chunks):
+    """
+    @see Clone.getChunkHashes
+    @return a Deferred firing with the list of digests, or None
+    """
+    responding = remoteOf(clone).performRequest("REPORT", {"Content-Type" : "text/xml"}, rangeDigestReportBody(chunks))
+    def failed(failure):
+        failure.trap(*NETWORK_ERRORS)
+        log.debug("error while requesting range digests from clone %r", clone)
+        return None
+    return responding.addCallbacks(lambda response: clone.rangeDigests(chunks, response.status, response.body), failed)
+
+def getRange(clone, consumer, offset, endoffset = None):
+    """
+    Request a byte range of the contents of the clone, passing the data to consumer as it arrives.
+
+    @param consumer: a callable, which is passed the data of a successful response
+    @param endoffset: the offset of the last byte (included), None for the end of the contents
+    @return a Deferred firing with the AsyncResponse. Its status is PARTIAL_CONTENT if the
+        clone honoured the range, OK if it sends the complete contents instead.
+    """
+    assert offset >= 0
+    return remoteOf(clone).performRequest("GET", {'range': rangeHeader(offset, endoffset)}, consumer = consumer)
+
+def getChunkHash(clone, offset, length):
+    """
+    @see Clone.getChunkHash
+    @return a Deferred firing with the digest, or None
+
+    Unlike Clone.getChunkHash, this is not subject to common.maxdownloadspeed_kib: RateLimit
+    sleeps, which would block the reactor, and a chunk is small anyway.
+    """
+    assert offset >= 0
+    assert length >= 0
+    hashObj = getHashObject()
+    received = [0]
+    def consume(data):
+        # in case the clone ignores the range and sends more
+        data = data[:length - received[0]]
+        received[0] += len(data)
+        hashObj.update(data)
+    def done(response):
+        if response.status not in (responsecode.OK, responsecode.PARTIAL_CONTENT) or received[0] != length:
+            return None
+        return hashObj.digest()
+    def failed(failure):
+        failure.trap(*NETWORK_ERRORS)
+        log.debug("network error while doing chunk validation on clone %r", clone)
+        return None
+    return getRange(clone, consume, offset, offset + length - 1).addCallbacks(done, failed)
+
+def announce(clone, localResource):
+    """
+    @see Clone.announce
+    @return a Deferred firing with whether the announcement could be sent
+    """
+    log.debug("announcing local clone to %r", clone)
+    responding = remoteOf(clone).performRequest("PROPPATCH", {}, makeCloneBody(localResource))
+    def announced(dummyresponse):
+        # the clone list of the remote clone has changed
+        clone.getPropertyManager().invalidateCache()
+        return True
+    def failed(failure):
+        failure.trap(*NETWORK_ERRORS)
+        log.debug("failed to announce to clone %r: %s", clone, failure.getErrorMessage())
+        return False
+    return responding.addCallbacks(announced, failed)
@@ -0,0 +1,335 @@
+"""
+An asynchronous counterpart of httpRemote, for use with the Twisted reactor.
+
+Requests are sent with the twisted.web2 HTTP client and return Deferreds, so a single
+process (and thread) can talk to many peers at once. Connections are kept alive and
+re-used, like those of the blocking connectionPool. The number of connections to a
+single host is limited, further requests to that host wait for a connection to
+become available.
+
+The time outs are those of httpRemote.Timeouts: the connect time out is passed to
+connectTCP, the read time out is the input time out of the client protocol, and the
+total time out is a timer aborting the request.
+"""
+
+from logging import getLogger
+
+from twisted.internet import error
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.internet.protocol import ClientCreator
+from twisted.python.failure import Failure
+from twisted.web2 import stream
+from twisted.web2.client.http import ClientRequest
+from twisted.web2.client.http import HTTPClientProtocol
+from twisted.web2.client.http import ProtocolError
+from twisted.web2.http_headers import Headers
+
+from angel_app.resource.remote.httpRemote import DEFAULT_TIMEOUTS
+from angel_app.resource.remote.httpRemote import USER_AGENT
+
+log = getLogger(__name__)
+
+# the maximum number of connections to a single host
+MAX_CONNECTIONS_PER_HOST = 4
+
+# the failures that mean the host could not be talked to (as opposed to errors in our code)
+NETWORK_ERRORS = (error.ConnectError, error.DNSLookupError, error.TimeoutError,
+                  error.ConnectionLost, error.ConnectionDone, ProtocolError)
+
+class AsyncResponse(object):
+    """
+    A python style struct holding a response. The interface resembles that of an httplib
+    response that has been read.
+    """
+    def __init__(self, status, headers, body = None):
+        self.status = status
+        # a twisted.web2.http_headers.Headers instance
+        self.headers = headers
+        # the body, None if it was passed to a consumer
+        self.body = body
+
+    def getheader(self, name, default = None):
+        values = self.headers.getRawHeaders(name)
+        if values is None:
+            return default
+        return ", ".join(values)
+
+    def read(self):
+        return self.body
+
+    def __repr__(self):
+        return "AsyncResponse(%r)" % self.status
+
+def formatHost(host):
+    """
+    @return the host as in the Host header, i.e. IPv6 addresses in brackets
+    """
+    if ":" in host:
+        return "[%s]" % host
+    return host
+
+def rawHeaders(headers):
+    """
+    @param headers: a dictionary mapping header names to (unparsed) values
+    @return a twisted.web2.http_headers.Headers instance
+    """
+    result = Headers()
+    for (name, value) in headers.iteritems():
+        result.setRawHeaders(name, [str(value)])
+    return result
+
+class _HostConnections(object):
+    """
+    A python style struct holding the connections to a single host.
+    """
+    def __init__(self):
+        # the connections not in use
+        self.idle = []
+        # the number of connections in use (or being established)
+        self.active = 0
+        # the Deferreds waiting for a connection, along with their connect time outs
+        self.waiting = []
+
+class _ConnectionManager(object):
+    """
+    Receives the state changes of a single client protocol, see
+    twisted.web2.client.interfaces.IHTTPClientManager
+    """
+    def __init__(self, pool, key):
+        self.pool = pool
+        self.key = key
+
+    def clientBusy(self, protocol):
+        pass
+
+    def clientPipelining(self, protocol):
+        pass
+
+    def clientIdle(self, protocol):
+        self.pool._idle(self.key, protocol)
+
+    def clientGone(self, protocol):
+        self.pool._gone(self.key, protocol)
+
+class _Exchange(object):
+    """
+    A single request and its response, on a pooled connection. If a re-used connection turns
+    out to have been closed by the peer in the meantime, the request is retried once on a
+    new connection.
+    """
+    def __init__(self, pool, host, port, method, path, headers, body, timeouts, consumer):
+        self.pool = pool
+        self.host = host
+        self.port = port
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+        self.timeouts = timeouts
+        self.consumer = consumer
+        self.deferred = Deferred()
+        self.protocol = None
+        self.timer = None
+        self.done = False
+
+    def start(self):
+        if self.timeouts.total is not None:
+            self.timer = reactor.callLater(self.timeouts.total, self._expire)
+        self._attempt(True)
+        return self.deferred
+
+    def _attempt(self, mayRetry):
+        connecting = self.pool._acquire(self.host, self.port, self.timeouts.connect)
+        connecting.addCallbacks(self._submit, self._fail, callbackArgs = (mayRetry,))
+
+    def _submit(self, (protocol, reused), mayRetry):
+        if self.done:
+            # timed out while waiting for the connection
+            self.pool._idle((self.host, self.port), protocol)
+            return
+        self.protocol = protocol
+        protocol.inputTimeOut = self.timeouts.read
+        request = ClientRequest(self.method, self.path, rawHeaders(self.headers), self.body or None)
+        responding = protocol.submitRequest(request, closeAfter = False)
+        responding.addCallbacks(self._gotResponse, self._submitFailed, errbackArgs = (reused and mayRetry,))
+
+    def _submitFailed(self, failure, retry):
+        self.protocol = None
+        if retry and not self.done and failure.check(error.ConnectionLost, error.ConnectionDone):
+            log.debug("stale connection to %s:%s, retrying on a new connection", self.host, self.port)
+            self._attempt(False)
+            return
+        self._fail(failure)
+
+    def _gotResponse(self, response):
+        if response.stream is None:
+            self._finish(AsyncResponse(response.code, response.headers, ""))
+            return
+        if self.consumer is not None and 200 <= response.code < 300:
+            reading = stream.readStream(response.stream, self.consumer)
+            reading.addCallbacks(lambda dummy: self._finish(AsyncResponse(response.code, response.headers)), self._fail)
+        else:
+            chunks = []
+            reading = stream.readStream(response.stream, chunks.append)
+            reading.addCallbacks(lambda dummy: self._finish(AsyncResponse(response.code, response.headers, "".join(chunks))),
+                                 self._fail)
+
+    def _finish(self, response):
+        if self.done:
+            return
+        self.done = True
+        self._cancelTimer()
+        self.deferred.callback(response)
+
+    def _fail(self, failure):
+        if self.done:
+            return
+        self.done = True
+        self._cancelTimer()
+        if self.protocol is not None and self.protocol.transport is not None:
+            # the rest of the response (if any) is of no use
+            self.protocol.transport.loseConnection()
+        self.deferred.errback(failure)
+
+    def _expire(self):
+        self.timer = None
+        self._fail(Failure(error.TimeoutError("%s %s:%s%s" % (self.method, self.host, self.port, self.path))))
+
+    def _cancelTimer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+class AsyncConnectionPool(object):
+    """
+    The persistent connections to the peers, at most maxPerHost per host.
+    """
+    def __init__(self, maxPerHost = MAX_CONNECTIONS_PER_HOST):
+        self.maxPerHost = maxPerHost
+        # map from (host, port) to _HostConnections
+        self._hosts = {}
+        # statistics
+        self.connects = 0
+        self.reuses = 0
+
+    def request(self, host, port, method, path, headers, body, timeouts, consumer = None):
+        """
+        @param headers: a dictionary mapping header names to (unparsed) values
+        @param body: the request body (a string), empty for none
+        @param timeouts: a httpRemote.Timeouts instance
+        @param consumer: if given, a callable to which the body of a successful (2xx) response is
+            passed as it arrives, rather than being returned with the response
+        @return a Deferred firing with an AsyncResponse
+        """
+        return _Exchange(self, host, port, method, path, headers, body, timeouts, consumer).start()
+
+    def _connections(self, key):
+        if not self._hosts.has_key(key):
+            self._hosts[key] = _HostConnections()
+        return self._hosts[key]
+
+    def _acquire(self, host, port, connectTimeout):
+        """
+        @return a Deferred firing with a tuple (protocol, reused), once a connection is available
+        """
+        key = (host, port)
+        connecting = Deferred()
+        self._connections(key).waiting.append((connecting, connectTimeout))
+        self._dispatch(key)
+        return connecting
+
+    def _dispatch(self, key):
+        """
+        Hand out the available connections to the requests waiting for one.
+        """
+        connections = self._connections(key)
+        while connections.waiting:
+            if connections.idle:
+                protocol = connections.idle.pop()
+                connections.active += 1
+                (connecting, dummytimeout) = connections.waiting.pop(0)
+                self.reuses += 1
+                connecting.callback((protocol, True))
+            elif connections.active < self.maxPerHost:
+                (connecting, connectTimeout) = connections.waiting.pop(0)
+                connections.active += 1
+                self._connect(key, connecting, connectTimeout)
+            else:
+                break
+        if not connections.waiting and not connections.idle and connections.active == 0:
+            del self._hosts[key]
+
+    def _connect(self, key, connecting, connectTimeout):
+        self.connects += 1
+        creator = ClientCreator(reactor, HTTPClientProtocol, _ConnectionManager(self, key))
+        def connected(protocol):
+            return (protocol, False)
+        def failed(failure):
+            self._connections(key).active -= 1
+            self._dispatch(key)
+            return failure
+        creator.connectTCP(key[0], key[1], connectTimeout).addCallbacks(connected, failed).chainDeferred(connecting)
+
+    def _idle(self, key, protocol):
+        connections = self._connections(key)
+        connections.active -= 1
+        connections.idle.append(protocol)
+        # not right away, we're called while the protocol finishes the previous request
+        reactor.callLater(0, self._dispatch, key)
+
+    def _gone(self, key, protocol):
+        connections = self._connections(key)
+        if protocol in connections.idle:
+            connections.idle.remove(protocol)
+        else:
+            connections.active -= 1
+        self._dispatch(key)
+
+    def __str__(self):
+        active = sum([connections.active for connections in self._hosts.values()])
+        idle = sum([len(connections.idle) for connections in self._hosts.values()])
+        waiting = sum([len(connections.waiting) for connections in self._hosts.values()])
+        return "AsyncConnectionPool(hosts: %d, active: %d, idle: %d, waiting: %d, connects: %d, reuses: %d)" % \
+            (len(self._hosts), active, idle, waiting, self.connects, self.reuses)
+
+
+pool = None # holder for the process-wide AsyncConnectionPool
+def getAsyncPool():
+    """
+    Implements a singleton for getting the process-wide AsyncConnectionPool.
+
+    @return: AsyncConnectionPool instance
+    """
+    global pool
+    if pool is None:
+        pool = AsyncConnectionPool()
+    return pool
+
+class AsyncHTTPRemote(object):
+    """
+    The asynchronous counterpart of httpRemote.HTTPRemote.
+    """
+    def __init__(self, host, port, path):
+        # the host name or ip
+        self.host = host
+        # a port number
+        self.port = port
+        # a path string. must be valid as part of an absolute URL (i.e. quoted, using "/")
+        self.path = path
+
+    def performRequest(self, method = "GET", headers = {}, body = "", timeouts = DEFAULT_TIMEOUTS, consumer = None):
+        """
+        @see AsyncConnectionPool.request
+        @return a Deferred firing with an AsyncResponse
+        """
+        headers = dict(headers)
+        if 'User-Agent' not in headers: headers['User-Agent'] = USER_AGENT # add default user agent
+        if 'Host' not in headers: headers['Host'] = "%s:%s" % (formatHost(self.host), self.port)
+        return getAsyncPool().request(self.host, self.port, method, self.path, headers, body, timeouts, consumer)
+
+    def __str__(self):
+        return "%s:%s%s" % (self.host, self.port, self.path)
+
+    def __repr__(self):
+        return "AsyncHTTPRemote('%s', '%s', '%s')" % (self.host, self.port, self.path)
@@ -1,9 +1,13 @@
+import binascii
 import socket
+import time
+from httplib import HTTPException
 from logging import getLogger
 
 from netaddress.rfc3986 import path_absolute
 from pyparsing import ParseException
 from twisted.web2 import responsecode
+from twisted.web2.dav import davxml
 from twisted.web2.dav.element import rfc2518
 from zope.interface import implements
 
@@ -13,7 +17,10 @@ from angel_app.config.config import getConfig
 from angel_app.resource import IResource
 from angel_app.resource.remote.contentManager import ContentManager
 from angel_app.resource.remote.httpRemote import HTTPRemote
+from angel_app.resource.remote.httpRemote import Timeouts
 from angel_app.resource.remote.propertyManager import PropertyManager
+from angel_app.resource.remote.propertyManager import makePropfindRequestBody
+from angel_app.resource.remote.propertyManager import okProperties
 from angel_app.resource.resource import Resource
 from angel_app.io import RateLimit
 from angel_app.io import bufferedReadLoop
@@ -27,6 +34,8 @@ PROVIDER_PUBLIC_LISTEN_PORT = 6221
 AngelConfig = getConfig()
 providerport = AngelConfig.getint("provider","listenPort")
 MAX_DOWNLOAD_SPEED = AngelConfig.getint('common', 'maxdownloadspeed_kib') * 1024 # internally handled in bytes
+# connecting must be as quick as for a ping, but the response may be considerably larger
+PROBE_TIMEOUTS = Timeouts(connect = 3.0, read = 10.0, total = 30.0)
 
 def typed(expr, ref):
     if not type(expr) == type(ref):
@@ -61,6 +70,9 @@ class Clone(Resource):
         # does this URI correspond to the result of a redirect (MOVED_PERMANENTLY)?
         self.redirected = False
         
+        # if the clone's properties were obtained by the parent's prefetchChildren(), the time when that happened
+        self.prefetched = None
+        
         self.updateRemote(HTTPRemote(self.host, self.port, self.path))
     
     def getPropertyManager(self):
@@ -116,29 +128,126 @@ class Clone(Resource):
         response = self.remote.performRequest(method = "HEAD", body = "")
         response.read()
         if response.status == responsecode.MOVED_PERMANENTLY:
-            log.info("Received redirect for clone: %s", self)
-            
-            if self.redirected:
-                errMsg = "Guarding against multiple redirects for " + str(self)
-                raise CloneError(errMsg)
-            
-            redirectlocation = response.getheader("location")
-            # TODO: how to verify/validate redirectlocation ?
-            # RFCs state it should be URI, but we get a path only
-            # for the time being, we require it's an absolute path
-            try:
-                path_absolute.parseString(redirectlocation)
-            except ParseException:
-                errorMessage = "Invalid redirect. Must be an absolute path. Found: " + redirectlocation
-                log.warn(errorMessage)
-                raise CloneError(errorMessage)
-            redirectClone = Clone(self.host, self.port, redirectlocation)
-            redirectClone.redirected = True
-            log.info("Redirecting to: %s", redirectClone)
-            return redirectClone
+            return self._redirectClone(response.getheader("location"))
         else:
             return self
     
+    def _redirectClone(self, redirectlocation):
+        """
+        @param redirectlocation: the location header of a MOVED_PERMANENTLY response
+        @return a new clone corresponding to the redirect target
+        """
+        log.info("Received redirect for clone: %s", self)
+        
+        if self.redirected:
+            errMsg = "Guarding against multiple redirects for " + str(self)
+            raise CloneError(errMsg)
+        
+        # TODO: how to verify/validate redirectlocation ?
+        # RFCs state it should be URI, but we get a path only
+        # for the time being, we require it's an absolute path
+        try:
+            path_absolute.parseString(redirectlocation)
+        except ParseException:
+            errorMessage = "Invalid redirect. Must be an absolute path. Found: " + redirectlocation
+            log.warn(errorMessage)
+            raise CloneError(errorMessage)
+        redirectClone = Clone(self.host, self.port, redirectlocation)
+        redirectClone.redirected = True
+        log.info("Redirecting to: %s", redirectClone)
+        return redirectClone
+    
+    def probe(self, withProperties = True):
+        """
+        Find out whether the clone is reachable, whether it redirects and whether the 
+        resource exists, all in a single PROPFIND request (rather than one HEAD request 
+        for each of ping(), checkForRedirect() and exists()). Only if the clone redirects,
+        the redirect target is probed in a second request.
+        
+        @param withProperties: if True, the frequently needed properties are requested 
+            along the way and added to the property cache of the (redirected) clone.
+        @return a ProbeResult
+        """
+        log.debug("probe %r", self)
+        
+        self.validatePath()
+        
+        (headers, requestBody) = self.probeRequest(withProperties)
+        try:
+            response = self.remote.performRequestWithTimeOuts("PROPFIND", headers, requestBody, PROBE_TIMEOUTS)
+            body = response.read()
+        except (socket.error, HTTPException), e:
+            log.debug("clone %r not reachable: %r", self, e)
+            return ProbeResult(self)
+        
+        if response.status == responsecode.MOVED_PERMANENTLY:
+            return self._redirectClone(response.getheader("location")).probe(withProperties)
+        
+        return self.probeResult(response.status, body, withProperties)
+    
+    def probeRequest(self, withProperties = True):
+        """
+        @return a tuple (headers, body) of the PROPFIND request of probe()
+        """
+        if withProperties:
+            properties = PropertyManager.cachedProperties
+        else:
+            properties = [rfc2518.ResourceType]
+        return ({"Depth" : 0}, makePropfindRequestBody(properties))
+    
+    def probeResult(self, status, body, withProperties = True):
+        """
+        @param status: the status of the (not redirected) response to the probe request
+        @param body: the body of the response
+        @return the ProbeResult for the response, see probe()
+        """
+        if status != responsecode.MULTI_STATUS:
+            log.debug("probe of %r returned status %r", self, status)
+            return ProbeResult(self, True)
+        
+        result = ProbeResult(self, True, True)
+        if withProperties:
+            try:
+                result.properties = okProperties(davxml.WebDAVDocument.fromString(body))
+                self.getPropertyManager().cacheProperties(result.properties)
+            except KeyboardInterrupt:
+                raise
+            except Exception, e:
+                # don't fail here, the properties will be requested (and fail) again when needed
+                log.debug("probe of %r returned unusable properties", self, exc_info = e)
+        return result
+    
+    def prefetchChildren(self):
+        """
+        Fetch the frequently needed properties of all children of this (collection) clone in 
+        a single PROPFIND request with Depth: 1 (rather than one request per child).
+        
+        @return a list of Clones, one for each child, with the properties already in their cache.
+        The paths of the clones are those reported by the remote host, i.e. they end with a "/" for 
+        collections.
+        """
+        log.debug("prefetching children of %r", self)
+        return self.childClones(self.getPropertyManager().childProperties())
+    
+    def childClones(self, childProperties):
+        """
+        @param childProperties: a dictionary as returned by PropertyManager.childProperties()
+        @return the child clones, see prefetchChildren()
+        """
+        now = time.time()
+        children = []
+        for (href, properties) in childProperties.iteritems():
+            child = Clone(self.host, self.port, href)
+            try:
+                child.validatePath()
+            except CloneError:
+                log.info("ignoring child with invalid path %r of clone %r", href, self)
+                continue
+            child.getPropertyManager().cacheProperties(properties)
+            child.prefetched = now
+            children.append(child)
+        return children
+    
     def __eq__(self, clone):
         """
         @rtype boolean
@@ -222,12 +331,27 @@ class Clone(Resource):
         requestBody = makeCloneBody(localResource)
         # no point in ping() or exists(): the PROPPATCH will either work or fail ;-)
         try:
-            self.remote.performRequest(method = "PROPPATCH", body = requestBody)
+            response = self.remote.performRequest(method = "PROPPATCH", body = requestBody)
+            response.read()
+            # the clone list of the remote clone has changed
+            self.getPropertyManager().invalidateCache()
         except socket.timeout:
             log.debug("timeout while announcing to clone %r", self)
             return False
         return True
 
+    def openFrom(self, offset):
+        """
+        Request the contents of the clone from offset to the end, e.g. for resuming
+        an interrupted download.
+        
+        @param offset: int
+        @return the response. Its status is PARTIAL_CONTENT if the clone honoured the range, 
+            OK if it sends the complete contents instead.
+        """
+        assert offset >= 0
+        return self.remote.performRequest("GET", {'range': rangeHeader(offset)})
+
     def getChunkHash(self, offset, length):
         """
         Utility method to fetch a byte range of the clone, compute a digest of
@@ -248,12 +372,77 @@ class Clone(Resource):
             return None
         return hashObj.digest()
 
+    def getChunkHashes(self, chunks):
+        """
+        Ask the clone for the digests of several byte ranges with a single REPORT request,
+        instead of downloading the byte ranges.
+
+        @param chunks: a list of (offset, length) tuples
+        @return a list of digests (as returned by getChunkHash), in the order of chunks,
+            or None, if the clone does not support range digest reports
+        """
+        assert not self.isCollection()
+        try:
+            response = self.remote.performRequest("REPORT",
+                                                  {"Content-Type" : "text/xml"},
+                                                  rangeDigestReportBody(chunks))
+            body = response.read()
+        except (socket.error, HTTPException):
+            log.debug("error while requesting range digests from clone %r", self)
+            return None
+        return self.rangeDigests(chunks, response.status, body)
+
+    def rangeDigests(self, chunks, status, body):
+        """
+        @param status: the status of the response to a range digest report request for chunks
+        @param body: the body of the response
+        @return the digests of the chunks, see getChunkHashes()
+        """
+        if status != responsecode.OK:
+            log.debug("clone %r does not support range digest reports, status: %d", self, status)
+            return None
+        try:
+            report = davxml.WebDAVDocument.fromString(body).root_element
+            digests = [binascii.unhexlify(str(rd.childOfType(elements.Digest)))
+                       for rd in report.childrenOfType(elements.RangeDigest)]
+        except Exception, e:
+            log.debug("invalid range digest report from clone %r", self, exc_info = e)
+            return None
+        if len(digests) != len(chunks):
+            return None
+        return digests
+
+class ProbeResult(object):
+    """
+    A python style struct holding the outcome of Clone.probe()
+    """
+    def __init__(self, clone, reachable = False, exists = False, properties = None):
+        # the probed clone, or the redirect target, if the clone redirected
+        self.clone = clone
+        # whether the host of the clone could be contacted
+        self.reachable = reachable
+        # whether the resource exists on that host
+        self.exists = exists
+        # a davxml.PropertyContainer with the cached properties, if requested and available
+        self.properties = properties
+
+    def __str__(self):
+        return "ProbeResult(%r, reachable: %r, exists: %r)" % (self.clone, self.reachable, self.exists)
+
 def formatHost(hostname = "localhost"):
     if not isNumericIPv6Address(hostname):
         return hostname
     else:
         return "[" + hostname + "]"
 
+def rangeDigestReportBody(chunks):
+    """
+    @param chunks: a list of (offset, length) tuples
+    @return the body of a REPORT request for the digests of the chunks
+    """
+    byteRanges = [elements.ByteRange("%d-%d" % (offset, offset + length - 1)) for (offset, length) in chunks]
+    return elements.RangeDigestReport(*byteRanges).toxml()
+
 def makeCloneBody(localResource):
     """
     Make a PROPPATCH body from the local clone for registration with a remote node.
@@ -0,0 +1,323 @@
+"""
+A process-wide pool of persistent (HTTP/1.1 keep-alive) connections to remote
+providers, keyed by (host, port).
+
+Inspecting a single resource involves a handful of requests to the same peer
+(HEAD, PROPFIND, GET, ...). Re-using the connection saves us a TCP handshake
+for all but the first of them.
+"""
+
+import os
+import select
+import socket
+import threading
+import time
+from httplib import HTTPConnection, HTTPResponse
+from logging import getLogger
+
+log = getLogger(__name__)
+
+# twisted.web2 drops idle persistent connections after 15 seconds
+# (see HTTPChannel.betweenRequestsTimeOut), so we give up on them a bit earlier
+IDLE_TIMEOUT = 10.0
+# the maximum number of idle connections we keep around for a single peer
+MAX_IDLE_PER_HOST = 4
+# the maximum number of idle connections we keep around in total
+MAX_IDLE = 64
+
+class PooledResponse(HTTPResponse):
+    """
+    An HTTPResponse that hands its connection back to the pool once the response
+    has been read completely (a response without a body, e.g. to a HEAD request, as soon
+    as it is received). If the response is closed before that, the connection is in an
+    undefined state and is discarded.
+    """
+    _pool = None
+    _connection = None
+    _readTimeout = None
+    _deadline = None
+
+    def setTimeOuts(self, readTimeout, deadline = None):
+        """
+        @param readTimeout: time out in seconds for every individual read on the socket
+        @param deadline: absolute time (as in time.time()) by which the response must have been read, or None
+        """
+        self._readTimeout = readTimeout
+        self._deadline = deadline
+
+    def read(self, amt = None):
+        if self._deadline is not None and not self.isclosed():
+            try:
+                timeout = remainingTime(self._readTimeout, self._deadline)
+            except socket.timeout:
+                self.close()
+                raise
+            self.fp._sock.settimeout(timeout)
+        return HTTPResponse.read(self, amt)
+
+    def attach(self, pool, connection):
+        """
+        Associate the response with the connection it was received on.
+        """
+        self._pool = pool
+        self._connection = connection
+        if self.isclosed() or (self.length == 0 and not self.chunked):
+            # there's nothing (left) to read
+            self.close()
+
+    def reusable(self):
+        """
+        @return whether the connection may be used for another request after this response.
+        """
+        # we don't bother with keeping track of chunked transfers, twisted.web2 sends
+        # a content-length header for everything we're interested in.
+        return (not self.will_close) and (not self.chunked) and self.length == 0
+
+    def _detach(self):
+        pool = self._pool
+        connection = self._connection
+        self._pool = None
+        self._connection = None
+        if pool is None:
+            return
+        if self.reusable():
+            pool.release(connection)
+        else:
+            pool.discard(connection)
+
+    def close(self):
+        HTTPResponse.close(self)
+        self._detach()
+
+
+class PooledConnection(HTTPConnection):
+    """
+    An HTTPConnection that produces PooledResponses.
+    
+    In contrast to HTTPConnection, the connect() time out is set on the socket directly 
+    (rather than via socket.setdefaulttimeout(), which would affect all threads).
+    """
+    response_class = PooledResponse
+    
+    # time out in seconds for establishing the connection, None for blocking
+    connectTimeout = None
+
+    def connect(self):
+        """
+        Connect to the host and port specified in __init__, trying all addresses the host name resolves to.
+        """
+        msg = "getaddrinfo returns an empty list"
+        for (family, socktype, proto, dummycanonname, address) in \
+                socket.getaddrinfo(self.host, self.port, 0, socket.SOCK_STREAM):
+            sock = None
+            try:
+                sock = socket.socket(family, socktype, proto)
+                sock.settimeout(self.connectTimeout)
+                sock.connect(address)
+            except socket.error, msg:
+                if sock is not None:
+                    sock.close()
+                continue
+            self.sock = sock
+            return
+        raise socket.error, msg
+
+
+def remainingTime(timeout, deadline):
+    """
+    @param timeout: time out in seconds for a single operation
+    @param deadline: absolute time (as in time.time()) by which the complete request must be done, or None
+    @return: the time out to be used for the next operation on the socket
+    """
+    if deadline is None:
+        return timeout
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise socket.timeout("request deadline exceeded")
+    if timeout is None:
+        return remaining
+    return min(timeout, remaining)
+
+
+def isAlive(connection):
+    """
+    Test if an idle connection can still be used.
+
+    An idle persistent connection should never be readable: if it is, the peer has either
+    closed its end of the connection (and we would read an EOF), or it sent garbage.
+
+    @param connection: a PooledConnection
+    @return: boolean
+    """
+    sock = connection.sock
+    if sock is None:
+        return False
+    try:
+        (readable, dummywritable, dummyerrors) = select.select([sock], [], [], 0)
+    except (select.error, socket.error, ValueError):
+        return False
+    return len(readable) == 0
+
+
+class ConnectionPool(object):
+    """
+    A pool of idle PooledConnections, keyed by (host, port).
+
+    Connections are handed out by acquire(). A connection is returned to the pool
+    by its PooledResponse, once that response has been read completely.
+    """
+
+    def __init__(self, maxIdlePerHost = MAX_IDLE_PER_HOST, maxIdle = MAX_IDLE, idleTimeout = IDLE_TIMEOUT):
+        self.maxIdlePerHost = maxIdlePerHost
+        self.maxIdle = maxIdle
+        self.idleTimeout = idleTimeout
+        self._lock = threading.Lock()
+        # map from (host, port) to a list of (time of release, connection) tuples, most recently used last
+        self._idle = {}
+        self._pid = os.getpid()
+        # statistics
+        self.created = 0
+        self.reused = 0
+
+    def _checkFork(self):
+        """
+        Connections inherited across a fork() share their socket with the parent process.
+        The child must forget about them without using them (closing our copy of the socket
+        does not affect the parent).
+        """
+        if self._pid == os.getpid():
+            return
+        for idle in self._idle.itervalues():
+            for (dummytime, connection) in idle:
+                connection.close()
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _evictIdle(self, now):
+        """
+        Close all connections that have been idle for too long. Must hold the lock.
+        """
+        for key in self._idle.keys():
+            idle = self._idle[key]
+            fresh = [(tt, cc) for (tt, cc) in idle if now - tt < self.idleTimeout]
+            for (tt, cc) in idle:
+                if now - tt >= self.idleTimeout:
+                    cc.close()
+            if len(fresh) > 0:
+                self._idle[key] = fresh
+            else:
+                del self._idle[key]
+
+    def _numIdle(self):
+        return sum([len(idle) for idle in self._idle.itervalues()])
+
+    def acquire(self, host, port):
+        """
+        Get hold of a connection to the given peer. The connection is re-used from
+        the pool, if possible. Otherwise, a new (unconnected) connection is created.
+
+        @return a tuple (connection, reused), where reused indicates whether the connection
+            has been used before
+        """
+        self._checkFork()
+        key = (host, port)
+        self._lock.acquire()
+        try:
+            self._evictIdle(time.time())
+            idle = self._idle.get(key, [])
+            while len(idle) > 0:
+                (dummytime, connection) = idle.pop()
+                if isAlive(connection):
+                    self.reused += 1
+                    return (connection, True)
+                log.debug("dropping half-closed connection to %s:%s", host, port)
+                connection.close()
+        finally:
+            self._lock.release()
+        return (self.create(host, port), False)
+
+    def create(self, host, port):
+        """
+        @return a new (unconnected) connection to the given peer, bypassing the idle connections
+        """
+        self._checkFork()
+        self._lock.acquire()
+        try:
+            self.created += 1
+        finally:
+            self._lock.release()
+        return PooledConnection(host, port)
+
+    def release(self, connection):
+        """
+        Return a connection to the pool.
+        """
+        self._checkFork()
+        if connection.sock is None:
+            return
+        key = (connection.host, connection.port)
+        self._lock.acquire()
+        try:
+            idle = self._idle.setdefault(key, [])
+            idle.append((time.time(), connection))
+            while len(idle) > self.maxIdlePerHost:
+                (dummytime, oldest) = idle.pop(0)
+                oldest.close()
+            if self._numIdle() > self.maxIdle:
+                self._evictOldest()
+        finally:
+            self._lock.release()
+
+    def _evictOldest(self):
+        """
+        Close the connection that has been idle for the longest time. Must hold the lock.
+        """
+        oldestKey = None
+        oldestTime = None
+        for (key, idle) in self._idle.iteritems():
+            if len(idle) > 0 and (oldestTime is None or idle[0][0] < oldestTime):
+                oldestKey = key
+                oldestTime = idle[0][0]
+        if oldestKey is None:
+            return
+        (dummytime, oldest) = self._idle[oldestKey].pop(0)
+        oldest.close()
+        if len(self._idle[oldestKey]) == 0:
+            del self._idle[oldestKey]
+
+    def discard(self, connection):
+        """
+        Close a connection that must not be re-used.
+        """
+        connection.close()
+
+    def clear(self):
+        """
+        Close all idle connections.
+        """
+        self._checkFork()
+        self._lock.acquire()
+        try:
+            for idle in self._idle.itervalues():
+                for (dummytime, connection) in idle:
+                    connection.close()
+            self._idle = {}
+        finally:
+            self._lock.release()
+
+    def __str__(self):
+        return "ConnectionPool(idle: %d, created: %d, reused: %d)" % (self._numIdle(), self.created, self.reused)
+
+
+pool = None # holder for the process-wide ConnectionPool
+def getPool():
+    """
+    Implements a singleton for getting the process-wide ConnectionPool.
+
+    @return: ConnectionPool instance
+    """
+    global pool
+    if pool is None:
+        pool = ConnectionPool()
+    return pool
@@ -18,6 +18,7 @@ class ContentManager(AbstractReadonlyContentManager):
     
     def contentLength(self):
         # we're only interested in the header, so issue a HEAD request only
-        rr = self.resource.performRequest(method = "HEAD")
+        rr = self.resource.remote.performRequest(method = "HEAD")
+        rr.read()
         return long(rr.getheader("content-length"))
         
\ No newline at end of file
@@ -17,4 +17,7 @@ class CloneNotFoundError(BaseCloneError):
 class CloneIOError(BaseCloneError):
     # socket et al
     pass
+class CloneContentError(BaseCloneError):
+    # content does not match the content signature
+    pass
 
@@ -1,13 +1,42 @@
 import socket
-from httplib import HTTPConnection
+import time
+from httplib import BadStatusLine, ImproperConnectionState
 from logging import getLogger
 
 from angel_app import version
+from angel_app.resource.remote.connectionPool import getPool
+from angel_app.resource.remote.connectionPool import remainingTime
 
 log = getLogger(__name__)
 
 USER_AGENT = 'Angel/%s' % version.getVersionString()
 
+class Timeouts(object):
+    """
+    A python style struct holding the time outs (in seconds) for a single request.
+    """
+    def __init__(self, connect = 10.0, read = 10.0, total = None):
+        # for establishing the connection
+        self.connect = connect
+        # for every individual send/receive on the socket
+        self.read = read
+        # for the complete request, including reading the response. None means no limit,
+        # which is what we want for (potentially huge) downloads.
+        self.total = total
+
+    def deadline(self):
+        """
+        @return the absolute time by which a request started now must be done, or None
+        """
+        if self.total is None:
+            return None
+        return time.time() + self.total
+
+    def __repr__(self):
+        return "Timeouts(%r, %r, %r)" % (self.connect, self.read, self.total)
+
+DEFAULT_TIMEOUTS = Timeouts()
+
 class HTTPRemote(object):
     """
     Lowest-level wrapper around HTTPConnection.
@@ -30,38 +59,12 @@ class HTTPRemote(object):
     
     def performRequestWithTimeOut(self, method = "HEAD", headers = {}, body = "", timeout = 3.0):
         """
-        Perform a request with a timeout. 
-        
-        TODO: It would be nice if we could set timeouts on a per-socket basis. For the time being, it
-        seems we have to operate with socket.setdefaulttimeout(), which is obviously a dangerous and
-        annoying hack (since it applies to all future sockets). We need to make sure that in the end, 
-        the default time out is set back to the original value (typically None). Since python2.4 does
-        not yet support the finally clause, we have to do that in two places (i.e. in the try statement,
-        if the request succeeds, in the catch statement otherwise).
+        Perform a request that must be completed (including reading the response) 
+        within timeout seconds.
         
         @see Clone.ping
         """
-        if 'User-Agent' not in headers: headers['User-Agent'] = USER_AGENT # add default user agent
-        conn = HTTPConnection(self.host, self.port)
-        oldTimeOut = socket.getdefaulttimeout()
-        socket.setdefaulttimeout(timeout)
-        try:
-            conn.connect()
-            conn.request(
-                 method, 
-                 self.path,
-                 headers = headers,
-                 body = body
-                 )
-            # revert back to blocking sockets -- 
-            socket.setdefaulttimeout(oldTimeOut)
-            return conn.getresponse()
-        except:
-            # revert back to blocking sockets
-            socket.setdefaulttimeout(oldTimeOut)
-            # then re-raise the exception
-            raise
-
+        return self.performRequestWithTimeOuts(method, headers, body, Timeouts(timeout, timeout, timeout))
 
     def performRequest(self, method = "GET", headers = {}, body = ""):
         """
@@ -88,7 +91,68 @@ class HTTPRemote(object):
         vinc: I still keep getting hangs in the maintainer -- and I think we will never be able to guarantee the absence 
         thereof, which is a major pain. I'll make performRequest use a (long) timeout.
         """
-        return self.performRequestWithTimeOut(method, headers, body, timeout = 10.0)
+        return self.performRequestWithTimeOuts(method, headers, body, DEFAULT_TIMEOUTS)
+
+    def performRequestWithTimeOuts(self, method, headers, body, timeouts):
+        """
+        Perform a request with separate connect, read and overall time outs.
+        
+        The time outs are set on the socket of the connection only, so (unlike the 
+        socket.setdefaulttimeout() hack we used to have here) this is safe to use from 
+        multiple threads.
+        
+        Connections are taken from (and returned to) the process-wide connection pool. If a re-used
+        connection turns out to have been dropped by the peer in the meantime, the request is retried
+        once on a fresh connection.
+        
+        @param timeouts: a Timeouts instance
+        """
+        headers = dict(headers)
+        if 'User-Agent' not in headers: headers['User-Agent'] = USER_AGENT # add default user agent
+        deadline = timeouts.deadline()
+        pool = getPool()
+        (conn, reused) = pool.acquire(self.host, self.port)
+        try:
+            response = self._requestOn(conn, method, headers, body, timeouts, deadline)
+        except socket.timeout:
+            pool.discard(conn)
+            raise
+        except (socket.error, BadStatusLine, ImproperConnectionState):
+            pool.discard(conn)
+            if not reused:
+                raise
+            # the peer closed the persistent connection while we were sending the request
+            log.debug("stale connection to %s:%s, retrying on a new connection", self.host, self.port)
+            conn = pool.create(self.host, self.port)
+            try:
+                response = self._requestOn(conn, method, headers, body, timeouts, deadline)
+            except:
+                pool.discard(conn)
+                raise
+        except:
+            pool.discard(conn)
+            raise
+        response.attach(pool, conn)
+        response.setTimeOuts(timeouts.read, deadline)
+        return response
+
+    def _requestOn(self, conn, method, headers, body, timeouts, deadline):
+        """
+        Send the request on the given connection and return the response. Unconnected
+        connections are connected first.
+        """
+        if conn.sock is None:
+            conn.connectTimeout = remainingTime(timeouts.connect, deadline)
+            conn.connect()
+        conn.sock.settimeout(remainingTime(timeouts.read, deadline))
+        conn.request(
+             method, 
+             self.path,
+             headers = headers,
+             body = body
+             )
+        conn.sock.settimeout(remainingTime(timeouts.read, deadline))
+        return conn.getresponse()
 
     def __str__(self):
         return "%s:%s%s" % (self.host, self.port, self.path)
@@ -96,16 +160,32 @@ class HTTPRemote(object):
     def __repr__(self):
         return "HTTPRemote('%s', '%s', '%s')" % (self.host, self.port, self.path)
 
-def rangeHeader(startoffset, endoffset, rangetype = 'bytes'):
+def rangeHeader(startoffset, endoffset = None, rangetype = 'bytes'):
     """
     Utility method to generate the http header syntax for querying a range of bytes from a resource
     @param startoffset: offset in bytes to start at
-    @param endoffset: offset in bytes to end at (including this byte!)
+    @param endoffset: offset in bytes to end at (including this byte!), None for the end of the resource
     @param rangetype: default 'bytes'
     """
+    if endoffset is None:
+        assert startoffset >= 0
+        return "%s=%d-" % (rangetype, startoffset)
     assert endoffset >= startoffset >= 0
     return "%s=%d-%d" % (rangetype, startoffset, endoffset)
 
+def contentRangeSize(contentRange):
+    """
+    @param contentRange: the value of a Content-Range header, e.g. "bytes 100-199/1000"
+    @return the total size of the resource (1000 in the example), or None if unknown
+    """
+    try:
+        size = contentRange.split("/")[1].strip()
+        if size == "*":
+            return None
+        return long(size)
+    except (AttributeError, IndexError, ValueError):
+        return None
+
 if __name__ == '__main__':
     # example to use byte range headers:
     r = HTTPRemote("localhost", 6221, "/MISSION%20ETERNITY/ARCANUM-CAPSULES/STOWAWAY/E20C7ABCB7D1DB66/5f537c32663df4edad16377d55feb86a6b9cef45-E20C7ABCB7D1DB66.txt")
@@ -0,0 +1,196 @@
+"""
+A process-wide cache of the properties of remote clones, shared by all Clone
+instances pointing to the same URI.
+
+Clones are created over and over again (from clone lists, by inheriting
+the clones of the parent, ...), so a cache that lives on the Clone instance
+only would make us request the same metadata many times during a single
+inspection. The cache is bounded in size (least recently used entries are
+dropped first) and in time (entries expire after a while, so that we notice
+changes on the remote side eventually).
+"""
+
+import os
+import threading
+import time
+from logging import getLogger
+
+from angel_app import elements
+
+log = getLogger(__name__)
+
+# the maximum number of clones for which we keep properties
+MAX_ENTRIES = 10000
+# the time (in seconds) after which we fetch the properties of a clone again
+TTL = 300.0
+# the fraction of the entries that is dropped when the cache is full
+EVICT_FRACTION = 0.1
+
+class PropertyCache(object):
+    """
+    A thread-safe LRU cache with time-to-live, mapping a key identifying a remote clone
+    to a dictionary of the clone's property elements by qname. Properties that are known
+    to be missing on the clone are cached with the value None.
+    """
+
+    def __init__(self, maxEntries = MAX_ENTRIES, ttl = TTL):
+        self.maxEntries = maxEntries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # map from key to [time of the oldest properties, time of last access, {qname: element}]
+        self._entries = {}
+        self._pid = os.getpid()
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _checkFork(self):
+        """
+        The cached properties are still valid in a forked child, but the lock might have
+        been held by another thread of the parent at the time of the fork.
+        """
+        if self._pid == os.getpid():
+            return
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _entry(self, key, now):
+        """
+        @return the entry for key, or None, if there is none or it has expired. Must hold the lock.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if now - entry[0] >= self.ttl:
+            del self._entries[key]
+            return None
+        return entry
+
+    def lookup(self, key, qnames):
+        """
+        @param key: the key of the clone
+        @param qnames: the qnames of the requested properties
+        @return a list of the requested property elements (None for those known to be missing), 
+            if all of them are cached, None otherwise
+        """
+        self._checkFork()
+        now = time.time()
+        self._lock.acquire()
+        try:
+            entry = self._entry(key, now)
+            if entry is not None:
+                properties = entry[2]
+                found = [properties[qname] for qname in qnames if properties.has_key(qname)]
+                if len(found) == len(qnames):
+                    entry[1] = now
+                    self.hits += 1
+                    return found
+            self.misses += 1
+            return None
+        finally:
+            self._lock.release()
+
+    def get(self, key):
+        """
+        @return a copy of the dictionary of (unexpired) property elements by qname for key,
+            including None values for the properties known to be missing
+        """
+        self._checkFork()
+        self._lock.acquire()
+        try:
+            entry = self._entry(key, time.time())
+            if entry is None:
+                return {}
+            return entry[2].copy()
+        finally:
+            self._lock.release()
+
+    def update(self, key, properties, missing = ()):
+        """
+        Add properties to the cache. If the revision of the clone has changed, all
+        properties cached for the old revision are dropped. Otherwise, the properties are
+        merged into the entry of the clone, which expires along with the properties cached
+        first (a partial update does not extend the life time of the other properties).
+
+        @param key: the key of the clone
+        @param properties: an iterable of property elements
+        @param missing: an iterable of the qnames of properties the clone doesn't have
+        """
+        self._checkFork()
+        now = time.time()
+        self._lock.acquire()
+        try:
+            entry = self._entry(key, now)
+            if entry is None:
+                entry = [now, now, {}]
+                self._entries[key] = entry
+                if len(self._entries) > self.maxEntries:
+                    self._evict()
+            revision = elements.Revision.qname()
+            newProperties = dict([(pp.qname(), pp) for pp in properties])
+            for qname in missing:
+                newProperties[qname] = None
+            if newProperties.has_key(revision) and entry[2].has_key(revision) and \
+                    entry[2][revision].toxml() != newProperties[revision].toxml():
+                log.debug("revision of %r changed, dropping cached properties", key)
+                entry[2].clear()
+                entry[0] = now
+            entry[2].update(newProperties)
+            entry[1] = now
+        finally:
+            self._lock.release()
+
+    def _evict(self):
+        """
+        Drop the least recently used entries. Must hold the lock.
+        """
+        numEvict = max(1, int(self.maxEntries * EVICT_FRACTION))
+        byAccess = [(entry[1], key) for (key, entry) in self._entries.iteritems()]
+        byAccess.sort()
+        for (dummytime, key) in byAccess[:numEvict]:
+            del self._entries[key]
+        self.evictions += numEvict
+
+    def invalidate(self, key):
+        """
+        Forget everything about the clone, e.g. after we modified it.
+        """
+        self._checkFork()
+        self._lock.acquire()
+        try:
+            if self._entries.has_key(key):
+                del self._entries[key]
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """
+        Forget everything.
+        """
+        self._checkFork()
+        self._lock.acquire()
+        try:
+            self._entries = {}
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        return "PropertyCache(entries: %d, hits: %d, misses: %d, evictions: %d)" % \
+            (len(self._entries), self.hits, self.misses, self.evictions)
+
+
+cache = None # holder for the process-wide PropertyCache
+def getPropertyCache():
+    """
+    Implements a singleton for getting the process-wide PropertyCache.
+
+    @return: PropertyCache instance
+    """
+    global cache
+    if cache is None:
+        cache = PropertyCache()
+    return cache
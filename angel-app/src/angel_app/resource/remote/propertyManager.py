@@ -7,6 +7,7 @@ from zope.interface import implements
 from angel_app import elements
 from angel_app.resource.IReadonlyPropertyManager import IReadonlyPropertyManager
 from angel_app.resource.remote import exceptions as cloneExceptions
+from angel_app.resource.remote.propertyCache import getPropertyCache
 
 class PropertyManager(object):
     """
@@ -14,11 +15,22 @@ class PropertyManager(object):
     """
     implements(IReadonlyPropertyManager)
    
-    cachedProperties = elements.signedKeys + [elements.MetaDataSignature, rfc2518.ResourceType, elements.Clones]  
+    cachedProperties = elements.signedKeys + elements.optionalSignedKeys + \
+                            [elements.MetaDataSignature, rfc2518.ResourceType, elements.Clones]  
   
     def __init__(self, remote):
-        self.propertyCache = {}
         self.remote = remote
+        # the properties are cached process-wide, i.e. shared with all other 
+        # PropertyManagers for the same remote resource
+        self.cacheKey = (remote.host, remote.port, remote.path)
+    
+    def _getPropertyCache(self):
+        """
+        @return a copy of the dictionary of the cached properties by qname
+        """
+        return getPropertyCache().get(self.cacheKey)
+    
+    propertyCache = property(_getPropertyCache)
     
     def getByElement(self, property):
         return self.getProperty(property)
@@ -47,11 +59,54 @@ class PropertyManager(object):
         okp =  okProperties(propertyDoc)
         
         # cache the properties for later re-use    
-        for pp in okp.children:
-            self.propertyCache[pp.qname()] = pp 
+        self.cacheProperties(okp)
             
         return okp
 
+    def childProperties(self):
+        """
+        Perform a single PROPFIND request with Depth: 1 for the cachedProperties of the
+        resource and all of its children, rather than one request per child.
+        
+        @return a dictionary mapping the href (i.e. the quoted absolute path) of each child 
+            to a davxml.PropertyContainer of the properties for which the request succeeded
+        """
+        return self.childPropertiesFrom(self._propertiesDocument(self.cachedProperties, "1"))
+
+    def childPropertiesFrom(self, propertyDoc):
+        """
+        @param propertyDoc: the response to a PROPFIND request with Depth: 1 for the cachedProperties
+        @return a dictionary as returned by childProperties()
+        """
+        ownPath = self.remote.path.rstrip("/")
+        childProperties = {}
+        for (href, propertiesByResponseCode) in propertiesByURL(propertyDoc).iteritems():
+            if href.rstrip("/") == ownPath:
+                # our own properties come for free, too
+                if propertiesByResponseCode.has_key(responsecode.OK):
+                    self.cacheProperties(propertiesByResponseCode[responsecode.OK])
+            elif propertiesByResponseCode.has_key(responsecode.OK):
+                childProperties[href] = propertiesByResponseCode[responsecode.OK]
+        return childProperties
+
+    def cacheProperties(self, propertyContainer):
+        """
+        Add all properties in the container to the cache, e.g. after they have been
+        obtained as a side effect of a different request. The container must be the
+        result of a request for (at least) the cachedProperties, i.e. optional properties
+        that are not in the container are cached as missing.
+        
+        @param propertyContainer: a davxml.PropertyContainer
+        """
+        found = [pp.qname() for pp in propertyContainer.children]
+        missing = [pp.qname() for pp in elements.optionalSignedKeys if pp.qname() not in found]
+        getPropertyCache().update(self.cacheKey, propertyContainer.children, missing)
+
+    def invalidateCache(self):
+        """
+        Forget the cached properties, e.g. after modifying them on the remote side.
+        """
+        getPropertyCache().invalidate(self.cacheKey)
 
     
     def getProperties(self, properties):
@@ -62,21 +117,16 @@ class PropertyManager(object):
         @see _getProperties
         """
         
-        # check if one of the requested properties is not in the cache
-        allCached = True
-        for pp in properties:
-            if pp.qname() not in self.propertyCache.keys():
-                allCached = False
-                break
+        cached = getPropertyCache().lookup(self.cacheKey, [pp.qname() for pp in properties])
             
-        if not allCached:
+        if cached is None:
             # since we need to make a request anyway, we 
             # might as well request frequently needed elements -- but avoid duplicates
             rp = self.cachedProperties + [pp for pp in properties if pp not in self.cachedProperties]
             returned = self._getProperties(rp)
         else:
-            props = [self.propertyCache[p.qname()] for p in properties]       
-            returned = davxml.PropertyContainer(*props)
+            # leave out the properties known to be missing
+            returned = davxml.PropertyContainer(*[pp for pp in cached if pp is not None])
             
         return returned
 
@@ -92,29 +142,25 @@ class PropertyManager(object):
             return resourceType.children[0].sname() == rfc2518.Collection.sname()
     
     
-    def _propertiesDocument(self, properties):
+    def _propertiesDocument(self, properties, depth = "0"):
         """
         Perform a PROPFIND request on the clone, returning the response body as an xml document.
         DO NOT use this directly. Use getProperties instead.
         
+        @param depth: the value of the Depth header, "0" for the clone only, "1" to include its children
         @rtype string
         @return the raw XML body of the multistatus response corresponding to the respective PROPFIND request.
         """
         try:
             resp = self.remote.performRequest(
                                   method = "PROPFIND", 
-                                  headers = {"Depth" : 0}, 
+                                  headers = {"Depth" : depth}, 
                                   body = makePropfindRequestBody(properties)
                                   )
         except socket.error, e:
             raise cloneExceptions.CloneIOError("Getting clone properties failed (socket problem): %r" % e)
 
-        if resp.status != responsecode.MULTI_STATUS:
-            if resp.status == responsecode.NOT_FOUND:
-                raise cloneExceptions.CloneNotFoundError("Clone with url %s not found, response code is: %r" % (self.remote, resp.status))
-            else:
-                raise cloneExceptions.CloneError("Clone with url %s didn't send a MULTI_STATUS response for PROPFIND, got: %r" % (self.remote, resp.status))
-
+        checkPropfindStatus(self.remote, resp.status)
         return davxml.WebDAVDocument.fromString(resp.read())
 
         
@@ -123,11 +169,20 @@ class PropertyManager(object):
         A single PROPFIND request can request multiple properties. Use this method to update the cache
         of all properties we will likely need.
         """
-        properties = okProperties(self._propertiesDocument(self.cachedProperties))
-        for property in properties:
-            self.propertyCache[property.qname()] = property   
+        self.cacheProperties(okProperties(self._propertiesDocument(self.cachedProperties)))
 
    
+def checkPropfindStatus(remote, status):
+    """
+    Raise a CloneNotFoundError or CloneError, unless the status of the response to a
+    PROPFIND request on remote is MULTI_STATUS.
+    """
+    if status != responsecode.MULTI_STATUS:
+        if status == responsecode.NOT_FOUND:
+            raise cloneExceptions.CloneNotFoundError("Clone with url %s not found, response code is: %r" % (remote, status))
+        else:
+            raise cloneExceptions.CloneError("Clone with url %s didn't send a MULTI_STATUS response for PROPFIND, got: %r" % (remote, status))
+
 def makePropfindRequestBody(properties):
     """
     @rtype string
@@ -143,7 +198,8 @@ def makePropfindRequestBody(properties):
 def okProperties(response):
     """
     In addition to the validation carried out by propertiesFromPropfindResponse,    
-    assert that the request succeeded for all requested properties. Raise a KeyError otherwise.
+    assert that the request succeeded for all requested properties, except for optional
+    properties that were not found. Raise a KeyError otherwise.
     
     @param the response body
     @return: a davxml.PropertyContainer of all properties for which the request succeeded.
@@ -153,6 +209,15 @@ def okProperties(response):
     
     propertiesByResponseCode = propertiesFromPropfindResponse(response)
     
+    if propertiesByResponseCode.has_key(responsecode.NOT_FOUND):
+        optional = [pp.qname() for pp in elements.optionalSignedKeys]
+        notFound = propertiesByResponseCode[responsecode.NOT_FOUND]
+        if not [pp for pp in notFound.children if pp.qname() not in optional]:
+            del propertiesByResponseCode[responsecode.NOT_FOUND]
+            if not propertiesByResponseCode.has_key(responsecode.OK):
+                # all requested properties were optional and missing
+                propertiesByResponseCode[responsecode.OK] = davxml.PropertyContainer()
+    
     if propertiesByResponseCode.keys() != [responsecode.OK]:
         notOKCodes = [kk for kk in propertiesByResponseCode.keys() if kk != responsecode.OK]
         notOKResponses = [propertiesByResponseCode[kk] for kk in notOKCodes]
@@ -166,24 +231,48 @@ def okProperties(response):
                       
 def propertiesFromPropfindResponse(response):
     """
-    Unwrap the actual property elements from a PROPFIND response.
+    Unwrap the actual property elements from a PROPFIND response for a single url
+    (i.e. a Depth: 0 request).
     
     @param response: a MULTISTATUS response element
     
-    @return a pair of lists of xml element objects. the first entry contains the properties for which the
-    request succeeded, the second pair contains those for which it failed.
+    @return a dictionary mapping response codes to davxml.PropertyContainer elements, e.g.
+    the properties for which the request succeeded are found under responsecode.OK.
     
-    @see twisted.web2.dav.method.propfind
+    @see propertiesByURL
     """
     
     responses = response.root_element.childrenOfType(davxml.PropertyStatusResponse)
-    assert 1 == len(responses), "We only do depth = 0 queries, so must receive responses for exactly 1 url."
-    response = responses[0]
+    assert 1 == len(responses), "Expected a response for exactly 1 url, use propertiesByURL for Depth: 1 requests."
+    # TODO: the url should in fact be the clone's self.path, we could check this, too
+    return _propertiesByResponseCode(responses[0])
+
 
-    # get the url
-    #url = response.childOfType(davxml.HRef).children[0]
-    # TODO: this should in fact be the clone's self.path, we could check this, too
+def propertiesByURL(response):
+    """
+    Unwrap the actual property elements from a PROPFIND response for any number of urls
+    (e.g. a Depth: 1 request for a collection and its children).
+    
+    @param response: a MULTISTATUS response element
+    
+    @return a dictionary mapping the href of each url to a dictionary as returned 
+    by propertiesFromPropfindResponse
+    
+    @see twisted.web2.dav.method.propfind
+    """
     
+    result = {}
+    for rr in response.root_element.childrenOfType(davxml.PropertyStatusResponse):
+        href = str(rr.childOfType(davxml.HRef).children[0])
+        result[href] = _propertiesByResponseCode(rr)
+    return result
+    
+
+def _propertiesByResponseCode(response):
+    """
+    @param response: a davxml.PropertyStatusResponse element
+    @return a dictionary mapping response codes to davxml.PropertyContainer elements
+    """
     propstats = response.childrenOfType(davxml.PropertyStatus)
     
     propertiesByResponseCode = {}
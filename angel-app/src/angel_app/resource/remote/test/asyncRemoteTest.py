@@ -0,0 +1,64 @@
+"""
+Tests for the asynchronous clone operations.
+"""
+
+from angel_app.resource.remote.clone import Clone
+from angel_app.resource.remote import asyncClone
+from angel_app.resource.remote import asyncRemote
+from angel_app.resource.remote.propertyCache import getPropertyCache
+from twisted.internet import defer
+from twisted.internet import reactor
+import time
+import unittest
+
+# a numeric address: name lookups need the reactor's thread pool, which only runs along with the reactor
+LOCALHOST = "127.0.0.1"
+
+def wait(deferred, timeout = 30):
+    """
+    Run the reactor until the deferred has fired.
+
+    @return the result of the deferred
+    """
+    results = []
+    deferred.addBoth(results.append)
+    deadline = time.time() + timeout
+    while not results:
+        assert time.time() < deadline, "time out waiting for %r" % deferred
+        reactor.iterate(0.01)
+    if isinstance(results[0], defer.failure.Failure):
+        results[0].raiseException()
+    return results[0]
+
+class AsyncRemoteTest(unittest.TestCase):
+
+    def setUp(self):
+        assert Clone().ping(), "locally running provider instance required"
+        getPropertyCache().clear()
+
+    def testProbe(self):
+        probe = wait(asyncClone.probe(Clone(LOCALHOST)))
+        assert probe.reachable
+        assert probe.exists
+
+    def testUnreachable(self):
+        probe = wait(asyncClone.probe(Clone(LOCALHOST, 1)))
+        assert not probe.reachable
+
+    def testFetchProperties(self):
+        cc = Clone(LOCALHOST)
+        assert wait(asyncClone.fetchProperties(cc)) is cc
+        # the blocking accessors find the properties in the cache
+        assert cc.resourceID() == Clone(LOCALHOST).resourceID()
+        assert wait(asyncClone.cloneList(cc)) == cc.cloneList()
+
+    def testConcurrentRequests(self):
+        """
+        Concurrent requests to a peer share at most MAX_CONNECTIONS_PER_HOST connections.
+        """
+        pool = asyncRemote.getAsyncPool()
+        (connects, reuses) = (pool.connects, pool.reuses)
+        probes = wait(defer.gatherResults([asyncClone.probe(Clone(LOCALHOST)) for dummy in range(10)]))
+        assert len([probe for probe in probes if probe.exists]) == 10
+        assert pool.connects - connects <= asyncRemote.MAX_CONNECTIONS_PER_HOST
+        assert pool.reuses - reuses >= 10 - asyncRemote.MAX_CONNECTIONS_PER_HOST
@@ -38,6 +38,7 @@ from angel_app.resource.IResource import IAngelResource
 from angel_app.resource.local import basic
 from angel_app.resource.remote import clone
 from angel_app.resource.remote.clone import Clone
+from angel_app.resource.remote.propertyCache import getPropertyCache
 from angel_app.resource.test import resourceTest
 import os
 import unittest
@@ -67,6 +68,26 @@ class CloneTest(resourceTest.ResourceTest):
         
         assert oldTimeOut == socket.getdefaulttimeout()
         
+    def testProbe(self):
+        """
+        A single probe must tell reachability and existence, and fill the property cache.
+        """
+        cc = Clone("localhost")
+        probe = cc.probe()
+        assert probe.reachable
+        assert probe.exists
+        assert probe.clone == cc
+        for ee in cc.getPropertyManager().cachedProperties:
+            assert ee.qname() in cc.getPropertyManager().propertyCache.keys()
+        
+        probe = Clone("localhost", path = "/this/does/not/exist").probe()
+        assert probe.reachable
+        assert not probe.exists
+        
+        probe = Clone("80.219.195.84", 6221).probe()
+        assert not probe.reachable
+        assert not probe.exists
+        
     def testIsCollection(self):
         
         assert self.testResource.isCollection() == True
@@ -79,6 +100,7 @@ class CloneTest(resourceTest.ResourceTest):
         """
         Assert proper cache management.
         """
+        getPropertyCache().clear()
         assert self.testResource.getPropertyManager().propertyCache == {}, "At the beginning, the cache must be empty."
         self.testResource.resourceID()
         contained = elements.ResourceID.qname() in self.testResource.getPropertyManager().propertyCache
@@ -87,6 +109,11 @@ class CloneTest(resourceTest.ResourceTest):
         for ee in self.testResource.getPropertyManager().cachedProperties:
             contained = ee.qname() in self.testResource.getPropertyManager().propertyCache.keys()
             assert contained, "Property %s must now be in the cache." % `ee`
+        
+        other = clone.Clone("localhost")
+        hits = getPropertyCache().hits
+        other.resourceID()
+        assert getPropertyCache().hits == hits + 1, "The cache must be shared by all clones with the same URI."
   
         
     def testInspectResource(self):
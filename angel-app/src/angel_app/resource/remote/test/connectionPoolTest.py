@@ -0,0 +1,109 @@
+"""
+Tests for the persistent connection pool.
+"""
+
+from angel_app.config import config
+from angel_app.resource.remote.clone import Clone
+from angel_app.resource.remote.connectionPool import ConnectionPool
+from angel_app.resource.remote import connectionPool
+from angel_app.resource.remote.httpRemote import HTTPRemote
+import socket
+import time
+import unittest
+
+AngelConfig = config.getConfig()
+providerport = AngelConfig.getint("provider","listenPort")
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        assert Clone().ping(), "locally running provider instance required"
+        connectionPool.getPool().clear()
+
+    def testReuse(self):
+        """
+        Subsequent requests to the same peer must share a single connection.
+        """
+        pool = connectionPool.getPool()
+        reused = pool.reused
+        cc = Clone("localhost")
+        assert cc.ping()
+        assert cc.ping()
+        cc.revision()
+        assert pool.reused >= reused + 2
+
+    def testBodilessResponse(self):
+        """
+        The connection of a response without a body must be returned to the pool, even if
+        the response is never read.
+        """
+        pool = connectionPool.getPool()
+        response = HTTPRemote("localhost", providerport, "/").performRequestWithTimeOut("HEAD")
+        assert response.status == 200
+        assert pool._numIdle() == 1
+        assert response.read() == ""
+
+    def testStaleConnection(self):
+        """
+        A re-used connection dropped by the peer is replaced by a new one, which is counted.
+        """
+        pool = connectionPool.getPool()
+        remote = HTTPRemote("localhost", providerport, "/")
+        remote.performRequestWithTimeOut().read()
+        created = pool.created
+        requestOn = remote._requestOn
+        calls = []
+        def dropped(conn, *args):
+            calls.append(conn)
+            if len(calls) == 1:
+                raise socket.error("connection reset by peer")
+            return requestOn(conn, *args)
+        remote._requestOn = dropped
+        assert remote.performRequestWithTimeOut().status == 200
+        assert len(calls) == 2
+        assert pool.created == created + 1
+
+    def testIdleEviction(self):
+        """
+        Connections that have been idle for too long must not be handed out again.
+        """
+        pool = ConnectionPool(idleTimeout = 0)
+        (conn, reused) = pool.acquire("localhost", providerport)
+        assert not reused
+        conn.connect()
+        pool.release(conn)
+        (conn2, reused) = pool.acquire("localhost", providerport)
+        assert not reused
+        assert conn2 is not conn
+        assert conn.sock is None
+
+    def testPerHostCap(self):
+        """
+        No more than maxIdlePerHost connections are kept per peer.
+        """
+        pool = ConnectionPool(maxIdlePerHost = 1)
+        (conn, dummyreused) = pool.acquire("localhost", providerport)
+        (conn2, dummyreused) = pool.acquire("localhost", providerport)
+        conn.connect()
+        conn2.connect()
+        pool.release(conn)
+        pool.release(conn2)
+        assert conn.sock is None
+        assert conn2.sock is not None
+        pool.clear()
+
+    def testDeadline(self):
+        """
+        The overall deadline must bound the time out of individual socket operations.
+        """
+        assert connectionPool.remainingTime(10.0, None) == 10.0
+        assert connectionPool.remainingTime(10.0, time.time() + 1.0) <= 1.0
+        self.assertRaises(socket.timeout, connectionPool.remainingTime, 10.0, time.time() - 1.0)
+
+    def testDefaultTimeOutUntouched(self):
+        """
+        Requests must not change the process-wide default socket time out.
+        """
+        oldTimeOut = socket.getdefaulttimeout()
+        HTTPRemote("localhost", providerport, "/").performRequestWithTimeOut().read()
+        assert oldTimeOut == socket.getdefaulttimeout()
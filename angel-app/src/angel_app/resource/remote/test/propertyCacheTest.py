@@ -0,0 +1,97 @@
+"""
+Tests for the process-wide remote property cache.
+"""
+
+from angel_app import elements
+from angel_app.resource.remote import propertyCache
+from angel_app.resource.remote.propertyCache import PropertyCache
+import time
+import unittest
+
+class PropertyCacheTest(unittest.TestCase):
+
+    def testLookup(self):
+        """
+        A lookup must only succeed if all requested properties are cached.
+        """
+        cache = PropertyCache()
+        revision = elements.Revision.fromString("1")
+        resourceID = elements.ResourceID.fromString("foo")
+        cache.update("a", [revision])
+        assert cache.lookup("a", [elements.Revision.qname()]) == [revision]
+        assert cache.lookup("a", [elements.Revision.qname(), elements.ResourceID.qname()]) is None
+        assert cache.lookup("b", [elements.Revision.qname()]) is None
+        assert cache.hits == 1
+        assert cache.misses == 2
+        cache.update("a", [resourceID])
+        assert cache.lookup("a", [elements.Revision.qname(), elements.ResourceID.qname()]) == [revision, resourceID]
+
+    def testMissing(self):
+        """
+        Properties known to be missing must be cached as None.
+        """
+        cache = PropertyCache()
+        revision = elements.Revision.fromString("1")
+        cache.update("a", [revision], [elements.BlockHashes.qname()])
+        assert cache.lookup("a", [elements.Revision.qname(), elements.BlockHashes.qname()]) == [revision, None]
+
+    def testRevisionChange(self):
+        """
+        When the revision of a clone changes, the properties of the old revision must be dropped.
+        """
+        cache = PropertyCache()
+        cache.update("a", [elements.Revision.fromString("1"), elements.ResourceID.fromString("foo")])
+        cache.update("a", [elements.Revision.fromString("1")])
+        assert cache.lookup("a", [elements.ResourceID.qname()]) is not None
+        cache.update("a", [elements.Revision.fromString("2")])
+        assert cache.lookup("a", [elements.ResourceID.qname()]) is None
+        assert str(cache.get("a")[elements.Revision.qname()]) == "2"
+
+    def testTTL(self):
+        """
+        Entries must expire.
+        """
+        cache = PropertyCache(ttl = 0.1)
+        cache.update("a", [elements.Revision.fromString("1")])
+        assert cache.lookup("a", [elements.Revision.qname()]) is not None
+        time.sleep(0.2)
+        assert cache.lookup("a", [elements.Revision.qname()]) is None
+        assert len(cache) == 0
+
+    def testPartialUpdate(self):
+        """
+        Merging properties into an entry must not extend the life time of those cached before.
+        """
+        cache = PropertyCache(ttl = 0.2)
+        cache.update("a", [elements.Revision.fromString("1")])
+        time.sleep(0.15)
+        cache.update("a", [elements.ResourceID.fromString("foo")])
+        assert cache.lookup("a", [elements.Revision.qname()]) is not None
+        time.sleep(0.1)
+        assert cache.lookup("a", [elements.Revision.qname()]) is None
+
+    def testEviction(self):
+        """
+        The least recently used entries must be dropped when the cache is full.
+        """
+        cache = PropertyCache(maxEntries = 2)
+        cache.update("a", [elements.Revision.fromString("1")])
+        time.sleep(0.01)
+        cache.update("b", [elements.Revision.fromString("1")])
+        time.sleep(0.01)
+        cache.lookup("a", [elements.Revision.qname()])
+        cache.update("c", [elements.Revision.fromString("1")])
+        assert len(cache) == 2
+        assert cache.evictions == 1
+        assert cache.get("b") == {}
+        assert cache.get("a") != {}
+        assert cache.get("c") != {}
+
+    def testInvalidate(self):
+        cache = PropertyCache()
+        cache.update("a", [elements.Revision.fromString("1")])
+        cache.invalidate("a")
+        assert cache.get("a") == {}
+
+    def testSingleton(self):
+        assert propertyCache.getPropertyCache() is propertyCache.getPropertyCache()
@@ -1,15 +1,16 @@
 import os
 import stat
+from httplib import HTTPResponse
 from logging import getLogger
 
 from angel_app import elements
-from angel_app.contrib.ezPyCrypto import key as ezKey
 from angel_app.resource import IResource
 from angel_app.resource import util
 from zope.interface import implements
 from angel_app.io import RateLimit
 from angel_app.io import bufferedReadLoop
 from angel_app.resource.remote import exceptions as cloneExceptions
+from angel_app.resource.signatureCache import getSignatureCache
 
 from angel_app.config.config import getConfig
 
@@ -34,6 +35,9 @@ class Resource(object):
     
     implements(IResource.IAngelResource)
     
+    # no instance dictionary required, see ResourceHandle
+    __slots__ = ()
+    
     def getPropertyManager(self):
         """
         @see: IReadOnlyPropertyManager
@@ -68,6 +72,15 @@ class Resource(object):
             # don't log complete exception, just notify IO problem
             log.debug("Failed to look up meta data field %r: %r" % (repr(element), repr(e)))
             return None
+
+    def optionalProperty(self, element):
+        """
+        Return a resource property by element, or None if the resource doesn't have it.
+        """
+        try:
+            return self.getProperty(element)
+        except KeyError:
+            return None
  
     def revision(self):
         """
@@ -94,6 +107,17 @@ class Resource(object):
         """
         return str(self.getProperty(elements.ContentSignature))
     
+    def blockHashes(self):
+        """
+        @return a tuple of the block size and the list of hex digests of the blocks of 
+            the resource content, or None, if the resource has no block hash manifest 
+            (collections, or resources signed by older versions)
+        """
+        blockHashes = self.optionalProperty(elements.BlockHashes)
+        if blockHashes is None:
+            return None
+        return util.blockHashesFromElement(blockHashes)
+    
     def metaDataSignature(self):
         """
         @return the signature of the signed metadata
@@ -118,8 +142,7 @@ class Resource(object):
 
     def _metaDataIsCorrect(self):
 
-        publicKey = ezKey()
-        publicKey.importKey(self.publicKeyString())
+        publicKeyString = self.publicKeyString()
         
         sm = self.signableMetadata()
         ms = self.metaDataSignature()
@@ -127,7 +150,8 @@ class Resource(object):
         #log.debug(ms)
         #log.debug(sm)
         try:
-            isCorrect = publicKey.verifyString(sm, ms)
+            # the same metadata is verified again and again (e.g. for every clone), see signatureCache
+            isCorrect = getSignatureCache().verify(publicKeyString, sm, ms)
             if not isCorrect:
                 log.info("Incorrect meta data for: %r", self.resourceID())
                 log.info("Meta data to be signed: %r", self.signableMetadata())
@@ -142,19 +166,32 @@ class Resource(object):
     def validate(self):
         return (self._dataIsCorrect() and self._metaDataIsCorrect())
 
-    def _computeContentHexDigest(self):
+    def validateMetaData(self):
+        """
+        Verify the metadata signature only, without reading the contents. Note that this
+        includes the content signature, which can then be checked against the contents
+        as they are read anyway, e.g. during a download.
+        
+        @return boolean
+        """
+        return self._metaDataIsCorrect()
+
+    def _computeContentHexDigest(self, blockHasher = None):
         """
+        @param blockHasher: if given, a util.BlockHasher that is fed with the content as well
         @return hexdigest for content of self
         """
         hashObj = util.getHashObject()
         callbacks = [ hashObj.update ]
+        if blockHasher is not None:
+            callbacks.append(blockHasher)
         f = self.open()
         BUFSIZE = LOCAL_BUFSIZE # files and StringIO
         # This is sort of hacky thanx to duck typing.
         # What we want to achieve here is rate limiting for network based activity.
         if f.__class__.__name__ == 'StringIO':
             size = len(f.getvalue()) # this is ok because we should only hit StringIO for directories which are only 9 bytes
-        elif f.__class__.__name__ == 'HTTPResponse':
+        elif isinstance(f, HTTPResponse):
             size = long(f.getheader('Content-Length'))
             callbacks.append(RateLimit(size, MAX_DOWNLOAD_SPEED))
             BUFSIZE = HTTP_BUFSIZE
@@ -216,11 +253,13 @@ class Resource(object):
         """
         @return a UUID of the first 32 bytes of the SHA checksum of the resource's public key string.
         """
-        return util.uuidFromPublicKeyString(self.publicKeyString())
+        return getSignatureCache().keyUUID(self.publicKeyString())
 
     def signableMetadata(self):
         """
         Returns a string representation of the metadata that needs to
         be signed.
         """
-        return "".join([self.getProperty(key).toxml() for key in elements.signedKeys])
+        signed = [self.getProperty(key) for key in elements.signedKeys]
+        optional = [self.optionalProperty(key) for key in elements.optionalSignedKeys]
+        return "".join([pp.toxml() for pp in signed + [pp for pp in optional if pp is not None]])
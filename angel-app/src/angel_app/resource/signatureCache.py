@@ -0,0 +1,195 @@
+"""
+A process-wide cache of imported public keys, of key UUIDs and of the outcome of signature
+verifications.
+
+Importing a public key (parsing the key string) and verifying an RSA signature are
+expensive, and the maintainer verifies the same metadata over and over again: that of
+every clone of a resource (which is usually identical to ours), and that of the local
+resource, several times per inspection. Since the outcome of a verification only depends
+on the public key, the signed data and the signature, it is cached by a digest of the
+three. Key UUIDs (see util.uuidFromPublicKeyString) are cached separately, since they are
+looked up far more often and must not require importing the key. All caches are bounded in
+size (least recently used entries are dropped first).
+"""
+
+import os
+import threading
+import time
+from logging import getLogger
+
+from angel_app.contrib.ezPyCrypto import key as ezKey
+from angel_app.resource import util
+
+log = getLogger(__name__)
+
+# the maximum number of public keys we keep imported
+MAX_KEYS = 1000
+# the maximum number of key UUIDs we keep
+MAX_UUIDS = 10000
+# the maximum number of verification outcomes we keep
+MAX_VERIFICATIONS = 100000
+# the fraction of the entries that is dropped when a cache is full
+EVICT_FRACTION = 0.1
+
+class _LRUDict(object):
+    """
+    A bounded mapping, dropping the least recently used entries when it is full.
+    Not thread-safe, see SignatureCache.
+    """
+    def __init__(self, maxEntries):
+        self.maxEntries = maxEntries
+        # map from key to [time of last access, value]
+        self._entries = {}
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        @return a tuple (found, value)
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return (False, None)
+        entry[0] = time.time()
+        return (True, entry[1])
+
+    def put(self, key, value):
+        self._entries[key] = [time.time(), value]
+        if len(self._entries) > self.maxEntries:
+            numEvict = max(1, int(self.maxEntries * EVICT_FRACTION))
+            byAccess = [(entry[0], key) for (key, entry) in self._entries.iteritems()]
+            byAccess.sort()
+            for (dummytime, key) in byAccess[:numEvict]:
+                del self._entries[key]
+            self.evictions += numEvict
+
+    def __len__(self):
+        return len(self._entries)
+
+def _tripleDigest(publicKeyString, data, signature):
+    """
+    @return a digest identifying the combination of public key, signed data and signature
+    """
+    digest = util.getHashObject()
+    for part in (publicKeyString, data, signature):
+        # length prefixed, so that the parts can't be shifted against each other
+        digest.update("%d:" % len(part))
+        digest.update(part)
+    return digest.digest()
+
+class SignatureCache(object):
+    """
+    A thread-safe cache of imported public keys, of key UUIDs, and of the outcome of
+    signature verifications.
+    """
+
+    def __init__(self, maxKeys = MAX_KEYS, maxVerifications = MAX_VERIFICATIONS, maxUUIDs = MAX_UUIDS):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        # map from the public key string to the imported key
+        self._keys = _LRUDict(maxKeys)
+        # map from the public key string to its key UUID
+        self._uuids = _LRUDict(maxUUIDs)
+        # map from the digest of (public key, data, signature) to the outcome of the verification
+        self._verifications = _LRUDict(maxVerifications)
+        # statistics
+        self.hits = 0
+        self.misses = 0
+
+    def _checkFork(self):
+        """
+        The cached keys and verifications are still valid in a forked child, but the lock might
+        have been held by another thread of the parent at the time of the fork.
+        """
+        if self._pid == os.getpid():
+            return
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def publicKey(self, publicKeyString):
+        """
+        @return the imported public key (an ezPyCrypto key), which must not be modified
+        """
+        self._checkFork()
+        self._lock.acquire()
+        try:
+            (found, publicKey) = self._keys.get(publicKeyString)
+        finally:
+            self._lock.release()
+        if found:
+            return publicKey
+        # import outside of the lock, another thread may do the same meanwhile
+        publicKey = ezKey()
+        publicKey.importKey(publicKeyString)
+        self._lock.acquire()
+        try:
+            self._keys.put(publicKeyString, publicKey)
+        finally:
+            self._lock.release()
+        return publicKey
+
+    def keyUUID(self, publicKeyString):
+        """
+        @see util.uuidFromPublicKeyString. The key is not imported, so this works for
+            malformed key strings, too.
+        """
+        self._checkFork()
+        self._lock.acquire()
+        try:
+            (found, keyUUID) = self._uuids.get(publicKeyString)
+            if not found:
+                keyUUID = util.uuidFromPublicKeyString(publicKeyString)
+                self._uuids.put(publicKeyString, keyUUID)
+            return keyUUID
+        finally:
+            self._lock.release()
+
+    def verify(self, publicKeyString, data, signature):
+        """
+        @return whether signature is a valid signature of data, with the given public key
+        @raise any exception raised by ezPyCrypto for malformed keys or signatures (such
+            outcomes are not cached)
+        """
+        self._checkFork()
+        digest = _tripleDigest(publicKeyString, data, signature)
+        self._lock.acquire()
+        try:
+            (found, isCorrect) = self._verifications.get(digest)
+            if found:
+                self.hits += 1
+                return isCorrect
+            self.misses += 1
+        finally:
+            self._lock.release()
+        isCorrect = bool(self.publicKey(publicKeyString).verifyString(data, signature))
+        self._lock.acquire()
+        try:
+            self._verifications.put(digest, isCorrect)
+        finally:
+            self._lock.release()
+        return isCorrect
+
+    def hitRate(self):
+        """
+        @return the fraction of the verifications that were answered from the cache
+        """
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return float(self.hits) / lookups
+
+    def __str__(self):
+        return "SignatureCache(keys: %d, UUIDs: %d, verifications: %d, hits: %d, misses: %d, hit rate: %.2f)" % \
+            (len(self._keys), len(self._uuids), len(self._verifications), self.hits, self.misses, self.hitRate())
+
+
+cache = None # holder for the process-wide SignatureCache
+def getSignatureCache():
+    """
+    Implements a singleton for getting the process-wide SignatureCache.
+
+    @return: SignatureCache instance
+    """
+    global cache
+    if cache is None:
+        cache = SignatureCache()
+    return cache
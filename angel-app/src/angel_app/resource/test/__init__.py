@@ -1,4 +1,5 @@
 
 all = [
-       "resourceTest"
+       "resourceTest",
+       "signatureCacheTest"
        ]
\ No newline at end of file
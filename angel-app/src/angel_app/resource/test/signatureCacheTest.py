@@ -0,0 +1,40 @@
+"""
+Tests for the signature cache.
+"""
+
+from angel_app.admin.secretKey import getDefaultKey
+from angel_app.resource import util
+from angel_app.resource.signatureCache import SignatureCache
+import unittest
+
+class SignatureCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.key = getDefaultKey()
+        self.publicKeyString = self.key.exportKey()
+        self.data = "lorem ipsum"
+        self.signature = self.key.signString(self.data)
+
+    def testVerify(self):
+        cache = SignatureCache()
+        assert cache.verify(self.publicKeyString, self.data, self.signature)
+        assert cache.verify(self.publicKeyString, self.data, self.signature)
+        assert not cache.verify(self.publicKeyString, self.data + ".", self.signature)
+        assert (cache.hits, cache.misses) == (1, 2)
+        # the key was imported only once
+        assert len(cache._keys) == 1
+
+    def testKeyUUID(self):
+        cache = SignatureCache()
+        assert cache.keyUUID(self.publicKeyString) == util.uuidFromPublicKeyString(self.publicKeyString)
+        # the UUID doesn't require importing the key
+        assert len(cache._keys) == 0
+        assert cache.keyUUID("malformed") == util.uuidFromPublicKeyString("malformed")
+        assert cache.publicKey(self.publicKeyString) is cache.publicKey(self.publicKeyString)
+
+    def testBounded(self):
+        cache = SignatureCache(maxVerifications = 10)
+        for ii in range(20):
+            assert not cache.verify(self.publicKeyString, self.data + str(ii), self.signature)
+        assert len(cache._verifications) <= 10
+        assert cache._verifications.evictions > 0
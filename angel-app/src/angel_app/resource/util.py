@@ -26,6 +26,7 @@ legalMatters = """
 
 author = """Vincent Kraeutler, 2006"""
 
+from angel_app import elements
 from angel_app.config import config
 from angel_app.contrib import uuid
 from os import sep
@@ -37,6 +38,9 @@ from urlparse import urlsplit
 AngelConfig = config.getConfig()
 repository = AngelConfig.get("common","repository")
 
+# the size of the blocks of the block hash manifest of a file
+BLOCK_SIZE = 1024 * 1024
+
 def urlPathFromPath(path):
     """
     URL-quote a file system path
@@ -88,4 +92,54 @@ def getHashObject(data = None):
 
 
 def uuidFromPublicKeyString(publicKey):    
-    return uuid.UUID( getHashObject(publicKey).hexdigest()[:32] )
\ No newline at end of file
+    return uuid.UUID( getHashObject(publicKey).hexdigest()[:32] )
+
+
+class BlockHasher(object):
+    """
+    Computes the hex digests of the consecutive blocks of a stream. To be used as 
+    a callback, i.e. it is called with the consecutive buffers read from the stream.
+    """
+    def __init__(self, blockSize = BLOCK_SIZE):
+        self.blockSize = blockSize
+        self.digests = []
+        self._hashObj = getHashObject()
+        self._remaining = blockSize
+
+    def __call__(self, buf):
+        while len(buf) > 0:
+            head = buf[:self._remaining]
+            buf = buf[self._remaining:]
+            self._hashObj.update(head)
+            self._remaining -= len(head)
+            if self._remaining == 0:
+                self.digests.append(self._hashObj.hexdigest())
+                self._hashObj = getHashObject()
+                self._remaining = self.blockSize
+
+    def hexdigests(self):
+        """
+        @return the list of hex digests of all blocks, including the last (incomplete) one
+        """
+        if self._remaining < self.blockSize:
+            return self.digests + [self._hashObj.hexdigest()]
+        return list(self.digests)
+
+def blockHashesToElement(blockSize, digests):
+    """
+    @param blockSize: the size of the blocks
+    @param digests: the list of hex digests of the blocks
+    @return an elements.BlockHashes element
+    """
+    return elements.BlockHashes(
+                elements.BlockSize(str(blockSize)),
+                *[elements.Digest(digest) for digest in digests])
+
+def blockHashesFromElement(blockHashes):
+    """
+    @param blockHashes: an elements.BlockHashes element
+    @return a tuple of the block size and the list of hex digests of the blocks
+    """
+    blockSize = int(str(blockHashes.childOfType(elements.BlockSize)))
+    digests = [str(digest) for digest in blockHashes.childrenOfType(elements.Digest)]
+    return (blockSize, digests)
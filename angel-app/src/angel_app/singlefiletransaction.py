@@ -44,12 +44,19 @@ import re
 import shutil
 import os
 import tempfile
+import time
 
 from angel_app.config.config import getConfig
 angelConfig = getConfig()
 
 bootstrap = True
 
+# the sub-directory of the tmp path where partially written files are kept 
+# across restarts (see ResumableFileTransaction)
+PARTIAL_DIR = "partial"
+# partially written files older than this (in seconds) are removed at bootstrap
+PARTIAL_MAX_AGE = 7 * 24 * 3600
+
 def setup():
     """
     setup() creates the needed internal directory structure for safe
@@ -76,12 +83,33 @@ def getTmpPath():
 
 def purgeTmpPathAndSetup():
     """
-    This function will empty the configured tmp path. It must only be called
+    This function will empty the configured tmp path, except for recent partially
+    written files that can still be resumed. It must only be called
     during bootstrap and while no other process is using the tmp path!
     """
-    shutil.rmtree(getTmpPath(), ignore_errors = False) # FIXME: catch errors
+    tmpPath = getTmpPath()
+    if os.path.isdir(tmpPath):
+        for name in os.listdir(tmpPath):
+            path = os.path.join(tmpPath, name)
+            if name == PARTIAL_DIR and os.path.isdir(path):
+                purgePartials(path)
+            elif os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path, ignore_errors = False) # FIXME: catch errors
+            else:
+                os.remove(path)
     setup()
 
+def purgePartials(partialPath):
+    """
+    Remove the partially written files in partialPath that have not been touched
+    for PARTIAL_MAX_AGE seconds.
+    """
+    now = time.time()
+    for name in os.listdir(partialPath):
+        path = os.path.join(partialPath, name)
+        if now - os.path.getmtime(path) > PARTIAL_MAX_AGE:
+            os.remove(path)
+
 class SingleFileTransaction(object):
     """
     This class provides an interface to safely work with files.
@@ -199,6 +227,89 @@ class SingleFileTransaction(object):
     def __del__(self):
         self.cleanup()
 
+class ResumableFileTransaction(SingleFileTransaction):
+    """
+    A SingleFileTransaction for (over-)writing a file, where the temporary file 
+    has a well-known name and is not removed by cleanup(). A transaction that 
+    fails (or a process that dies) before the commit can therefore be resumed 
+    by a later transaction with the same key.
+    The temporary file is only ever appended to.
+    Parameters:
+    key - the name of the temporary file, must identify the final contents of the file
+    tmpPath - full pathname to the temp directory to operate in (optional)
+    """
+
+    def __init__(self, key, tmpPath = None):
+        """
+        The constructor
+        
+        @param key: string name of the temporary file
+        @param tmpPath: string path to temporary directory (optional)
+        """
+        SingleFileTransaction.__init__(self, tmpPath)
+        partialdir = os.path.join(self._basedir, PARTIAL_DIR)
+        if not os.path.isdir(partialdir):
+            os.mkdir(partialdir)
+        assert os.sep not in key, "invalid key '%s'" % key
+        self.safename = os.path.join(partialdir, key)
+
+    def open(self, name, append = True):
+        """
+        Open the temporary file for appending (or, if append is False, for writing
+        at arbitrary positions). Before calling commit(), the file with the given 
+        name is left untouched.
+        
+        @return a python file object
+        """
+        self.name = name
+        if append:
+            self.mode = 'ab'
+        else:
+            open(self.safename, 'ab').close() # make sure it exists
+            self.mode = 'r+b'
+        self.safe = open(self.safename, self.mode)
+        return self.safe
+
+    def size(self):
+        """
+        @return the number of bytes written to the temporary file so far (e.g. by
+        a previous transaction)
+        """
+        if self.safe is not None and not self.safe.closed:
+            self.safe.flush()
+        if not os.path.exists(self.safename):
+            return 0
+        return os.path.getsize(self.safename)
+
+    def truncate(self, size = 0):
+        """
+        Discard the data written so far (beyond size bytes), but keep the transaction open.
+        """
+        self.safe.seek(size)
+        self.safe.truncate()
+
+    def cleanup(self):
+        """
+        Close the temporary file, but keep it around for resuming.
+        """
+        if not self.safe is None:
+            try:
+                if not self.safe.closed:
+                    self.safe.close()
+            except: # don't fail
+                pass
+            self.safe = None
+
+    def discard(self):
+        """
+        Close and remove the temporary file, e.g. if its contents turned out to be wrong.
+        """
+        self.cleanup()
+        try:
+            os.unlink(self.safename)
+        except OSError: # don't fail / worst case is spurious leftovers
+            pass
+
 import unittest
 
 class SingleFileTransactionTest(unittest.TestCase):
@@ -278,6 +389,29 @@ class SingleFileTransactionTest(unittest.TestCase):
         self.assertEqual(False, os.path.exists(self.testfilename))
         del self.t # make sure the destructor does not fail by calling it explicitly
 
+    def testResume(self):
+        t = ResumableFileTransaction('key', self.testdir)
+        safe = t.open(self.testfilename)
+        safe.write(self.teststring)
+        t.cleanup()
+        self.assertEqual(False, os.path.exists(self.testfilename))
+        # a new transaction with the same key picks up where the first one stopped
+        t = ResumableFileTransaction('key', self.testdir)
+        self.assertEqual(len(self.teststring), t.size())
+        safe = t.open(self.testfilename)
+        safe.write(self.teststring2)
+        t.commit()
+        self.assertEqual(self.teststring + self.teststring2, open(self.testfilename).read())
+        self.assertEqual(0, ResumableFileTransaction('key', self.testdir).size())
+
+    def testDiscard(self):
+        t = ResumableFileTransaction('key', self.testdir)
+        safe = t.open(self.testfilename)
+        safe.write(self.teststring)
+        t.discard()
+        self.assertEqual(0, ResumableFileTransaction('key', self.testdir).size())
+        self.assertEqual(False, os.path.exists(self.testfilename))
+
     def tearDown(self):
         shutil.rmtree(self.testdir)
 
@@ -285,4 +419,4 @@ if __name__ == "__main__":
     """
     test code
     """
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,82 @@
+"""
+Tests for the delegation of work.
+"""
+
+from angel_app import worker
+import os
+import unittest
+
+def triple(i):
+    "will raise an exception if i > 5"
+    if i > 5:
+        raise ValueError, "Test"
+    return i * 3
+
+def pid(i):
+    return os.getpid()
+
+class WorkerTest(unittest.TestCase):
+
+    def testThreadedWork(self):
+        res = worker.threadedwork(triple, range(10), 3)
+        assert sorted(res.keys()) == range(10)
+        for ii in range(6):
+            assert res[ii] == ii * 3
+        for ii in range(6, 10):
+            assert isinstance(res[ii], worker.WorkerError)
+            assert res[ii].type() == ValueError
+
+    def testThreadedWorkMatchesSerialWork(self):
+        items = range(5)
+        assert worker.threadedwork(triple, items) == worker.serialwork(triple, items)
+
+    def testPooledWork(self):
+        pool = worker.WorkerPool(3, 100)
+        try:
+            res = pool.run(triple, range(10), 3)
+            assert sorted(res.keys()) == range(10)
+            for ii in range(6):
+                assert res[ii] == ii * 3
+            for ii in range(6, 10):
+                assert isinstance(res[ii], worker.WorkerError)
+                assert res[ii].type() == ValueError
+            assert pool.completed == 10
+            assert pool.queued == 0
+        finally:
+            pool.close()
+
+    def testWorkersPersist(self):
+        pool = worker.WorkerPool(2, 100)
+        try:
+            first = set(pool.run(pid, range(6), 2).values())
+            second = set(pool.run(pid, range(6), 2).values())
+            assert os.getpid() not in first
+            assert first == second
+            assert pool.spawned == 2
+        finally:
+            pool.close()
+
+    def testWorkersRecycled(self):
+        pool = worker.WorkerPool(1, 2)
+        try:
+            pids = pool.run(pid, range(6), 1).values()
+            assert len(set(pids)) == 3
+            assert pool.spawned == 3
+        finally:
+            pool.close()
+
+    def testStart(self):
+        pool = worker.WorkerPool(2, 100)
+        try:
+            pool.start()
+            assert pool.spawned == 2
+            assert len(pool.run(pid, range(4), 2)) == 4
+            assert pool.spawned == 2
+        finally:
+            pool.close()
+
+    def testUnpicklableFunction(self):
+        assert worker.isPicklable(triple)
+        assert not worker.isPicklable(lambda i: i)
+        res = worker.forkedwork(lambda i: i * 2, range(3), 2)
+        assert res == {0 : 0, 1 : 2, 2 : 4}
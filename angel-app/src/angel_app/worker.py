@@ -5,14 +5,39 @@ of workers.
 For now, this code can 
 """
 
+import os
+import select
+import signal
+import struct
 import sys
+import threading
+import time
+import traceback
 from logging import getLogger
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 from angel_app.config.config import getConfig
 
 log = getLogger(__name__)
 cfg = getConfig()
 
+# the number of worker processes, unless configured otherwise
+POOL_SIZE = 6
+# the number of tasks after which a worker process is replaced, unless configured otherwise
+MAX_TASKS = 200
+# the program run by a worker process, see WorkerPool._spawn()
+WORKER_COMMAND = "import sys; from angel_app.config import config; config.getConfig(sys.argv[1]); " + \
+                 "from angel_app import worker; worker.serveWorker(sys.argv[2:])"
+# the file descriptors a worker process might inherit
+try:
+    MAXFD = os.sysconf("SC_OPEN_MAX")
+except (AttributeError, ValueError):
+    MAXFD = 256
+
 class WorkerError(object):
     """Class for passing on exceptions raised in worker processes."""
     def __init__(self, type, value, traceback = []):
@@ -30,7 +55,7 @@ class WorkerError(object):
         return self._value
 
 
-def dowork(function, items, children = 5):
+def dowork(function, items, children = 5, threadsafe = False):
     """
     High level method to delegate work to a function.
     This is essentially a hack to allow using optimized parallelization
@@ -39,17 +64,27 @@ def dowork(function, items, children = 5):
     @param function: a callable
     @param items: a list of things that should be passed individualy to function
     @param children: max children to be run in parallel at a time
+    @param threadsafe: whether function may be run concurrently in threads of this
+        process (rather than in forked children)
     """
     if len(items) < 1:
         return {}
+    elif len(items) > 1 and threadsafe and cfg.getboolean('common', 'workerthreading'):
+        return threadedwork(function, items, children)
     elif len(items) > 1 and cfg.getboolean('common', 'workerforking'):
         return forkedwork(function, items, children)
     else: # if only 1 item, do not fork()!
         return serialwork(function, items, children)
 
 def forkedwork(function, items, children = 5):
-    "run function on each member of items in parallel using fork()"  
+    """
+    run function on each member of items in parallel in the worker processes of the
+    WorkerPool, or in children forked for this call if function can't be pickled
+    """
     log.debug("forkedwork(): parallel execution with %i tasks (max %i)", len(items), children)
+    if isPicklable(function):
+        return getPool().run(function, items, children)
+    log.debug("forkedwork(): %r can't be passed to a worker process, forking", function)
     from angel_app.contrib import delegate
     resMap = delegate.parallelize(function, items, children)
     # map errors to our own wrapper (WorkerError)
@@ -58,6 +93,373 @@ def forkedwork(function, items, children = 5):
             resMap[k] = WorkerError(resMap[k].type, resMap[k].value, resMap[k].tbdump)
     return resMap
 
+def isPicklable(function):
+    """
+    @return whether the function can be passed to a worker process (e.g. a module level
+        function, but not a nested one)
+    """
+    try:
+        pickle.dumps(function, pickle.HIGHEST_PROTOCOL)
+        return True
+    except Exception:
+        return False
+
+def _send(fd, obj):
+    "write the pickled object to the file descriptor, preceded by its length"
+    data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    data = struct.pack("!I", len(data)) + data
+    while data:
+        data = data[os.write(fd, data):]
+
+def _receiveBytes(fd, length):
+    data = ""
+    while len(data) < length:
+        chunk = os.read(fd, length - len(data))
+        if chunk == "":
+            raise EOFError("worker pipe closed")
+        data += chunk
+    return data
+
+def _receive(fd):
+    "read an object written by _send() from the file descriptor"
+    (length,) = struct.unpack("!I", _receiveBytes(fd, 4))
+    return pickle.loads(_receiveBytes(fd, length))
+
+def _serve(reader, writer, maxTasks):
+    """
+    The main loop of a worker process: run the (function, item) tasks read from reader, and
+    write a tuple (result, retiring) for each to writer, where result is a WorkerError if 
+    the function raised an exception. The process exits after maxTasks tasks, or when 
+    the pool closes the pipe.
+    """
+    for count in range(1, maxTasks + 1):
+        try:
+            (function, item) = _receive(reader)
+        except EOFError:
+            return
+        try:
+            result = function(item)
+        except Exception, e:
+            result = WorkerError(type(e), e, traceback = traceback.format_tb(sys.exc_info()[2]))
+        retiring = count == maxTasks
+        try:
+            _send(writer, (result, retiring))
+        except Exception, e:
+            # e.g. the result can't be pickled
+            _send(writer, (WorkerError(type(e), str(e), traceback.format_tb(sys.exc_info()[2])), retiring))
+
+def serveWorker(args):
+    """
+    The main program of a worker process, see WORKER_COMMAND.
+    
+    @param args: the file descriptors to read the tasks from and to write the results to, and
+        the number of tasks after which to exit
+    """
+    from angel_app.log import initializeLogging
+    initializeLogging("worker", ["socket"])
+    (reader, writer, maxTasks) = [int(arg) for arg in args]
+    _serve(reader, writer, maxTasks)
+
+class _WorkerProcess(object):
+    """
+    A python style struct describing a worker process.
+    """
+    def __init__(self, pid, reader, writer):
+        self.pid = pid
+        # the ends of the pipes from and to the process
+        self.reader = reader
+        self.writer = writer
+        # the number of tasks sent to the process
+        self.tasks = 0
+
+class WorkerPool(object):
+    """
+    A pool of long-lived worker processes. Unlike delegate.parallelize, which forks new 
+    children for every call, the processes are started on demand (or all at once, see 
+    start()) and then kept, so their caches (connections, keys, remote properties, DNS) 
+    survive from one task to the next. Each process is replaced after maxTasks tasks, to 
+    bound its memory use.
+    
+    The processes run a fresh interpreter rather than a copy of this one, since this 
+    process may have other threads, which might hold locks at the time of the fork.
+    
+    Tasks are passed to the processes over a pipe, so the function, the items and the 
+    results must be picklable.
+    
+    Several threads may run tasks at the same time, each using the processes it has 
+    acquired from the pool.
+    """
+    def __init__(self, size = POOL_SIZE, maxTasks = MAX_TASKS):
+        """
+        @param size: the maximum number of worker processes
+        @param maxTasks: the number of tasks after which a worker process is replaced
+        """
+        self.size = size
+        self.maxTasks = maxTasks
+        self._condition = threading.Condition()
+        # the worker processes not in use
+        self._idle = []
+        # the number of worker processes alive
+        self._alive = 0
+        # the processes are those of the process that created them
+        self._pid = os.getpid()
+        # statistics
+        self.queued = 0
+        self.spawned = 0
+        self.completed = 0
+        self.taskTime = 0.0
+        self.maxTaskTime = 0.0
+
+    def run(self, function, items, children = 5):
+        """
+        Run function on each member of items, in at most children worker processes.
+        
+        @return a dictionary mapping each item to its result, or a WorkerError
+        """
+        self._condition.acquire()
+        try:
+            self.queued += len(items)
+        finally:
+            self._condition.release()
+        res = {}
+        todo = list(items)
+        # map from the reader of a busy worker process to (process, item, start time)
+        busy = {}
+        try:
+            while todo or busy:
+                while todo and len(busy) < children:
+                    process = self._acquire(len(busy) == 0)
+                    if process is None:
+                        break
+                    item = todo.pop(0)
+                    self._dequeued(1)
+                    try:
+                        _send(process.writer, (function, item))
+                        process.tasks += 1
+                        busy[process.reader] = (process, item, time.time())
+                    except Exception, e:
+                        # e.g. the item can't be pickled
+                        res[item] = WorkerError(type(e), e, traceback.format_tb(sys.exc_info()[2]))
+                        self._release(process, True)
+                if not busy:
+                    continue
+                (readable, dummywritable, dummyexceptional) = select.select(busy.keys(), [], [])
+                for reader in readable:
+                    (process, item, started) = busy.pop(reader)
+                    try:
+                        (result, retiring) = _receive(reader)
+                    except EOFError:
+                        result = WorkerError(RuntimeError, "worker process %d terminated abnormally" % process.pid)
+                        retiring = True
+                    res[item] = result
+                    self._done(time.time() - started)
+                    self._release(process, retiring)
+        finally:
+            # only on errors in this process, e.g. KeyboardInterrupt
+            for (process, dummyitem, dummystarted) in busy.values():
+                self._release(process, True, True)
+            self._dequeued(len(todo))
+        return res
+
+    def _dequeued(self, count):
+        self._condition.acquire()
+        try:
+            self.queued -= count
+        finally:
+            self._condition.release()
+
+    def _done(self, duration):
+        self._condition.acquire()
+        try:
+            self.completed += 1
+            self.taskTime += duration
+            self.maxTaskTime = max(self.maxTaskTime, duration)
+        finally:
+            self._condition.release()
+
+    def _acquire(self, wait):
+        """
+        @param wait: whether to wait for a worker process if all of them are in use
+        @return an idle worker process (forking a new one if there are less than size), None if
+            there is none and wait is False
+        """
+        self._condition.acquire()
+        try:
+            if self._pid != os.getpid():
+                # we're a forked child, the processes belong to the parent
+                self._idle = []
+                self._alive = 0
+                self._pid = os.getpid()
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._alive < self.size:
+                    self._alive += 1
+                    break
+                if not wait:
+                    return None
+                self._condition.wait()
+        finally:
+            self._condition.release()
+        try:
+            return self._spawn()
+        except:
+            self._condition.acquire()
+            try:
+                self._alive -= 1
+            finally:
+                self._condition.release()
+            raise
+
+    def start(self):
+        """
+        Start all of the worker processes right away, rather than on demand.
+        """
+        while True:
+            self._condition.acquire()
+            try:
+                if self._alive >= self.size:
+                    return
+                self._alive += 1
+            finally:
+                self._condition.release()
+            try:
+                process = self._spawn()
+            except:
+                self._release(None, True)
+                raise
+            self._release(process, False)
+
+    def _release(self, process, retire, kill = False):
+        """
+        Return the process to the pool, or end it if retire is True.
+        
+        @param process: the process, None if it could not be started
+        @param kill: whether to kill the process rather than wait for it to finish its task
+        """
+        retire = retire or process.tasks >= self.maxTasks
+        self._condition.acquire()
+        try:
+            if retire:
+                self._alive -= 1
+            else:
+                self._idle.append(process)
+            self._condition.notify()
+        finally:
+            self._condition.release()
+        if retire and process is not None:
+            self._end(process, kill)
+
+    def _spawn(self):
+        childread, parentwrite = os.pipe()
+        parentread, childwrite = os.pipe()
+        command = [sys.executable, "-c", WORKER_COMMAND, cfg.configfilename,
+                   str(childread), str(childwrite), str(self.maxTasks)]
+        environment = dict(os.environ)
+        environment["PYTHONPATH"] = os.pathsep.join([os.path.abspath(path) for path in sys.path])
+        (low, high) = sorted((childread, childwrite))
+        pid = os.fork()
+        if pid == 0:
+            # nothing but system calls up to the exec, see the class documentation. The pipes are 
+            # the only file descriptors passed on, other processes would never see the end of file
+            # of their pipes while this one is alive.
+            try:
+                os.closerange(3, low)
+                os.closerange(low + 1, high)
+                os.closerange(high + 1, MAXFD)
+                os.execve(sys.executable, command, environment)
+            finally:
+                os._exit(1)
+        os.close(childread)
+        os.close(childwrite)
+        self._condition.acquire()
+        try:
+            self.spawned += 1
+        finally:
+            self._condition.release()
+        log.debug("started worker process %d", pid)
+        return _WorkerProcess(pid, parentread, parentwrite)
+
+    def _end(self, process, kill = False):
+        """
+        End the worker process, and wait for it to exit. Must be called without holding the
+        condition.
+        """
+        if kill:
+            try:
+                os.kill(process.pid, signal.SIGTERM)
+            except OSError:
+                pass
+        os.close(process.writer)
+        os.close(process.reader)
+        try:
+            os.waitpid(process.pid, 0)
+        except OSError:
+            pass
+
+    def close(self):
+        """
+        End the idle worker processes.
+        """
+        self._condition.acquire()
+        try:
+            idle = self._idle
+            self._idle = []
+            self._alive -= len(idle)
+        finally:
+            self._condition.release()
+        for process in idle:
+            self._end(process)
+
+    def __str__(self):
+        meanTime = 0.0
+        if self.completed > 0:
+            meanTime = self.taskTime / self.completed
+        return "WorkerPool(processes: %d, idle: %d, queued: %d, spawned: %d, completed: %d, mean time: %.2f sec, max time: %.2f sec)" % \
+            (self._alive, len(self._idle), self.queued, self.spawned, self.completed, meanTime, self.maxTaskTime)
+
+
+pool = None # holder for the process-wide WorkerPool
+def getPool():
+    """
+    Implements a singleton for getting the process-wide WorkerPool.
+
+    @return: WorkerPool instance
+    """
+    global pool
+    if pool is None:
+        pool = WorkerPool(cfg.getint('common', 'workerprocesses'), cfg.getint('common', 'workerprocesstasks'))
+    return pool
+
+def threadedwork(function, items, children = 5):
+    "run function on each member of items in parallel using a pool of threads"
+    log.debug("threadedwork(): parallel execution with %i tasks (max %i threads)", len(items), children)
+    import Queue
+    import threading
+    import traceback
+    todo = Queue.Queue()
+    for item in items:
+        todo.put(item)
+    res = {}
+    def work():
+        while True:
+            try:
+                item = todo.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                result = function(item)
+            except Exception, e:
+                result = WorkerError(type(e), e, traceback = traceback.format_tb(sys.exc_info()[2]))
+            res[item] = result # assignment of a single dict item is atomic
+    threads = [threading.Thread(target = work) for dummyii in range(min(children, len(items)))]
+    for thread in threads:
+        thread.setDaemon(True)
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return res
+
 def serialwork(function, items, children = 5):
     "run function on each member of items in a serial fashion"
     log.debug("serialwork(): sequential execution for %i tasks", len(items))
@@ -67,7 +469,7 @@ def serialwork(function, items, children = 5):
         try:
             res[item] = function(item)
         except Exception, e:
-            res[item] = WorkerError(type(e), e, traceback = traceback.format_tb(sys.exc_traceback))
+            res[item] = WorkerError(type(e), e, traceback = traceback.format_tb(sys.exc_info()[2]))
     return res
 
 def main():
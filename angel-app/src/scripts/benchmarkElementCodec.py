@@ -0,0 +1,41 @@
+"""
+Utility script to compare the size and the decoding speed of the compact element
+encoding with pickles, for Children elements of various sizes. Since the children
+are materialized lazily, the time to decode and access them is given as well.
+"""
+
+import cPickle
+import time
+
+from angel_app.resource.local import elementCodec
+from angel_app.resource.local.test.elementCodecTest import makeChildren
+
+def decodeAndMaterialize(data):
+    return elementCodec.decode(data).children
+
+def timeDecode(decode, data, repeat):
+    start = time.time()
+    for dummyii in xrange(repeat):
+        decode(data)
+    return (time.time() - start) / repeat
+
+if __name__ == "__main__":
+    print "%8s %10s %10s %10s %12s %12s %12s %12s %8s" % ("children", "compact", "pickle", "pickle(0)",
+                                                          "compact/ms", "accessed/ms", "pickle/ms", "pickle(0)/ms",
+                                                          "speedup")
+    for count in [10, 100, 1000, 10000]:
+        children = makeChildren(count)
+        compact = elementCodec.encode(children)
+        pickled = cPickle.dumps(children, cPickle.HIGHEST_PROTOCOL)
+        # as stored by the DirectoryDeadProperties of older versions
+        pickled0 = cPickle.dumps(children)
+        repeat = max(1, 10000 / count)
+        tCompact = timeDecode(elementCodec.decode, compact, repeat)
+        tAccessed = timeDecode(decodeAndMaterialize, compact, repeat)
+        tPickle = timeDecode(cPickle.loads, pickled, repeat)
+        tPickle0 = timeDecode(cPickle.loads, pickled0, repeat)
+        # the speedup if the children are accessed
+        print "%8d %10d %10d %10d %12.3f %12.3f %12.3f %12.3f %7.1fx" % (count, len(compact), len(pickled), len(pickled0),
+                                                                       tCompact * 1000, tAccessed * 1000,
+                                                                       tPickle * 1000, tPickle0 * 1000,
+                                                                       tPickle / tAccessed)
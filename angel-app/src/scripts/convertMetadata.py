@@ -0,0 +1,11 @@
+"""
+Utility script to copy the metadata of all resources from the metadata directory
+tree into the sqlite data base (for common.metadatastore = sqlite). Run it while
+angel-app is not running.
+"""
+
+from angel_app.resource.local import SqliteDeadProperties
+
+if __name__ == "__main__":
+    count = SqliteDeadProperties.convert()
+    print "converted %d properties into %s" % (count, SqliteDeadProperties.getDatabase().path)
@@ -1,15 +1,38 @@
 """
-Utility script to force inspect a local resource
+Utility script to force inspect a local resource, and all resources below it.
+The resources are inspected concurrently, see maintainer.maxinspections.
+
+With --async, the resources are inspected on the Twisted reactor instead, see 
+maintainer.asyncUpdate.
+
+Usage: inspectResource.py [--async] [path relative to the repository root]
 """
 
-import angel_app.resource.remote.client
+import os
+import sys
 
 import angel_app.log
 angel_app.log.initializeLogging('inspectResource', ['console'])
 
 from angel_app.config import config
+from angel_app.maintainer import client
+from angel_app.resource.local.resourceHandle import ResourceHandle
 AngelConfig = config.getConfig()
 repository = AngelConfig.get("common", "repository")
-            
+
 if __name__ == "__main__":
-    angel_app.resource.remote.client.inspectResource(repository + "/MISSION ETERNITY")
+    args = [arg for arg in sys.argv[1:] if arg != "--async"]
+    relativePath = "MISSION ETERNITY"
+    if len(args) > 0:
+        relativePath = args[0]
+    root = ResourceHandle(os.path.join(repository, relativePath.lstrip(os.sep)))
+    if "--async" in sys.argv[1:]:
+        from twisted.internet import reactor
+        from angel_app.maintainer import asyncUpdate
+        def inspect():
+            inspecting = asyncUpdate.inspectTree(root)
+            inspecting.addBoth(lambda dummy: reactor.stop())
+        reactor.callWhenRunning(inspect)
+        reactor.run()
+    else:
+        client.inspectTree(root, client.getInspector())
@@ -0,0 +1,55 @@
+"""
+Utility script to summarize the contents of the local repository, as recorded in
+the repository index. With --rebuild, the index is rebuilt from the repository first.
+The replication levels are those found by the maintainer, see maintainer.schedule.
+"""
+
+import sys
+import time
+
+from angel_app.config import config
+from angel_app.maintainer.schedule import getSchedule
+from angel_app.resource.local.basic import Basic
+from angel_app.resource.local.repositoryIndex import getRepositoryIndex
+
+AngelConfig = config.getConfig()
+repository = AngelConfig.get("common", "repository")
+
+if __name__ == "__main__":
+    index = getRepositoryIndex()
+    if index is None:
+        print "The repository index is disabled (common.repositoryindex)."
+        sys.exit(1)
+    if "--rebuild" in sys.argv[1:]:
+        index.rebuild(Basic(repository))
+
+    entries = index.entries()
+    byKey = {}
+    for entry in entries:
+        byKey.setdefault(entry.keyUUID, []).append(entry)
+    print "%d resources, %d bytes" % (len(entries), index.totalSize())
+    for (keyUUID, keyEntries) in byKey.items():
+        print "key %s: %d resources, %d bytes" % (keyUUID, len(keyEntries), index.totalSize(keyUUID))
+
+    day = 24 * 3600
+    now = time.time()
+    neverValidated = [entry for entry in entries if entry.validated is None]
+    print "%d resources never validated" % len(neverValidated)
+    print "%d resources not validated in the last day" % len(index.entries(validatedBefore = now - day))
+    print "%d resources with less than two known clones" % len([entry for entry in entries if len(entry.clones) < 2])
+
+    schedule = getSchedule()
+    if schedule is not None:
+        print "replication levels (distinct good clones on other nodes, target %d):" % schedule.replicationTarget
+        levels = schedule.replicationLevels().items()
+        levels.sort()
+        for (level, count) in levels:
+            if level is None:
+                print "  not inspected yet: %d resources" % count
+            else:
+                print "  %d: %d resources" % (level, count)
+        underReplicated = schedule.underReplicated()
+        print "%d resources below the replication target" % len(underReplicated)
+        for entry in underReplicated[:20]:
+            print "  %s: %d good, %d old, %d unreachable, %d bad clones" % \
+                (entry.path, entry.goodClones, entry.oldClones or 0, entry.unreachableClones or 0, entry.badClones or 0)